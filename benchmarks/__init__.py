@@ -0,0 +1 @@
+"""Офлайн-бенчмарки горячего пути: t.me → парсер → отправка в Bot API"""
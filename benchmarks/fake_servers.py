@@ -0,0 +1,245 @@
+"""Локальные подмены t.me и Bot API для офлайн-бенчмарков"""
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeServer:
+    """HTTP-сервер на свободном порту 127.0.0.1 в фоновом потоке"""
+
+    def __init__(self, handler: Callable):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят отдельными send(): без TCP_NODELAY keep-alive ждет delayed ACK ~40 мс
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                handler(server, self)
+
+            def do_POST(self):
+                handler(server, self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address
+        return f'http://{host}:{port}'
+
+    @property
+    def host(self) -> str:
+        return urlparse(self.url).netloc
+
+    def start(self) -> 'FakeServer':
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fake-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    @staticmethod
+    def reply(request: BaseHTTPRequestHandler, status: int, body: bytes = b'',
+              content_type: str = 'application/json', headers: Optional[Dict[str, str]] = None):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.end_headers()
+        if body:
+            request.wfile.write(body)
+
+
+class FakeTelegramWeb(FakeServer):
+    """Отдает /s/<канал> из фикстур, поддерживает If-None-Match (304).
+
+    delays — искусственная задержка ответа по каналам, в секундах.
+    """
+
+    def __init__(self, pages: Dict[str, bytes]):
+        super().__init__(self.handle)
+        self.pages = pages
+        self.delays = {}
+        self.etags = {username: f'"{hashlib.sha1(page).hexdigest()}"' for username, page in pages.items()}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.not_modified = 0
+        # (time.monotonic(), канал) каждого запроса страницы канала
+        self.fetches = []
+
+    def handle(self, server, request: BaseHTTPRequestHandler):
+        path = urlparse(request.path).path
+        username = path[len('/s/'):] if path.startswith('/s/') else None
+        with self.lock:
+            self.requests += 1
+        if username not in self.pages:
+            self.reply(request, 404, b'not found', 'text/plain')
+            return
+        with self.lock:
+            self.fetches.append((time.monotonic(), username))
+        delay = self.delays.get(username)
+        if delay:
+            time.sleep(delay)
+        etag = self.etags[username]
+        if request.headers.get('If-None-Match') == etag:
+            with self.lock:
+                self.not_modified += 1
+            self.reply(request, 304, headers={'ETag': etag})
+            return
+        self.reply(request, 200, self.pages[username], 'text/html; charset=utf-8', {'ETag': etag})
+
+
+def png(seed: str, size: int = 32) -> bytes:
+    """Детерминированная серая PNG-картинка из шума: разные seed дают далекие dHash"""
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + bytes(rng.randrange(256) for _ in range(size)) for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows)) + chunk(b'IEND', b'')
+
+
+class FakeCDN(FakeServer):
+    """Отдает превью вместо cdn*.telesco.pe: своя картинка на каждый путь"""
+
+    def __init__(self):
+        super().__init__(self.handle)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def handle(self, server, request: BaseHTTPRequestHandler):
+        with self.lock:
+            self.requests += 1
+        self.reply(request, 200, png(urlparse(request.path).path), 'image/png')
+
+
+class FakeBotAPI(FakeServer):
+    """Bot API, который отвечает успехом на любой метод и записывает вызовы.
+
+    Чатам из blocked отвечает 403, как пользователям, заблокировавшим бота.
+    getUpdates отдает обновления из push_updates с long polling, как Telegram.
+    """
+
+    def __init__(self):
+        super().__init__(self.handle)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.listeners = []
+        self.message_id = 0
+        self.blocked = set()
+        self.updates = []
+        self.updates_ready = threading.Condition()
+
+    def handle(self, server, request: BaseHTTPRequestHandler):
+        received = time.perf_counter()
+        parsed = urlparse(request.path)
+        method = parsed.path.rsplit('/', 1)[-1]
+        params = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        length = int(request.headers.get('Content-Length') or 0)
+        body = request.rfile.read(length) if length else b''
+        if body and request.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+
+        call = {'time': received, 'method': method, 'chat_id': params.get('chat_id'), 'params': params}
+        with self.lock:
+            self.calls.append(call)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(call)
+        if call['chat_id'] in self.blocked:
+            body = {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+            self.reply(request, 403, json.dumps(body).encode('utf-8'))
+            return
+        self.reply(request, 200, json.dumps({'ok': True, 'result': self.result(method, params)}).encode('utf-8'))
+
+    def next_message(self, params: Dict) -> Dict:
+        with self.lock:
+            self.message_id += 1
+            message_id = self.message_id
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'CatBot'}
+        }
+
+    def push_updates(self, updates: List[Dict]):
+        """Добавляет обновления для getUpdates и будит ждущие запросы"""
+        with self.updates_ready:
+            self.updates.extend(updates)
+            self.updates_ready.notify_all()
+
+    def get_updates(self, params: Dict) -> List[Dict]:
+        """Обновления с update_id >= offset; без них запрос ждет до timeout секунд"""
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        deadline = time.monotonic() + float(params.get('timeout') or 0)
+        with self.updates_ready:
+            # offset подтверждает все обновления до него
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            while not self.updates and time.monotonic() < deadline:
+                self.updates_ready.wait(deadline - time.monotonic())
+            return self.updates[:limit]
+
+    def result(self, method: str, params: Dict):
+        """Правдоподобный ответ: сообщения с file_id для медиа, True для служебных методов"""
+        if method == 'getUpdates':
+            return self.get_updates(params)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'CatBot', 'username': 'cat_bot'}
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media') or '[]')
+            return [self.with_photo(self.next_message(params)) for _ in media]
+        if method == 'sendPhoto':
+            return self.with_photo(self.next_message(params))
+        if method == 'sendVideo':
+            message = self.next_message(params)
+            message['video'] = {
+                'file_id': f'video{message["message_id"]}', 'file_unique_id': f'v{message["message_id"]}',
+                'width': 720, 'height': 480, 'duration': 10
+            }
+            return message
+        if method.startswith(('send', 'edit')):
+            message = self.next_message(params)
+            message['text'] = params.get('text', '')
+            return message
+        return True
+
+    @staticmethod
+    def with_photo(message: Dict) -> Dict:
+        message['photo'] = [{
+            'file_id': f'photo{message["message_id"]}', 'file_unique_id': f'p{message["message_id"]}',
+            'width': 800, 'height': 600
+        }]
+        return message
+
+    def subscribe(self, listener: Callable[[Dict], None]):
+        """Вызывает listener для каждого следующего вызова API"""
+        with self.lock:
+            self.listeners.append(listener)
+
+    def reset(self) -> List[Dict]:
+        """Возвращает записанные вызовы и очищает журнал"""
+        with self.lock:
+            calls, self.calls = self.calls, []
+            self.listeners = []
+            return calls
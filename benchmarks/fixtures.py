@@ -0,0 +1,219 @@
+"""Страницы t.me/s/<канал> для бенчмарков.
+
+Записанные страницы лежат в benchmarks/fixtures/<размер>/<канал>.html. Каналу
+бенчмарка достается одна из записей своего размера (по хэшу имени), а имя
+записанного канала в ней заменяется на его имя. Без записей страница
+генерируется детерминированно в разметке t.me.
+
+Запись живого канала (medium и large собираются из истории через ?before=):
+    python -m benchmarks.fixtures record cats_yalta small
+"""
+import os
+import random
+import sys
+import zlib
+from datetime import datetime, timedelta, timezone
+from html import escape
+
+import requests
+from bs4 import BeautifulSoup
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Число сообщений на странице: t.me отдает ~20, крупные страницы проверяют масштабирование
+SIZES = {'small': 20, 'medium': 100, 'large': 400}
+
+ADOPTION_TEXTS = [
+    'Котенок {name} ищет дом! Возраст {age} месяца, {sex}, {color} окрас. Здоров, привит, приучен к лотку. '
+    'Звоните +7 978 {phone} или пишите @volunteer{n}',
+    'Срочно! Кошка {name} потерялась в районе набережной, {color}, очень ласковая. '
+    'Нашедших просим позвонить: +7 978 {phone}',
+    'Ищет дом взрослый кот {name}, {age} года, кастрирован. Спокойный, любит детей. '
+    'Контакты: @cats_helper{n}, +7 978 {phone}',
+    'Пристраиваем котят от уличной кошки: {age} котенка, {color}. Отдаем в добрые руки, '
+    'помощь с кормом и стерилизацией. Пишите @yalta_cats{n}'
+]
+OFFTOPIC_TEXTS = [
+    'Спасибо всем, кто помог собрать на лечение! Отчет о расходах будет завтра.',
+    'Напоминаем: субботник в приюте в это воскресенье в 10:00, нужны перчатки и мешки.'
+]
+NAMES = ['Мурзик', 'Барсик', 'Пушок', 'Рыжик', 'Снежок', 'Маруся', 'Соня', 'Тигра']
+COLORS = ['рыжий', 'черный', 'серый полосатый', 'трехцветный', 'белый']
+
+
+def random_text(rng: random.Random) -> str:
+    """Текст сообщения канала: чаще объявление, иногда посторонняя новость"""
+    if rng.random() < 0.15:
+        return rng.choice(OFFTOPIC_TEXTS)
+    return rng.choice(ADOPTION_TEXTS).format(
+        name=rng.choice(NAMES), age=rng.randint(2, 5), sex=rng.choice(['мальчик', 'девочка']),
+        color=rng.choice(COLORS), phone=f'{rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}',
+        n=rng.randint(1, 50)
+    )
+
+
+DISTRICTS = [
+    'набережной', 'Массандры', 'Ливадии', 'Гаспры', 'Никиты', 'Кореиза', 'Алупки', 'Гурзуфа', 'Симеиза',
+    'автовокзала', 'рынка', 'Пушкинской', 'Киевской', 'Московской', 'Садовой', 'Боткинской', 'Дражинского'
+]
+TRAITS = [
+    'ласковый', 'игривый', 'спокойный', 'пугливый', 'общительный', 'любит детей', 'ладит с собаками',
+    'мурчит на руках', 'приучен к когтеточке', 'ест сухой корм', 'любит спать у окна', 'не боится пылесоса',
+    'ходит за хозяином', 'любит гулять на шлейке', 'очень умный', 'немного застенчивый', 'просится на руки'
+]
+HEALTH = ['привит', 'обработан от паразитов', 'стерилизован', 'здоров', 'есть ветпаспорт', 'чипирован']
+STORIES = [
+    'Нашли у подъезда в дождь.', 'Жил в подвале с мамой-кошкой.', 'Хозяева уехали и оставили.',
+    'Подобрали на трассе.', 'Выходили после травмы лапы.', 'Прибился к кафе на набережной.',
+    'Сидел под машиной два дня.', 'Вырос на передержке.'
+]
+
+
+def random_ad(rng: random.Random) -> str:
+    """Разнообразное объявление для корпусов из тысяч постов"""
+    parts = [
+        f"{rng.choice(['Котенок', 'Кот', 'Кошка', 'Кошечка', 'Котик'])} {rng.choice(NAMES)} "
+        f"из района {rng.choice(DISTRICTS)} ищет дом!",
+        rng.choice(STORIES),
+        f"Возраст {rng.randint(1, 11)} {rng.choice(['месяцев', 'лет'])}, {rng.choice(['мальчик', 'девочка'])}, "
+        f"{rng.choice(COLORS)} окрас.",
+        'Характер: ' + ', '.join(rng.sample(TRAITS, 3)) + '.',
+        ', '.join(rng.sample(HEALTH, rng.randint(1, 3))).capitalize() + '.',
+        f"Звоните +7 978 {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}"
+    ]
+    return ' '.join(parts)
+
+
+def short_ad(rng: random.Random) -> str:
+    """Короткое объявление в пару строк: шинглов меньше, чем ячеек MinHash"""
+    return (
+        f"{rng.choice(['Котенок', 'Кот', 'Кошка'])} {rng.choice(NAMES)} ищет дом, звоните "
+        f"+7 978 {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}"
+    )
+
+
+def repost_text(rng: random.Random, text: str) -> str:
+    """Перепост: тот же текст с пометкой, хэштегом или сокращенным хвостом"""
+    variant = rng.random()
+    if variant < 0.3:
+        return text
+    if variant < 0.55:
+        return f"Репост! {text}"
+    if variant < 0.8:
+        return f"{text} #ялта #котики"
+    return text.rsplit(' Звоните', 1)[0]
+
+
+def render_message(username: str, msg_id: int, text: str, when: datetime,
+                   photo: bool = False, video: bool = False) -> str:
+    """Одно сообщение в разметке виджета t.me"""
+    media = ''
+    if photo:
+        media = (
+            f'<a class="tgme_widget_message_photo_wrap blured" href="https://t.me/{username}/{msg_id}" '
+            f'style="width:800px;background-image:url(\'https://cdn4.telesco.pe/file/{username}_{msg_id}.jpg\')"></a>'
+        )
+    elif video:
+        media = (
+            f'<div class="tgme_widget_message_video_wrap" '
+            f'style="width:720px;background-image:url(\'https://cdn4.telesco.pe/file/{username}_{msg_id}_thumb.jpg\')">'
+            f'<video class="tgme_widget_message_video" src="https://cdn4.telesco.pe/file/{username}_{msg_id}.mp4"></video></div>'
+        )
+    return (
+        f'<div class="tgme_widget_message_wrap js-widget_message_wrap">'
+        f'<div class="tgme_widget_message text_not_supported_wrap js-widget_message" data-post="{username}/{msg_id}">'
+        f'<div class="tgme_widget_message_user"><a href="https://t.me/{username}"></a></div>'
+        f'<div class="tgme_widget_message_bubble">{media}'
+        f'<div class="tgme_widget_message_text js-message_text" dir="auto">{escape(text).replace(". ", ".<br/>")}</div>'
+        f'<div class="tgme_widget_message_footer compact js-message_footer">'
+        f'<div class="tgme_widget_message_info short js-message_info">'
+        f'<span class="tgme_widget_message_views">{msg_id % 997 + 100}</span>'
+        f'<span class="tgme_widget_message_meta"><a class="tgme_widget_message_date" href="https://t.me/{username}/{msg_id}">'
+        f'<time datetime="{when.isoformat()}" class="time">{when:%H:%M}</time></a></span>'
+        f'</div></div></div></div></div>'
+    )
+
+
+def wrap_page(messages: str) -> bytes:
+    """Обертка страницы канала вокруг разметки сообщений"""
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Telegram</title></head><body>'
+        '<main class="tgme_main"><section class="tgme_channel_history js-message_history">'
+        + messages +
+        '</section></main></body></html>'
+    ).encode('utf-8')
+
+
+def render_page(username: str, count: int, first_id: int = 1000, seed: int = 0) -> bytes:
+    """Синтетическая страница канала: сообщения от старых к новым, как на t.me"""
+    rng = random.Random(f'{username}:{count}:{seed}')
+    started = datetime(2025, 8, 1, 9, 0, tzinfo=timezone.utc)
+    messages = []
+    for index in range(count):
+        msg_id = first_id + index
+        text = random_text(rng)
+        kind = rng.random()
+        messages.append(render_message(
+            username, msg_id, text, started + timedelta(minutes=37 * index),
+            photo=kind < 0.6, video=0.6 <= kind < 0.75
+        ))
+    return wrap_page(''.join(messages))
+
+
+def recorded_pages(size: str) -> list:
+    directory = os.path.join(FIXTURES_DIR, size)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len('.html')] for name in os.listdir(directory) if name.endswith('.html'))
+
+
+def load_page(username: str, size: str) -> bytes:
+    """Записанная страница размера size (под именем username) или сгенерированная на лету"""
+    recorded = recorded_pages(size)
+    if not recorded:
+        return render_page(username, SIZES[size])
+    source = recorded[zlib.crc32(username.encode('utf-8')) % len(recorded)]
+    with open(os.path.join(FIXTURES_DIR, size, f'{source}.html'), 'rb') as f:
+        page = f.read()
+    # data-post="канал/номер" и ссылки t.me/канал/номер должны указывать на канал бенчмарка
+    for prefix in (b'"', b'/'):
+        page = page.replace(prefix + source.encode('utf-8') + b'/', prefix + username.encode('utf-8') + b'/')
+    return page
+
+
+def record(username: str, size: str):
+    """Сохраняет сообщения канала с t.me как фикстуру размера size (не меньше SIZES[size] сообщений)"""
+    chunks = []
+    count = 0
+    before = None
+    while count < SIZES[size]:
+        response = requests.get(
+            f'https://t.me/s/{username}', params={'before': before} if before else None, timeout=15
+        )
+        response.raise_for_status()
+        wraps = BeautifulSoup(response.content, 'html.parser').select('.tgme_widget_message_wrap')
+        ids = [
+            int(node['data-post'].rsplit('/', 1)[1])
+            for node in (wrap.select_one('.tgme_widget_message[data-post]') for wrap in wraps) if node
+        ]
+        if not ids:
+            break
+        # Более старые страницы идут перед уже собранными: на t.me сообщения от старых к новым
+        chunks.insert(0, ''.join(str(wrap) for wrap in wraps))
+        count += len(wraps)
+        before = min(ids)
+        if before <= 1:
+            break
+    directory = os.path.join(FIXTURES_DIR, size)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{username}.html')
+    page = wrap_page(''.join(chunks))
+    with open(path, 'wb') as f:
+        f.write(page)
+    print(f'💾 {path}: {count} сообщений, {len(page)} байт')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'record' or sys.argv[3] not in SIZES:
+        sys.exit(f'usage: python -m benchmarks.fixtures record <channel> <{"|".join(SIZES)}>')
+    record(sys.argv[2], sys.argv[3])
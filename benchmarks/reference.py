@@ -0,0 +1,86 @@
+"""Прежние реализации горячих мест — точка «до» в сценариях «до/после».
+
+Код перенесен из main.py без изменений логики; бот его не использует.
+"""
+import re
+
+
+# Извлечение полей поста до TextExtractor: четыре прохода и регулярки, собираемые при каждом вызове
+def extract_title(text: str) -> str:
+    lines = text.split('\n')
+    for line in lines[:3]:
+        line = line.strip()
+        if line and len(line) > 5:
+            title = re.sub(r'[^\w\s\-\.,!?а-яёА-ЯЁ]', '', line)
+            if len(title) > 50:
+                title = title[:50] + "..."
+            return title or "Котик ищет дом"
+    return "Котик ищет дом"
+
+
+def extract_description(text: str) -> str:
+    clean_text = re.sub(r'@\w+|https?://\S+|\+?\d[\d\s\-\(\)]+', '', text)
+    clean_text = re.sub(r'\s+', ' ', clean_text).strip()
+    if len(clean_text) > 200:
+        return clean_text[:200] + "..."
+    return clean_text or "Подробности в посте"
+
+
+def extract_contact(text: str) -> str:
+    phone_pattern = r'\+?[78][\s\-]?\(?9\d{2}\)?\s?[\d\s\-]{7,10}'
+    phones = re.findall(phone_pattern, text)
+
+    username_pattern = r'@\w+'
+    usernames = re.findall(username_pattern, text)
+
+    contacts = []
+    if phones:
+        contacts.extend(phones[:1])
+    if usernames:
+        contacts.extend(usernames[:1])
+
+    return ' • '.join(contacts) if contacts else "См. в группе"
+
+
+def is_animal_related(text: str) -> bool:
+    animal_keywords = [
+        'кот', 'кошк', 'котен', 'котик', 'мурз', 'мяу',
+        'пристрой', 'дом', 'питомец', 'стерил', 'прививк',
+        'потерял', 'нашел', 'пропал', 'найден', 'потеряшка'
+    ]
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in animal_keywords)
+
+
+FIELDS = ('title', 'description', 'contact', 'relevant')
+
+
+def extract_fields(text: str) -> dict:
+    """Поля FIELDS, как их возвращает TextExtractor.extract, прежними функциями"""
+    return {
+        'title': extract_title(text),
+        'description': extract_description(text),
+        'contact': extract_contact(text),
+        'relevant': is_animal_related(text)
+    }
+
+
+# Пост до Post: словарь из 14 ключей, название и адрес канала копируются в каждый пост
+def post_dict(post_id: str, text: str, date_str: str, timestamp: float, fields: dict,
+              photo_url, video_url, channel: dict) -> dict:
+    return {
+        'id': post_id,
+        'text': text,
+        'date': date_str,
+        'timestamp': timestamp,
+        'url': f"{channel['url']}/{post_id}" if post_id else channel['url'],
+        'title': fields['title'],
+        'description': fields['description'],
+        'contact': fields['contact'],
+        'photo_url': photo_url,
+        'video_url': video_url,
+        'has_media': bool(photo_url or video_url),
+        'type': channel['type'],
+        'channel': channel['title'],
+        'channel_url': channel['url']
+    }
@@ -0,0 +1,1158 @@
+"""Офлайн-бенчмарк горячего пути бота против локальных t.me и Bot API.
+
+    python -m benchmarks.run                                  # все сценарии
+    python -m benchmarks.run --only cold_refresh warm_refresh
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json   # код 1 при регрессии
+
+Для каждого сценария печатаются пропускная способность, p50/p99 задержки
+и пик выделенной памяти (tracemalloc, отдельный прогон).
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from benchmarks import reference
+from benchmarks.fake_servers import FakeBotAPI, FakeCDN, FakeTelegramWeb
+from benchmarks.fixtures import SIZES, load_page, random_ad, random_text, repost_text, short_ad
+
+SCENARIOS = {}
+
+# Метрики, рост которых — улучшение; остальные (задержки, память) должны падать
+HIGHER_IS_BETTER = {'throughput'}
+COMPARED_METRICS = ('throughput', 'p50_ms', 'p99_ms', 'alloc_peak_kib')
+
+
+def scenario(name: str):
+    """Регистрирует сценарий; он возвращает словарь {имя результата: метрики}"""
+    def decorator(func: Callable):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def traced_peak_kib(func: Callable) -> float:
+    """Пик памяти, выделенной за вызов func (в КиБ)"""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def summarize(latencies: List[float], units: float, elapsed: float, alloc_peak_kib: float, **extra) -> Dict:
+    return {
+        'iterations': len(latencies),
+        'throughput': round(units / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'alloc_peak_kib': alloc_peak_kib,
+        **extra
+    }
+
+
+class Environment:
+    """Фейковые серверы, временное хранилище и переменные окружения для main"""
+
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix='catbot-bench-')
+        self.usernames = [f'bench_{index}' for index in range(args.channels)]
+        self.web = FakeTelegramWeb({u: load_page(u, args.page_size) for u in self.usernames}).start()
+        self.api = FakeBotAPI().start()
+        self.databases = 0
+
+        os.environ.update({
+            'TOKEN': '123456:BENCHMARK',
+            'TELEGRAM_WEB_URL': self.web.url,
+            'CHANNELS_CONFIG': self.write_channels('channels.json', self.usernames, self.web),
+            'PARSER_MAX_WORKERS': str(args.workers),
+            'UPDATE_QUEUE_SIZE': str(max(500, args.users)),
+            'STATS_FLUSH_INTERVAL': '3600',
+            # Превью фикстур лежат на настоящем CDN; сценарий images подменяет его своим
+            'DEDUP_IMAGES': '0'
+        })
+        if not args.real_limits:
+            # Без лимитов Telegram замер показывает стоимость кода, а не паузы ведер
+            os.environ.update({
+                'SEND_GLOBAL_RATE': '1000000', 'SEND_CHAT_RATE': '1000000', 'SEND_CHAT_BURST': '1000000',
+                'FANOUT_RATE': '1000000'
+            })
+
+        import telebot
+        import main
+        telebot.apihelper.API_URL = f'{self.api.url}/bot{{0}}/{{1}}'
+        if not args.verbose:
+            logging.getLogger('main').setLevel(logging.WARNING)
+            logging.getLogger('TeleBot').setLevel(logging.CRITICAL)
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        self.main = main
+
+    def write_channels(self, name: str, usernames: List[str], web: FakeTelegramWeb,
+                       hosts: Optional[Dict[str, Dict]] = None) -> str:
+        """Конфигурация каналов для CHANNELS_CONFIG (hosts — лимиты других хостов); возвращает путь к файлу"""
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                # Лимит для локального хоста не должен искажать замер
+                'hosts': {web.host: {'rate': 1e6, 'burst': 1e6}, **(hosts or {})},
+                'channels': [
+                    {'username': u, 'title': f'Бенчмарк {u}', 'type': 'cats', 'city': 'Ялта'}
+                    for u in usernames
+                ]
+            }, f, ensure_ascii=False)
+        return path
+
+    def new_db(self) -> str:
+        """Отдельная база для каждого «холодного» экземпляра"""
+        self.databases += 1
+        path = os.path.join(self.workdir, f'posts-{self.databases}.db')
+        os.environ['POSTS_DB'] = path
+        return path
+
+    def new_parser(self):
+        self.new_db()
+        return self.main.AdvancedChannelParser()
+
+    @staticmethod
+    def close_parser(parser):
+        parser.stop_event.set()
+        parser.executor.shutdown(wait=True)
+        parser.store.conn.close()
+
+    def close(self):
+        self.web.stop()
+        self.api.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+@scenario('parse')
+def bench_parse(env: Environment) -> Dict[str, Dict]:
+    """Разбор страницы каждым бэкендом для каждого размера фикстуры: время и пик памяти"""
+    parser = env.new_parser()
+    channel = parser.channels[0]
+    configured = parser.parser_backend
+    # Без lxml остается только html.parser
+    backends = [b for b in env.main.PARSER_BACKENDS if b == 'html.parser' or env.main.LXML_AVAILABLE]
+    results = {}
+    for size in SIZES:
+        page = load_page(channel.username, size)
+        reference = None
+        for backend in backends:
+            parser.parser_backend = backend
+
+            def parse_page():
+                return [parser.parse_message_node(node, channel) for node in parser.extract_message_nodes(page)]
+
+            posts = [p.to_dict() for p in parse_page() if p]
+            # Все бэкенды обязаны давать одинаковые посты
+            if reference is None:
+                reference = posts
+            elif posts != reference:
+                raise RuntimeError(f'{backend} на {size}: посты отличаются от {backends[0]}')
+            latencies = []
+            for _ in range(env.args.iterations):
+                started = time.perf_counter()
+                parse_page()
+                latencies.append(time.perf_counter() - started)
+            name = f'parse_{size}' if backend == configured else f'parse_{size}_{backend}'
+            results[name] = summarize(
+                latencies, len(latencies), sum(latencies), traced_peak_kib(parse_page),
+                page_kib=round(len(page) / 1024, 1), posts=len(posts), backend=backend
+            )
+    parser.parser_backend = configured
+    env.close_parser(parser)
+    return results
+
+
+@scenario('extract')
+def bench_extract(env: Environment) -> Dict[str, Dict]:
+    """Извлечение полей поста: прежние четыре функции против одного прохода TextExtractor"""
+    rng = random.Random(0)
+    # Первая фраза — отдельной строкой, как заголовок в постах каналов
+    texts = [
+        (random_ad(rng) if rng.random() < 0.5 else random_text(rng)).replace('! ', '!\n', 1)
+        for _ in range(env.args.extract_posts)
+    ]
+    # Телефон бывает только внутри ссылки: прежние функции находили его и там
+    for index in range(0, len(texts), 10):
+        texts[index] = f"{texts[index].split(' Звоните')[0]} Пишите: https://wa.me/7978{rng.randint(1000000, 9999999)}"
+    extractor = env.main.TextExtractor()
+
+    def before():
+        return [reference.extract_fields(text) for text in texts]
+
+    def after():
+        return [extractor.extract(text) for text in texts]
+
+    # text — новое поле (полный текст при обрезанном описании); прежние поля должны совпадать
+    if before() != [{key: item[key] for key in reference.FIELDS} for item in after()]:
+        raise RuntimeError('TextExtractor расходится с прежними функциями')
+    results = {}
+    for name, func in (('extract_before', before), ('extract_after', after)):
+        latencies = []
+        for _ in range(env.args.iterations):
+            started = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - started)
+        results[name] = summarize(
+            latencies, len(texts) * len(latencies), sum(latencies), traced_peak_kib(func), posts=len(texts)
+        )
+    return results
+
+
+@scenario('posts_memory')
+def bench_posts_memory(env: Environment) -> Dict[str, Dict]:
+    """Память на 10 тыс. постов и скорость (де)сериализации: Post против прежних словарей"""
+    main = env.main
+    rng = random.Random(0)
+    count = env.args.memory_posts
+    channels = [main.Channel(u, f'Бенчмарк {u}', 'cats') for u in env.usernames]
+    legacy_channels = [{'url': c.url, 'type': c.type, 'title': c.title} for c in channels]
+    started_at = time.time()
+    # Текст приходит из HTML байтами: строка создается при разборе, как в parse_message_div
+    raw = [
+        (
+            index, (random_ad(rng) if rng.random() < 0.5 else random_text(rng)).encode('utf-8'),
+            started_at - rng.randrange(30 * 86400), f'https://cdn.example/photo/{index}.jpg'
+        )
+        for index in range(count)
+    ]
+    extractor = main.TextExtractor()
+    fields = [extractor.extract(text.decode('utf-8')) for _, text, _, _ in raw]
+
+    def date_of(timestamp: float) -> str:
+        return datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y %H:%M')
+
+    def build_dicts():
+        return [
+            reference.post_dict(
+                str(1000 + index), text.decode('utf-8'), date_of(timestamp), timestamp, fields[index],
+                photo_url, None, legacy_channels[index % len(channels)]
+            )
+            for index, text, timestamp, photo_url in raw
+        ]
+
+    def build_posts():
+        posts = []
+        for index, text, timestamp, photo_url in raw:
+            # Post не хранит исходный текст: разобранная строка сразу освобождается
+            text.decode('utf-8')
+            item = fields[index]
+            posts.append(main.Post(
+                1000 + index, channels[index % len(channels)], date_of(timestamp), timestamp,
+                item['title'], item['description'], item['contact'], photo_url, text=item['text']
+            ))
+        return posts
+
+    def retained_kib(build: Callable) -> float:
+        """Память, которую удерживают построенные записи, в пересчете на 10 тыс. постов"""
+        tracemalloc.start()
+        try:
+            records = build()
+            current, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del records
+        return round(current / 1024 * 10000 / count, 1)
+
+    variants = {
+        'dict': (build_dicts(), lambda record: record, lambda data, channel: data),
+        'post': (build_posts(), lambda post: post.to_dict(), main.Post.from_dict)
+    }
+    results = {}
+    for name, (records, to_data, from_data) in variants.items():
+        memory = retained_kib(build_dicts if name == 'dict' else build_posts)
+        serialized = [json.dumps(to_data(record), ensure_ascii=False) for record in records]
+        for action, func in (
+            ('dump', lambda: [json.dumps(to_data(record), ensure_ascii=False) for record in records]),
+            ('load', lambda: [
+                from_data(json.loads(data), channels[index % len(channels)]) for index, data in enumerate(serialized)
+            ])
+        ):
+            latencies = []
+            for _ in range(env.args.iterations):
+                started = time.perf_counter()
+                func()
+                latencies.append(time.perf_counter() - started)
+            results[f'posts_{name}_{action}'] = summarize(
+                latencies, count * len(latencies), sum(latencies), traced_peak_kib(func),
+                posts=count, retained_kib_per_10k=memory
+            )
+    return results
+
+
+@scenario('cold_refresh')
+def bench_cold_refresh(env: Environment) -> Dict[str, Dict]:
+    """Первое обновление всех каналов с пустым хранилищем"""
+    latencies = []
+    for _ in range(env.args.iterations):
+        parser = env.new_parser()
+        started = time.perf_counter()
+        parser.refresh(force=True)
+        latencies.append(time.perf_counter() - started)
+        env.close_parser(parser)
+
+    parser = env.new_parser()
+    alloc = traced_peak_kib(lambda: parser.refresh(force=True))
+    posts = sum(len(p) for p in parser.channel_posts.values())
+    env.close_parser(parser)
+    return {'cold_refresh': summarize(
+        latencies, len(latencies) * len(env.usernames), sum(latencies), alloc,
+        channels=len(env.usernames), posts=posts
+    )}
+
+
+@scenario('warm_refresh')
+def bench_warm_refresh(env: Environment) -> Dict[str, Dict]:
+    """Повторное обновление: все каналы отвечают 304"""
+    parser = env.new_parser()
+    parser.refresh(force=True)
+    not_modified_before = env.web.not_modified
+    latencies = []
+    for _ in range(env.args.iterations):
+        started = time.perf_counter()
+        parser.refresh(force=True)
+        latencies.append(time.perf_counter() - started)
+    not_modified = env.web.not_modified - not_modified_before
+    alloc = traced_peak_kib(lambda: parser.refresh(force=True))
+    env.close_parser(parser)
+    return {'warm_refresh': summarize(
+        latencies, len(latencies) * len(env.usernames), sum(latencies), alloc,
+        channels=len(env.usernames), not_modified=not_modified
+    )}
+
+
+@scenario('latency')
+def bench_latency(env: Environment) -> Dict[str, Dict]:
+    """Холодное обновление при задержках t.me: последовательно и параллельно"""
+    rng = random.Random(0)
+    delays = {username: round(rng.uniform(0.05, env.args.max_delay), 3) for username in env.usernames}
+    env.web.delays.update(delays)
+    workers = os.environ['PARSER_MAX_WORKERS']
+    # Пул не меньше числа каналов: параллельное обновление ограничено самым медленным каналом
+    os.environ['PARSER_MAX_WORKERS'] = str(len(env.usernames))
+    results = {}
+    try:
+        for name, concurrent in (('latency_sequential', False), ('latency_concurrent', True)):
+            latencies = []
+            for _ in range(env.args.latency_runs):
+                parser = env.new_parser()
+                parser.concurrent_fetch = concurrent
+                started = time.perf_counter()
+                parser.refresh(force=True)
+                latencies.append(time.perf_counter() - started)
+                env.close_parser(parser)
+            results[name] = summarize(
+                latencies, len(latencies), sum(latencies), 0.0, channels=len(delays),
+                slowest_ms=round(max(delays.values()) * 1000, 1), sum_ms=round(sum(delays.values()) * 1000, 1)
+            )
+    finally:
+        os.environ['PARSER_MAX_WORKERS'] = workers
+        env.web.delays.clear()
+    return results
+
+
+@scenario('scaling')
+def bench_scaling(env: Environment) -> Dict[str, Dict]:
+    """Стоимость обновления и память парсера при росте числа каналов"""
+    counts = env.args.scaling_channels
+    usernames = [f'scale_{index}' for index in range(max(counts))]
+    web = FakeTelegramWeb({u: load_page(u, env.args.page_size) for u in usernames}).start()
+    saved = {key: os.environ[key] for key in ('TELEGRAM_WEB_URL', 'CHANNELS_CONFIG')}
+    os.environ['TELEGRAM_WEB_URL'] = web.url
+    results = {}
+    try:
+        for count in counts:
+            os.environ['CHANNELS_CONFIG'] = env.write_channels(f'channels-{count}.json', usernames[:count], web)
+            cold, warm = [], []
+            for _ in range(env.args.scaling_runs):
+                parser = env.new_parser()
+                # Первое обновление всех каналов, затем повторное — с ответами 304
+                for latencies in (cold, warm):
+                    started = time.perf_counter()
+                    parser.refresh(force=True)
+                    latencies.append(time.perf_counter() - started)
+                env.close_parser(parser)
+
+            # Пик памяти за холодное обновление и сколько парсер удерживает после него
+            tracemalloc.start()
+            try:
+                parser = env.new_parser()
+                parser.refresh(force=True)
+                retained, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            posts = sum(len(p) for p in parser.channel_posts.values())
+            env.close_parser(parser)
+            results[f'scaling_{count}'] = summarize(
+                cold, count * len(cold), sum(cold), round(peak / 1024, 1),
+                channels=count, posts=posts, warm_p50_ms=round(percentile(warm, 50) * 1000, 3),
+                retained_kib=round(retained / 1024, 1), retained_kib_per_channel=round(retained / 1024 / count, 1)
+            )
+    finally:
+        os.environ.update(saved)
+        web.stop()
+    return results
+
+
+def serve_reads(duration: float, barrier):
+    """Процесс сценария workers: фоновое обновление и чтения снимка, как у воркера gunicorn"""
+    import main
+    logging.getLogger('main').setLevel(logging.WARNING)
+    parser = main.AdvancedChannelParser()
+    barrier.wait()
+    parser.start_background_refresh()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        parser.get_cached_posts()
+        time.sleep(0.01)
+    parser.stop_event.set()
+    with parser.refresh_lock:
+        parser.executor.shutdown(wait=True)
+
+
+@scenario('workers')
+def bench_workers(env: Environment) -> Dict[str, Dict]:
+    """Несколько процессов на одном POSTS_DB: каждый канал запрашивается ровно один раз за TTL"""
+    ttl = env.args.workers_ttl
+    duration = ttl * env.args.workers_ttls
+    processes = env.args.processes
+    env.new_db()
+    saved = {key: os.environ.get(key) for key in ('REFRESH_INTERVAL', 'REFRESH_CHECK_INTERVAL')}
+    os.environ.update({'REFRESH_INTERVAL': str(ttl), 'REFRESH_CHECK_INTERVAL': '1'})
+    # spawn: дочерние процессы не наследуют потоки фейковых серверов
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(processes + 1)
+    workers = [context.Process(target=serve_reads, args=(duration, barrier)) for _ in range(processes)]
+    try:
+        for worker in workers:
+            worker.start()
+        barrier.wait(env.args.timeout)
+        first = len(env.web.fetches)
+        started = time.monotonic()
+        for worker in workers:
+            worker.join(duration + env.args.timeout)
+        elapsed = time.monotonic() - started
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    if any(worker.exitcode for worker in workers):
+        raise RuntimeError(f'воркеры завершились с кодами {[worker.exitcode for worker in workers]}')
+
+    fetched = {username: [] for username in env.usernames}
+    for at, username in env.web.fetches[first:]:
+        fetched[username].append(at)
+    gaps = [later - earlier for times in fetched.values() for earlier, later in zip(times, times[1:])]
+    missing = [username for username, times in fetched.items() if not times]
+    # Промежуток короче TTL — второй запрос за TTL; длиннее двух TTL — пропущенное окно
+    if missing or not gaps or min(gaps) < ttl * 0.95 or max(gaps) >= ttl * 2:
+        raise RuntimeError(
+            f'каналы без запросов: {missing}, промежутки между запросами канала '
+            f'{min(gaps, default=0):.2f}–{max(gaps, default=0):.2f} с при TTL {ttl} с'
+        )
+    fetches = sum(len(times) for times in fetched.values())
+    return {'workers': summarize(
+        gaps, fetches, elapsed, 0.0,
+        processes=processes, channels=len(fetched), ttl_s=ttl, fetches=fetches,
+        fetches_per_channel_ttl=round(fetches / len(fetched) / (elapsed / ttl), 2),
+        min_gap_s=round(min(gaps), 3), max_gap_s=round(max(gaps), 3)
+    )}
+
+
+@scenario('dispatch')
+def bench_dispatch(env: Environment) -> Dict[str, Dict]:
+    """Время выбора обработчика от размера меню: цепочка фильтров telebot против MessageRouter"""
+    import telebot
+    rng = random.Random(0)
+    results = {}
+    for size in env.args.menu_sizes:
+        buttons = [f'Кнопка {index}' for index in range(size)]
+        commands = [f'cmd{index}' for index in range(max(1, size // 5))]
+        texts = buttons + [f'/{name}' for name in commands] + ['текст вне меню']
+        messages = [
+            telebot.types.Message.de_json({
+                'message_id': index, 'date': 0, 'text': rng.choice(texts),
+                'chat': {'id': 1, 'type': 'private'}, 'from': {'id': 1, 'is_bot': False, 'first_name': 'User'}
+            })
+            for index in range(env.args.dispatch_messages)
+        ]
+        hits = {'chain': [], 'router': []}
+
+        def handler_for(name: str, target: str):
+            return lambda message: hits[name].append(target)
+
+        # До: по обработчику на кнопку и команду, telebot проверяет фильтры по очереди
+        chain = telebot.TeleBot('123456:BENCHMARK', threaded=False)
+        for name in commands:
+            chain.register_message_handler(handler_for('chain', name), commands=[name])
+        for text in buttons:
+            chain.register_message_handler(handler_for('chain', text), func=lambda message, text=text: message.text == text)
+        chain.register_message_handler(handler_for('chain', None), content_types=['text'])
+
+        # После: один обработчик и поиск в словаре
+        router = env.main.MessageRouter(handler_for('router', None))
+        for name in commands:
+            router.command(name)(handler_for('router', name))
+        for text in buttons:
+            router.button(text)(handler_for('router', text))
+        routed = telebot.TeleBot('123456:BENCHMARK', threaded=False)
+        routed.register_message_handler(router.dispatch, content_types=['text'])
+
+        for name, bot in (('chain', chain), ('router', routed)):
+            latencies = []
+            for _ in range(env.args.iterations):
+                started = time.perf_counter()
+                bot.process_new_messages(messages)
+                latencies.append(time.perf_counter() - started)
+            results[f'dispatch_{name}_{size}'] = summarize(
+                latencies, len(messages) * len(latencies), sum(latencies),
+                traced_peak_kib(lambda: bot.process_new_messages(messages)),
+                menu_size=len(texts) - 1, messages=len(messages),
+                us_per_message=round(percentile(latencies, 50) / len(messages) * 1e6, 2)
+            )
+        if hits['chain'] != hits['router']:
+            raise RuntimeError(f'меню из {size} кнопок: MessageRouter выбрал другие обработчики')
+    return results
+
+
+@scenario('burst')
+def bench_burst(env: Environment) -> Dict[str, Dict]:
+    """N пользователей одновременно нажимают «🐱 Актуальные посты»"""
+    env.new_db()
+    bot = env.main.CatBotWithPhotos()
+    bot.parser.refresh(force=True)
+    client = bot.app.test_client()
+    users = env.args.users
+    counter = {'update_id': 0, 'chat_id': 100000}
+
+    def run_burst():
+        """Один всплеск: задержки по пользователям, длительность и число вызовов API"""
+        taps = {}
+        delivered = {}
+        done = threading.Event()
+
+        # Последнее сообщение ответа — подсказка «💡 Как помочь?»
+        def on_call(call):
+            if call['method'] == 'sendMessage' and call['params'].get('text', '').startswith('💡'):
+                delivered[call['chat_id']] = call['time']
+                if len(delivered) >= users:
+                    done.set()
+
+        env.api.subscribe(on_call)
+        for _ in range(users):
+            counter['update_id'] += 1
+            counter['chat_id'] += 1
+            chat_id = counter['chat_id']
+            update = {
+                'update_id': counter['update_id'],
+                'message': {
+                    'message_id': counter['update_id'],
+                    'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+                    'text': '🐱 Актуальные посты'
+                }
+            }
+            taps[str(chat_id)] = time.perf_counter()
+            response = client.post(f'/{bot.token}', json=update)
+            if response.status_code != 200:
+                raise RuntimeError(f'webhook вернул {response.status_code}')
+        if not done.wait(env.args.timeout):
+            raise RuntimeError(f'за {env.args.timeout} с ответ получили {len(delivered)}/{users} пользователей')
+        calls = env.api.reset()
+        elapsed = max(delivered.values()) - min(taps.values())
+        return [delivered[chat] - taps[chat] for chat in taps], elapsed, len(calls)
+
+    latencies = []
+    elapsed = 0.0
+    calls = 0
+    for _ in range(env.args.burst_runs):
+        run_latencies, run_elapsed, run_calls = run_burst()
+        latencies.extend(run_latencies)
+        elapsed += run_elapsed
+        calls += run_calls
+    alloc = traced_peak_kib(run_burst)
+    return {'burst': summarize(
+        latencies, len(latencies), elapsed, alloc,
+        users=users, api_calls_per_user=round(calls / len(latencies), 2)
+    )}
+
+
+@scenario('webhook')
+def bench_webhook(env: Environment) -> Dict[str, Dict]:
+    """Параллельные POST на webhook по HTTP: время ответа в синхронном и асинхронном режимах"""
+    import requests
+    from werkzeug.serving import make_server
+    users = env.args.users
+    clients = env.args.webhook_clients
+    counter = {'update_id': 0}
+    lock = threading.Lock()
+    local = threading.local()
+    results = {}
+    saved = os.environ.get('ASYNC_UPDATES')
+    try:
+        for mode, flag in (('sync', '0'), ('async', '1')):
+            os.environ['ASYNC_UPDATES'] = flag
+            env.new_db()
+            bot = env.main.CatBotWithPhotos()
+            bot.parser.refresh(force=True)
+            server = make_server('127.0.0.1', 0, bot.app, threaded=True)
+            threading.Thread(target=server.serve_forever, name='bench-webhook', daemon=True).start()
+            url = f'http://127.0.0.1:{server.server_port}/{bot.token}'
+
+            def post(chat_id: int):
+                """POST одного обновления; возвращает время от отправки до ответа и момент отправки"""
+                with lock:
+                    counter['update_id'] += 1
+                    update_id = counter['update_id']
+                if not hasattr(local, 'session'):
+                    local.session = requests.Session()
+                body = json.dumps({'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'},
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+                    'text': '🐱 Актуальные посты'
+                }})
+                sent = time.perf_counter()
+                response = local.session.post(url, data=body, headers={'Content-Type': 'application/json'})
+                if response.status_code != 200:
+                    raise RuntimeError(f'webhook вернул {response.status_code}')
+                return time.perf_counter() - sent, sent
+
+            latencies, replies = [], []
+            started = time.perf_counter()
+            for run in range(env.args.burst_runs):
+                chats = range(300000 + run * users, 300000 + (run + 1) * users)
+                delivered = {}
+                done = threading.Event()
+
+                def on_call(call):
+                    if call['method'] == 'sendMessage' and call['params'].get('text', '').startswith('💡'):
+                        delivered[call['chat_id']] = call['time']
+                        if len(delivered) >= users:
+                            done.set()
+
+                env.api.subscribe(on_call)
+                with ThreadPoolExecutor(clients) as pool:
+                    timings = dict(zip(chats, pool.map(post, chats)))
+                if not done.wait(env.args.timeout):
+                    raise RuntimeError(f'{mode}: за {env.args.timeout} с ответ получили {len(delivered)}/{users}')
+                env.api.reset()
+                latencies.extend(latency for latency, _ in timings.values())
+                replies.extend(delivered[str(chat)] - sent for chat, (_, sent) in timings.items())
+            elapsed = time.perf_counter() - started
+            server.shutdown()
+            server.server_close()
+            results[f'webhook_{mode}'] = summarize(
+                latencies, len(latencies), elapsed, 0.0,
+                users=users, clients=clients, reply_p99_ms=round(percentile(replies, 99) * 1000, 3)
+            )
+    finally:
+        if saved is None:
+            os.environ.pop('ASYNC_UPDATES', None)
+        else:
+            os.environ['ASYNC_UPDATES'] = saved
+    return results
+
+
+@scenario('polling')
+def bench_polling(env: Environment) -> Dict[str, Dict]:
+    """Обновления в секунду через PollingEngine против getUpdates фейкового Bot API"""
+    total = env.args.poll_updates
+    saved = {key: os.environ.get(key) for key in ('POLL_BATCH_SIZE', 'POLL_TIMEOUT')}
+    results = {}
+    try:
+        for batch_size in env.args.poll_batch_sizes:
+            os.environ.update({'POLL_BATCH_SIZE': str(batch_size), 'POLL_TIMEOUT': '1'})
+            env.new_db()
+            bot = env.main.CatBotWithPhotos()
+            engine = env.main.PollingEngine(bot.token, bot.updates, bot.store)
+            batches = []
+            process_batch = engine.process_batch
+
+            def timed_batch(batch):
+                started = time.perf_counter()
+                process_batch(batch)
+                batches.append(time.perf_counter() - started)
+
+            engine.process_batch = timed_batch
+            env.api.reset()
+            env.api.push_updates([
+                {'update_id': update_id, 'message': {
+                    'message_id': update_id, 'date': int(time.time()), 'text': 'привет',
+                    'chat': {'id': 400000 + update_id % env.args.users, 'type': 'private'},
+                    'from': {'id': 400000 + update_id % env.args.users, 'is_bot': False, 'first_name': 'User'}
+                }}
+                for update_id in range(1, total + 1)
+            ])
+            started = time.perf_counter()
+            thread = threading.Thread(target=engine.run, name='bench-polling', daemon=True)
+            thread.start()
+            deadline = started + env.args.timeout
+            while engine.metrics['updates'] < total and time.perf_counter() < deadline:
+                time.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            engine.stop()
+            thread.join(env.args.timeout)
+            if engine.metrics['updates'] < total:
+                raise RuntimeError(f'за {env.args.timeout} с обработано {engine.metrics["updates"]}/{total} обновлений')
+            polls = [call for call in env.api.reset() if call['method'] == 'getUpdates']
+            results[f'polling_{batch_size}'] = summarize(
+                batches, total, elapsed, 0.0,
+                batch_size=batch_size, updates=total, polls=len(polls),
+                immediate_repolls=sum(1 for call in polls if call['params'].get('timeout') == '0')
+            )
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return results
+
+
+@scenario('search')
+def bench_search(env: Environment) -> Dict[str, Dict]:
+    """Построение поискового индекса на синтетическом корпусе и запросы к нему"""
+    main = env.main
+    rng = random.Random(0)
+    channels = [main.Channel(f'search_{index}', f'Поиск {index}') for index in range(10)]
+    extractor = main.TextExtractor()
+    posts = []
+    for post_id in range(env.args.search_posts):
+        fields = extractor.extract(random_text(rng))
+        posts.append(main.Post(
+            post_id, channels[post_id % len(channels)], '01.08.2025 09:00', 1.7e9 + post_id,
+            fields['title'], fields['description'], fields['contact']
+        ))
+
+    index = main.PostIndex()
+    started = time.perf_counter()
+    index.add(posts)
+    build_seconds = time.perf_counter() - started
+    build_alloc = traced_peak_kib(lambda: main.PostIndex().add(posts))
+
+    queries = ['рыжий котенок', 'кастрирован', 'трехцветная кошка', 'привит девочка', 'ласковая', 'мурзик']
+    latencies = []
+    for _ in range(env.args.iterations):
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query, limit=5)
+            latencies.append(time.perf_counter() - started)
+    alloc = traced_peak_kib(lambda: [index.search(query, limit=5) for query in queries])
+    return {
+        'search_build': summarize(
+            [build_seconds], len(posts), build_seconds, build_alloc, posts=len(posts)
+        ),
+        'search_query': summarize(
+            latencies, len(latencies), sum(latencies), alloc, posts=len(posts), queries=len(queries)
+        )
+    }
+
+
+@scenario('dedup')
+def bench_dedup(env: Environment) -> Dict[str, Dict]:
+    """Склейка перепостов между каналами на синтетическом корпусе (без превью), треть объявлений короткие"""
+    main = env.main
+    rng = random.Random(0)
+    channels = [main.Channel(f'dedup_{index}', f'Дубли {index}') for index in range(10)]
+    posts, originals = [], {}
+    for post_id in range(env.args.dedup_posts):
+        channel = channels[post_id % len(channels)]
+        if posts and rng.random() < 0.2:
+            source = rng.choice(posts[-500:])
+            original = originals.get(source.url, source.url)
+            if original.startswith(f'{channel.url}/'):
+                channel = channels[(post_id + 1) % len(channels)]
+            text = repost_text(rng, source.description)
+            originals[f'{channel.url}/{post_id}'] = original
+        else:
+            text = short_ad(rng) if rng.random() < 0.3 else random_ad(rng)
+        posts.append(main.Post(
+            post_id, channel, '01.08.2025 09:00', 1.7e9 + post_id, 'Котик', text, ''
+        ))
+
+    detectors = []
+
+    def run() -> List[float]:
+        detector = main.DuplicateDetector()
+        latencies = []
+        for post in posts:
+            post.duplicate_of, post.reposts = None, ()
+            started = time.perf_counter()
+            detector.check(post)
+            latencies.append(time.perf_counter() - started)
+        detectors.append(detector)
+        return latencies
+
+    latencies = run()
+    # Крупные корзины LSH — кандидаты, которые каждая проверка сравнивает точным Жаккаром
+    buckets = [len(keys) for table in detectors[0].text.tables for keys in table.values()]
+    short = sum(1 for post in posts if len(post.description.split()) < 12)
+    found = sum(1 for post in posts if post.duplicate_of)
+    # Пропущенный перепост сам становится основным — совпадение с ним тоже верное
+    correct = sum(
+        1 for post in posts
+        if post.duplicate_of and originals.get(post.duplicate_of, post.duplicate_of) == originals.get(post.url)
+    )
+    alloc = traced_peak_kib(run)
+    return {'dedup': summarize(
+        latencies, len(posts), sum(latencies), alloc,
+        posts=len(posts), short_posts=short, reposts=len(originals), detected=found,
+        false_positives=found - correct, max_bucket=max(buckets, default=0),
+        candidate_pairs=sum(size * (size - 1) // 2 for size in buckets)
+    )}
+
+
+@scenario('images')
+def bench_images(env: Environment) -> Dict[str, Dict]:
+    """Склейка по превью: обновление не ждет загрузки превью, очередь разбирается с лимитом CDN"""
+    usernames = [f'images_{index}' for index in range(env.args.image_channels)]
+    cdn = FakeCDN().start()
+    # Ссылки на cdn*.telesco.pe в страницах ведут на локальный CDN
+    web = FakeTelegramWeb({
+        u: re.sub(rb'https://cdn\d*\.telesco\.pe', cdn.url.encode('utf-8'), load_page(u, env.args.page_size))
+        for u in usernames
+    }).start()
+    # Без --cdn-rate действует лимит хоста по умолчанию, как для настоящего CDN
+    rate = env.args.cdn_rate
+    hosts = {cdn.host: {'rate': rate, 'burst': rate}} if rate else None
+    saved = {key: os.environ[key] for key in ('TELEGRAM_WEB_URL', 'CHANNELS_CONFIG', 'DEDUP_IMAGES')}
+    os.environ.update({
+        'TELEGRAM_WEB_URL': web.url,
+        'CHANNELS_CONFIG': env.write_channels('channels-images.json', usernames, web, hosts)
+    })
+    results = {}
+    try:
+        for name, enabled in (('images_off', '0'), ('images_on', '1')):
+            os.environ['DEDUP_IMAGES'] = enabled
+            parser = env.new_parser()
+            previews_before = cdn.requests
+            started = time.perf_counter()
+            parser.refresh(force=True)
+            refreshed = time.perf_counter() - started
+            # Обновление вернулось сразу; превью догружает фоновый поток
+            parser.image_queue.join()
+            drained = time.perf_counter() - started
+            previews = cdn.requests - previews_before
+            posts = sum(len(p) for p in parser.channel_posts.values())
+            duplicates = sum(1 for p in parser.channel_posts.values() for post in p if post.duplicate_of)
+            env.close_parser(parser)
+
+            # Пик памяти — отдельным прогоном с новой базой (кэш хэшей превью пуст)
+            parser = env.new_parser()
+            alloc = traced_peak_kib(lambda: parser.refresh(force=True))
+            parser.image_queue.join()
+            env.close_parser(parser)
+            results[name] = summarize(
+                [refreshed], len(usernames), refreshed, alloc, channels=len(usernames), posts=posts,
+                previews=previews, drain_s=round(drained, 2), duplicates=duplicates
+            )
+    finally:
+        os.environ.update(saved)
+        web.stop()
+        cdn.stop()
+    return results
+
+
+@scenario('fanout')
+def bench_fanout(env: Environment) -> Dict[str, Dict]:
+    """Рассылка новых постов подписчикам: подбор, постоянная очередь и отправка; 1% заблокировал бота"""
+    env.new_db()
+    bot = env.main.CatBotWithPhotos()
+    bot.parser.refresh(force=True)
+    rng = random.Random(0)
+    usernames = [channel.username for channel in bot.parser.channels]
+    queries = ['рыжий', 'котенок', 'кастрирован', 'девочка ласковая', 'черный кот', 'привит']
+    subscriptions = []
+    for index in range(env.args.subscribers):
+        roll = rng.random()
+        if roll < 0.5:
+            filters = {}
+        elif roll < 0.7:
+            filters = {'type': 'cats'}
+        elif roll < 0.85:
+            filters = {'channel': rng.choice(usernames)}
+        else:
+            filters = {'query': rng.choice(queries)}
+        subscriptions.append((300000 + index, filters))
+    bot.store.save_subscriptions(subscriptions)
+    bot.store.incr('subscriptions_generation')
+    blocked = {str(chat_id) for chat_id, _ in subscriptions[::100]}
+    env.api.blocked.update(blocked)
+
+    posts = bot.parser.posts_cache[:env.args.fanout_posts]
+    started = time.perf_counter()
+    bot.subscriptions.sync()
+    load_seconds = time.perf_counter() - started
+    match_latencies = []
+    expected = set()
+    for post in posts:
+        started = time.perf_counter()
+        chats = bot.subscriptions.match(post)
+        match_latencies.append(time.perf_counter() - started)
+        expected.update(str(chat_id) for chat_id in chats)
+    expected -= blocked
+    alloc = traced_peak_kib(lambda: [bot.subscriptions.match(post) for post in posts])
+
+    delivered = {}
+    done = threading.Event()
+
+    def on_call(call):
+        chat_id = call['chat_id']
+        if chat_id in expected and chat_id not in delivered:
+            delivered[chat_id] = call['time']
+            if len(delivered) >= len(expected):
+                done.set()
+
+    env.api.subscribe(on_call)
+    started = time.perf_counter()
+    bot.notify_subscribers(posts)
+    enqueue_seconds = time.perf_counter() - started
+    if expected and not done.wait(env.args.timeout):
+        raise RuntimeError(f'за {env.args.timeout} с уведомления получили {len(delivered)}/{len(expected)} чатов')
+    bot.fanout.join(env.args.timeout)
+    elapsed = time.perf_counter() - started
+    calls = env.api.reset()
+    env.api.blocked.clear()
+    stats = bot.fanout.stats()
+    return {
+        'fanout_match': summarize(
+            match_latencies, len(posts), sum(match_latencies), alloc,
+            subscribers=len(subscriptions), load_ms=round(load_seconds * 1000, 1)
+        ),
+        'fanout': summarize(
+            [delivered[chat_id] - started for chat_id in expected], len(calls), elapsed, 0.0,
+            chats=len(expected), posts=len(posts), enqueue_ms=round(enqueue_seconds * 1000, 1),
+            blocked_dropped=stats['blocked'], failed=stats['failed'],
+            subscribers_left=len(bot.subscriptions)
+        )
+    }
+
+
+@scenario('feed_paging')
+def bench_feed_paging(env: Environment) -> Dict[str, Dict]:
+    """Пользователи открывают ленту и листают ее кнопкой «Ещё ▶️»"""
+    env.new_db()
+    bot = env.main.CatBotWithPhotos()
+    bot.parser.refresh(force=True)
+    client = bot.app.test_client()
+    users = env.args.users
+    pages = env.args.feed_pages
+    update_ids = iter(range(1, 10 ** 9))
+    chats = [200000 + index for index in range(users)]
+    feed_messages = {}
+    opened = threading.Event()
+
+    def on_open(call):
+        markup = call['params'].get('reply_markup') or ''
+        if call['method'] in ('sendPhoto', 'sendMessage') and 'feed:' in markup:
+            feed_messages[call['chat_id']] = call
+            if len(feed_messages) >= users:
+                opened.set()
+
+    def post_update(update: Dict):
+        response = client.post(f'/{bot.token}', json=update)
+        if response.status_code != 200:
+            raise RuntimeError(f'webhook вернул {response.status_code}')
+
+    env.api.subscribe(on_open)
+    for chat_id in chats:
+        update_id = next(update_ids)
+        post_update({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+            'text': '🐱 Актуальные посты'
+        }})
+    if not opened.wait(env.args.timeout):
+        raise RuntimeError(f'лента открылась у {len(feed_messages)}/{users} пользователей')
+    bot.outbox.join()
+    env.api.reset()
+
+    def run_pages(first: int, count: int):
+        """Каждый пользователь листает count страниц; задержка — от нажатия до правки сообщения"""
+        latencies = []
+        calls = 0
+        started = time.perf_counter()
+        for page in range(first, first + count):
+            taps = {}
+            edited = {}
+            done = threading.Event()
+
+            def on_edit(call):
+                if call['method'].startswith(('edit', 'send')) and call['chat_id'] in taps:
+                    edited.setdefault(call['chat_id'], call['time'])
+                    if len(edited) >= len(taps):
+                        done.set()
+
+            env.api.subscribe(on_edit)
+            for chat_id in chats:
+                update_id = next(update_ids)
+                taps[str(chat_id)] = time.perf_counter()
+                post_update({'update_id': update_id, 'callback_query': {
+                    'id': str(update_id), 'chat_instance': str(chat_id), 'data': f'feed:{page}',
+                    'from': {'id': chat_id, 'is_bot': False, 'first_name': 'User'},
+                    'message': {
+                        'message_id': bot.feed_cursors.get(chat_id).message_id, 'date': int(time.time()),
+                        'chat': {'id': chat_id, 'type': 'private'}
+                    }
+                }})
+            if not done.wait(env.args.timeout):
+                raise RuntimeError(f'страница {page}: правок {len(edited)}/{len(taps)}')
+            # Ответ на callback_query приходит раньше правки — дожидаемся оставшихся вызовов
+            bot.outbox.join()
+            calls += len(env.api.reset())
+            latencies.extend(edited[chat] - taps[chat] for chat in edited)
+        return latencies, time.perf_counter() - started, calls
+
+    latencies, elapsed, calls = run_pages(1, pages)
+    alloc = traced_peak_kib(lambda: run_pages(pages + 1, 1))
+    return {'feed_paging': summarize(
+        latencies, len(latencies), elapsed, alloc,
+        users=users, pages=pages, api_calls_per_turn=round(calls / len(latencies), 2)
+    )}
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Сравнивает с базовой линией; возвращает описания регрессий"""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric in COMPARED_METRICS:
+            current, previous = metrics.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = current / previous - 1
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            flag = ''
+            if worse > tolerance:
+                flag = '  ❌'
+                regressions.append(f'{name}.{metric}: {previous} → {current} ({change:+.0%})')
+            print(f'  {name:<24} {metric:<15} {previous:>12} → {current:<12} {change:+7.1%}{flag}')
+    return regressions
+
+
+def print_results(results: Dict[str, Dict]):
+    print(f"{'сценарий':<24} {'итераций':>8} {'в секунду':>12} {'p50, мс':>10} {'p99, мс':>10} {'память, КиБ':>12}")
+    for name, metrics in results.items():
+        print(
+            f"{name:<24} {metrics['iterations']:>8} {metrics['throughput'] or 0:>12} "
+            f"{metrics['p50_ms']:>10} {metrics['p99_ms']:>10} {metrics['alloc_peak_kib']:>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарк CatBot')
+    parser.add_argument('--only', nargs='+', choices=sorted(SCENARIOS), help='запустить только эти сценарии')
+    parser.add_argument('--iterations', type=int, default=20, help='повторов в сценариях парсинга и обновления')
+    parser.add_argument('--channels', type=int, default=10, help='число каналов на фейковом t.me')
+    parser.add_argument('--page-size', choices=sorted(SIZES), default='small', help='фикстура страниц каналов')
+    parser.add_argument('--workers', type=int, default=4, help='PARSER_MAX_WORKERS')
+    parser.add_argument('--max-delay', type=float, default=0.5, help='наибольшая задержка канала в сценарии latency, с')
+    parser.add_argument('--latency-runs', type=int, default=3, help='повторов в сценарии latency')
+    parser.add_argument('--scaling-channels', type=int, nargs='+', default=[2, 5, 10, 25, 50, 100],
+                        help='число каналов в сценарии scaling')
+    parser.add_argument('--scaling-runs', type=int, default=3, help='повторов на каждое число каналов в scaling')
+    parser.add_argument('--processes', type=int, default=4, help='процессов-воркеров в сценарии workers')
+    parser.add_argument('--workers-ttl', type=int, default=3, help='REFRESH_INTERVAL в сценарии workers, с')
+    parser.add_argument('--workers-ttls', type=int, default=4, help='длительность сценария workers в TTL')
+    parser.add_argument('--menu-sizes', type=int, nargs='+', default=[5, 20, 100, 500],
+                        help='число кнопок меню в сценарии dispatch')
+    parser.add_argument('--dispatch-messages', type=int, default=2000, help='сообщений за итерацию в dispatch')
+    parser.add_argument('--users', type=int, default=200, help='пользователей в одном всплеске')
+    parser.add_argument('--burst-runs', type=int, default=3, help='число всплесков')
+    parser.add_argument('--webhook-clients', type=int, default=32, help='параллельных HTTP-клиентов в сценарии webhook')
+    parser.add_argument('--poll-updates', type=int, default=2000, help='обновлений в сценарии polling')
+    parser.add_argument('--poll-batch-sizes', type=int, nargs='+', default=[1, 10, 100],
+                        help='POLL_BATCH_SIZE в сценарии polling')
+    parser.add_argument('--memory-posts', type=int, default=10000, help='постов в сценарии posts_memory')
+    parser.add_argument('--extract-posts', type=int, default=5000, help='текстов в сценарии extract')
+    parser.add_argument('--search-posts', type=int, default=20000, help='размер корпуса для сценария search')
+    parser.add_argument('--dedup-posts', type=int, default=10000, help='размер корпуса для сценария dedup')
+    parser.add_argument('--image-channels', type=int, default=1, help='каналов в сценарии images')
+    parser.add_argument('--cdn-rate', type=float, help='лимит запросов в секунду к CDN в сценарии images')
+    parser.add_argument('--subscribers', type=int, default=50000, help='подписчиков в сценарии fanout')
+    parser.add_argument('--fanout-posts', type=int, default=3, help='новых постов в сценарии fanout')
+    parser.add_argument('--feed-pages', type=int, default=3, help='страниц ленты, которые листает пользователь')
+    parser.add_argument('--timeout', type=float, default=120, help='ожидание ответов всплеска, с')
+    parser.add_argument('--real-limits', action='store_true', help='не снимать лимиты отправки Telegram')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    parser.add_argument('--baseline', help='сравнить с базовой линией (JSON)')
+    parser.add_argument('--save-baseline', help='записать результаты как новую базовую линию')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое ухудшение, доля')
+    parser.add_argument('--verbose', action='store_true', help='не приглушать логи бота')
+    args = parser.parse_args()
+
+    env = Environment(args)
+    results = {}
+    try:
+        for name in args.only or SCENARIOS:
+            print(f'▶️ {name}', file=sys.stderr)
+            results.update(SCENARIOS[name](env))
+    finally:
+        env.close()
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'channels': args.channels,
+            'page_size': args.page_size,
+            'users': args.users,
+            'real_limits': args.real_limits
+        },
+        'results': results
+    }
+    print_results(results)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f'\nСравнение с {args.baseline} (допуск {args.tolerance:.0%}):')
+        regressions = compare(results, baseline.get('results', {}), args.tolerance)
+        if regressions:
+            print('\n❌ Регрессии:\n' + '\n'.join(f'  {r}' for r in regressions))
+            sys.exit(1)
+        print('\n✅ Регрессий нет')
+
+
+if __name__ == '__main__':
+    main()
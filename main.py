@@ -1,15 +1,36 @@
 import os
+import sys
 import telebot
 from telebot import types
-from flask import Flask, request, jsonify
-from datetime import datetime
+from telebot.apihelper import ApiTelegramException
+from flask import Flask, Response, request, jsonify
+from datetime import datetime, date, timedelta
 import time
 import logging
+import threading
+import queue
+from abc import ABC, abstractmethod
+from functools import lru_cache, partial, wraps
+from collections import OrderedDict
 import json
+import gzip
+import hashlib
+import base64
+import io
+import math
+import sqlite3
+import socket
+import random
+import bisect
+import heapq
+from urllib.parse import urlparse
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 import re
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from typing import Callable, Dict, List, Optional, Tuple
+from cachetools import LRUCache, TTLCache
 
 # 🔧 Настройка логирования
 logging.basicConfig(
@@ -18,69 +39,1839 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# requests распаковывает brotli только при установленном пакете brotli
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# lxml нужен для быстрых бэкендов парсинга; без него остается html.parser
+try:
+    from lxml import etree
+    import lxml.html
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+# Pillow нужен для перцептивных хэшей превью; без него перепосты ищутся только по тексту
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+PARSER_BACKENDS = ('html.parser', 'lxml', 'lxml-xpath')
+BACKGROUND_IMAGE_RE = re.compile(r"background-image:url\('(.*?)'\)")
+# До построения дерева class — целая строка («tgme_widget_message js-widget_message»), ищем токен
+MESSAGE_STRAINER = SoupStrainer('div', class_=re.compile(r'(?:^|\s)tgme_widget_message(?:\s|$)'))
+
+
+def class_xpath(path: str, css_class: str) -> str:
+    """XPath-условие на наличие CSS-класса в атрибуте class"""
+    return f"{path}[contains(concat(' ', normalize-space(@class), ' '), ' {css_class} ')]"
+
+
+if LXML_AVAILABLE:
+    XPATH_MESSAGES = etree.XPath(class_xpath('//div', 'tgme_widget_message'))
+    XPATH_TEXT = etree.XPath(class_xpath('.//div', 'tgme_widget_message_text'))
+    XPATH_TIME = etree.XPath('.//time[@datetime]/@datetime')
+    XPATH_PHOTO_STYLE = etree.XPath(class_xpath('.//a', 'tgme_widget_message_photo_wrap') + '/@style')
+    XPATH_VIDEO_STYLE = etree.XPath(class_xpath('.//div', 'tgme_widget_message_video_wrap') + '/@style')
+
+
+class Metrics:
+    """Счетчики, гистограммы и датчики в текстовом формате Prometheus"""
+    
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+    
+    def inc(self, name: str, amount: float = 1, **labels):
+        """Увеличивает счетчик"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def observe(self, name: str, value: float, **labels):
+        """Добавляет наблюдение в гистограмму"""
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def gauge(self, name: str, func: Callable):
+        """Датчик, значение которого вычисляется при выдаче /metrics"""
+        self.gauges[name] = func
+    
+    def timed(self, name: str, **labels):
+        """Декоратор: длительность вызова в гистограмму, исключения — в catbot_errors_total"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc('catbot_errors_total', source=name)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+    
+    @staticmethod
+    def format_labels(labels, extra: str = '') -> str:
+        parts = ['%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels]
+        if extra:
+            parts.append(extra)
+        return '{' + ','.join(parts) + '}' if parts else ''
+    
+    def render(self) -> str:
+        """Текст для эндпоинта /metrics"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+        
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{self.format_labels(labels)} {value}')
+        
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = self.format_labels(labels, 'le="%s"' % bound)
+                lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = self.format_labels(labels, 'le="+Inf"')
+            lines.append(f'{name}_bucket{bucket_labels} {count}')
+            lines.append(f'{name}_sum{self.format_labels(labels)} {total}')
+            lines.append(f'{name}_count{self.format_labels(labels)} {count}')
+        
+        for name, func in sorted(self.gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            if value is None:
+                continue
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+DEFAULT_ANIMAL_KEYWORDS = (
+    'кот', 'кошк', 'котен', 'котик', 'мурз', 'мяу',
+    'пристрой', 'дом', 'питомец', 'стерил', 'прививк',
+    'потерял', 'нашел', 'пропал', 'найден', 'потеряшка'
+)
+TITLE_CLEAN_RE = re.compile(r'[^\w\s\-\.,!?а-яёА-ЯЁ]')
+PHONE_RE = re.compile(r'\+?[78][\s\-]?\(?9\d{2}\)?\s?[\d\s\-]{7,10}')
+USERNAME_RE = re.compile(r'@\w+')
+# Всё, что вырезается из описания, одной альтернативой
+CONTACT_TOKENS_RE = re.compile(r'@\w+|https?://\S+|\+?\d[\d\s\-\(\)]+')
+
+
+class TextExtractor:
+    """Извлекает заголовок, описание, контакты и релевантность поста.
+    
+    Результат совпадает с прежними функциями: телефон и @username ищутся по всему
+    тексту (в том числе внутри ссылок), регулярки скомпилированы заранее, а пробелы
+    сжимаются str.split вместо подстановки \\s+ — на ней уходила четверть времени.
+    """
+    
+    DESCRIPTION_LENGTH = 200
+    
+    def __init__(self, keywords=DEFAULT_ANIMAL_KEYWORDS):
+        self.keywords = tuple(k.lower() for k in keywords)
+    
+    def extract(self, text: str) -> Dict:
+        """Возвращает title, description, contact, relevant и text — полный текст без контактов,
+        если description обрезано (иначе None)"""
+        phone = PHONE_RE.search(text)
+        username = USERNAME_RE.search(text)
+        # split() без аргументов делит по тем же пробельным символам, что и \s
+        clean_text = ' '.join(CONTACT_TOKENS_RE.sub('', text).split())
+        lowered = text.lower()
+        
+        contacts = [match.group() for match in (phone, username) if match]
+        return {
+            'title': self.extract_title(text),
+            'description': self.extract_description(clean_text),
+            'contact': ' • '.join(contacts) if contacts else "См. в группе",
+            'relevant': any(keyword in lowered for keyword in self.keywords),
+            # Поиск, подписки и склейка перепостов смотрят на слова после обрезки описания
+            'text': clean_text if len(clean_text) > self.DESCRIPTION_LENGTH else None
+        }
+    
+    def extract_title(self, text: str) -> str:
+        """Извлекает заголовок из текста поста"""
+        for line in text.split('\n', 3)[:3]:
+            line = line.strip()
+            if line and len(line) > 5:
+                title = TITLE_CLEAN_RE.sub('', line)
+                if len(title) > 50:
+                    title = title[:50] + "..."
+                return title or "Котик ищет дом"
+        return "Котик ищет дом"
+    
+    def extract_description(self, clean_text: str) -> str:
+        """Обрезает текст без контактов (пробелы уже сжаты) до описания"""
+        if len(clean_text) > self.DESCRIPTION_LENGTH:
+            return clean_text[:self.DESCRIPTION_LENGTH] + "..."
+        return clean_text or "Подробности в посте"
+
+
+class Channel:
+    """Канал или группа-источник объявлений"""
+    
+    __slots__ = ('username', 'url', 'type', 'title', 'city', 'refresh_interval', 'priority')
+    
+    def __init__(self, username: str, title: str, type: str = 'cats', url: Optional[str] = None,
+                 city: str = 'Ялта', refresh_interval: float = 3600, priority: int = 0):
+        self.username = sys.intern(username)
+        self.title = sys.intern(title)
+        self.type = sys.intern(type)
+        self.url = sys.intern(url or f'https://t.me/{username}')
+        self.city = sys.intern(city)
+        self.refresh_interval = refresh_interval
+        self.priority = priority
+    
+    def to_dict(self) -> Dict:
+        return {
+            'username': self.username, 'title': self.title, 'type': self.type, 'url': self.url,
+            'city': self.city, 'refresh_interval': self.refresh_interval, 'priority': self.priority
+        }
+
+
+class ChannelRegistry:
+    """Реестр каналов из конфигурации: интервалы, приоритеты и лимиты запросов по хостам"""
+    
+    DEFAULT_CHANNELS = [
+        {'username': 'cats_yalta', 'title': 'Котики Ялта (канал)', 'type': 'cats'},
+        {'username': 'cats_yalta_group', 'title': 'Котики Ялта (группа)', 'type': 'cats'}
+    ]
+    DEFAULT_HOST_LIMIT = {'rate': 1.0, 'burst': 4}
+    
+    def __init__(self, channels: List[Channel], host_limits: Optional[Dict[str, Dict]] = None):
+        # Сначала приоритетные каналы — в этом порядке они и обновляются
+        self.channels = sorted(channels, key=lambda c: -c.priority)
+        self.by_username = {c.username: c for c in self.channels}
+        self.host_limits = host_limits or {}
+        self.buckets = {}
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def load(cls, path: str, default_interval: float) -> 'ChannelRegistry':
+        """Читает JSON-конфигурацию; без файла используются каналы Ялты по умолчанию"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"⚠️ {path} не найден, используются каналы по умолчанию")
+            config = {}
+        
+        channels = []
+        for item in config.get('channels') or cls.DEFAULT_CHANNELS:
+            channels.append(Channel(
+                item['username'],
+                item.get('title', item['username']),
+                item.get('type', 'cats'),
+                url=item.get('url'),
+                city=item.get('city', 'Ялта'),
+                refresh_interval=float(item.get('refresh_interval', default_interval)),
+                priority=int(item.get('priority', 0))
+            ))
+        registry = cls(channels, config.get('hosts'))
+        logger.info(
+            f"📚 Каналов: {len(channels)}, городов: {len(registry.cities())}, "
+            f"типов: {', '.join(registry.types())}"
+        )
+        return registry
+    
+    def get(self, username: str) -> Optional[Channel]:
+        return self.by_username.get(username)
+    
+    def of_type(self, channel_type: str = 'all', city: Optional[str] = None) -> List[Channel]:
+        return [
+            c for c in self.channels
+            if (channel_type == 'all' or c.type == channel_type) and (city is None or c.city == city)
+        ]
+    
+    def types(self) -> List[str]:
+        return sorted({c.type for c in self.channels})
+    
+    def cities(self) -> List[str]:
+        return sorted({c.city for c in self.channels})
+    
+    def bucket_for(self, url: str) -> 'TokenBucket':
+        """Общий лимит запросов для всех каналов одного хоста"""
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                limit = self.host_limits.get(host, self.DEFAULT_HOST_LIMIT)
+                bucket = TokenBucket(float(limit.get('rate', 1.0)), float(limit.get('burst', 1)))
+                self.buckets[host] = bucket
+            return bucket
+
+
+class Post:
+    """Компактная запись поста; данные канала — ссылкой на общий Channel"""
+    
+    __slots__ = (
+        'id', 'channel', 'date', 'timestamp', 'title', 'description', 'contact', 'photo_url', 'video_url',
+        'duplicate_of', 'reposts', 'text'
+    )
+    
+    def __init__(self, id: int, channel: Channel, date: str, timestamp: float, title: str,
+                 description: str, contact: str, photo_url: Optional[str] = None, video_url: Optional[str] = None,
+                 duplicate_of: Optional[str] = None, reposts: tuple = (), text: Optional[str] = None):
+        self.id = id
+        self.channel = channel
+        # Даты и подписи по умолчанию повторяются у многих постов
+        self.date = sys.intern(date)
+        self.timestamp = timestamp
+        self.title = title
+        self.description = description
+        self.contact = sys.intern(contact)
+        self.photo_url = photo_url
+        self.video_url = video_url
+        # Перепост: URL основного поста; у основного — (название канала, URL) его перепостов
+        self.duplicate_of = duplicate_of
+        self.reposts = reposts
+        # Полный текст без контактов — только если description обрезано
+        self.text = text
+    
+    @property
+    def type(self) -> str:
+        return self.channel.type
+    
+    @property
+    def search_text(self) -> str:
+        """Текст для поиска, подписок и склейки перепостов: без обрезки описания"""
+        return f"{self.title} {self.text or self.description}"
+    
+    @property
+    def url(self) -> str:
+        return f"{self.channel.url}/{self.id}"
+    
+    @property
+    def has_media(self) -> bool:
+        return bool(self.photo_url or self.video_url)
+    
+    def to_dict(self) -> Dict:
+        """Словарь для JSON (API и хранилище)"""
+        return {
+            'id': self.id,
+            'channel_username': self.channel.username,
+            'channel': self.channel.title,
+            'channel_url': self.channel.url,
+            'type': self.channel.type,
+            'url': self.url,
+            'date': self.date,
+            'timestamp': self.timestamp,
+            'title': self.title,
+            'description': self.description,
+            'contact': self.contact,
+            'photo_url': self.photo_url,
+            'video_url': self.video_url,
+            'duplicate_of': self.duplicate_of,
+            'reposts': [list(repost) for repost in self.reposts],
+            'text': self.text
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict, channel: Channel) -> 'Post':
+        return cls(
+            int(data['id']), channel, data['date'], data['timestamp'], data['title'],
+            data['description'], data['contact'], data.get('photo_url'), data.get('video_url'),
+            data.get('duplicate_of'), tuple(tuple(repost) for repost in data.get('reposts') or ()),
+            data.get('text')
+        )
+
+
+class CacheBackend(ABC):
+    """Общий для всех процессов кэш: посты, служебные данные, аренды и счетчики.
+    
+    Реализации должны быть безопасны при одновременном доступе из нескольких
+    процессов (SQLite/WAL сейчас, Redis — при необходимости позже).
+    """
+    
+    @abstractmethod
+    def save_posts(self, channel: str, posts: List[Post]):
+        """Добавляет или обновляет посты канала"""
+    
+    @abstractmethod
+    def prune(self, channel: str, keep: int):
+        """Оставляет только keep самых новых постов канала"""
+    
+    @abstractmethod
+    def load_channel_posts(self) -> Dict[str, List[Dict]]:
+        """Все посты, сгруппированные по каналам (новые сначала)"""
+    
+    @abstractmethod
+    def load_posts(self, channel: str) -> List[Dict]:
+        """Посты одного канала (новые сначала)"""
+    
+    @abstractmethod
+    def query_posts(self, channel_type: str = 'all', limit: int = 5, since: float = 0, offset: int = 0,
+                    after: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """Посты нужного типа: без since — самые новые, с since или after — следующие по времени"""
+    
+    @abstractmethod
+    def get_meta(self, key: str, default=None):
+        """Читает служебное значение (default, если его нет)"""
+    
+    @abstractmethod
+    def set_meta(self, key: str, value):
+        """Сохраняет служебное значение"""
+    
+    @abstractmethod
+    def delete_meta(self, key: str):
+        """Удаляет служебное значение"""
+    
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Захватывает аренду на ttl секунд; True, если она наша"""
+    
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        """Освобождает аренду, если она принадлежит owner"""
+    
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1):
+        """Увеличивает общий счетчик"""
+    
+    @abstractmethod
+    def get_counter(self, key: str) -> int:
+        """Читает общий счетчик"""
+    
+    @abstractmethod
+    def get_post(self, channel: str, post_id: int) -> Optional[Dict]:
+        """Один пост по каналу и номеру"""
+    
+    @abstractmethod
+    def save_subscriptions(self, subscriptions: List[Tuple[int, Dict]]):
+        """Добавляет или заменяет подписки чатов"""
+    
+    @abstractmethod
+    def delete_subscription(self, chat_id: int):
+        """Удаляет подписку чата вместе с неотправленными уведомлениями"""
+    
+    @abstractmethod
+    def load_subscriptions(self) -> Dict[int, Dict]:
+        """Все подписки: {chat_id: фильтры}"""
+    
+    @abstractmethod
+    def enqueue_notifications(self, rows: List[Tuple[int, str, int]]):
+        """Ставит уведомления (chat_id, канал, номер поста) в очередь; повторы игнорируются"""
+    
+    @abstractmethod
+    def pending_notifications(self, after: int, limit: int) -> List[Tuple[int, int, str, int, float]]:
+        """Неотправленные уведомления (id, chat_id, канал, номер поста, время постановки) после id after"""
+    
+    @abstractmethod
+    def ack_notifications(self, ids: List[int]):
+        """Удаляет доставленные уведомления"""
+    
+    @abstractmethod
+    def retry_notifications(self, ids: List[int], max_attempts: int):
+        """Учитывает неудачную попытку; после max_attempts уведомление удаляется"""
+
+
+class PostStore(CacheBackend):
+    """Хранилище постов в SQLite (WAL), общее для всех воркеров и переживающее перезапуски"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS posts (
+            channel TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (channel, id)
+        );
+        CREATE INDEX IF NOT EXISTS idx_posts_type_timestamp ON posts (type, timestamp DESC);
+        CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp DESC);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            filters TEXT NOT NULL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            post_id INTEGER NOT NULL,
+            created REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            UNIQUE (chat_id, channel, post_id)
+        );
+    """
+    
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        # timeout — ожидание блокировки записи другим процессом
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(self.SCHEMA)
+        self.migrate()
+    
+    def migrate(self):
+        """Добавляет столбцы, появившиеся после создания базы"""
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(posts)')}
+        if 'duplicate_of' not in columns:
+            with self.conn:
+                self.conn.execute('ALTER TABLE posts ADD COLUMN duplicate_of TEXT')
+    
+    def save_posts(self, channel: str, posts: List[Post]):
+        """Добавляет или обновляет посты канала"""
+        rows = [
+            (channel, p.id, p.type, p.timestamp, json.dumps(p.to_dict(), ensure_ascii=False), p.duplicate_of)
+            for p in posts
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO posts (channel, id, type, timestamp, data, duplicate_of) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+    
+    def prune(self, channel: str, keep: int):
+        """Оставляет только keep самых новых постов канала"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'DELETE FROM posts WHERE channel = ? AND id NOT IN '
+                '(SELECT id FROM posts WHERE channel = ? ORDER BY id DESC LIMIT ?)',
+                (channel, channel, keep)
+            )
+    
+    def load_channel_posts(self) -> Dict[str, List[Dict]]:
+        """Загружает все посты, сгруппированные по каналам (новые сначала)"""
+        channel_posts = {}
+        with self.lock:
+            rows = self.conn.execute('SELECT channel, data FROM posts ORDER BY channel, id DESC').fetchall()
+        for channel, data in rows:
+            channel_posts.setdefault(channel, []).append(json.loads(data))
+        return channel_posts
+    
+    def load_posts(self, channel: str) -> List[Dict]:
+        """Посты одного канала (новые сначала)"""
+        with self.lock:
+            rows = self.conn.execute('SELECT data FROM posts WHERE channel = ? ORDER BY id DESC', (channel,)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def query_posts(self, channel_type: str = 'all', limit: int = 5, since: float = 0, offset: int = 0,
+                    after: Optional[Tuple[str, int]] = None) -> List[Dict]:
+        """Самые новые посты нужного типа через индекс (type, timestamp); offset — для страниц.
+        
+        С since — самые ранние из более новых по (timestamp, канал, номер), по возрастанию,
+        чтобы опрос с последнего полученного поста ничего не пропускал; after — (канал, номер)
+        этого поста: посты с тем же timestamp после него тоже отдаются.
+        Перепосты (duplicate_of) в выдачу не попадают.
+        """
+        where, params = 'duplicate_of IS NULL AND timestamp > ?', [since]
+        if after:
+            where = 'duplicate_of IS NULL AND (timestamp > ? OR (timestamp = ? AND (channel, id) > (?, ?)))'
+            params = [since, since, after[0], after[1]]
+        if channel_type != 'all':
+            where = f'type = ? AND {where}'
+            params.insert(0, channel_type)
+        order = 'timestamp, channel, id' if since else 'timestamp DESC'
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT data FROM posts WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?',
+                (*params, limit, offset)
+            ).fetchall()
+        return [json.loads(data) for (data,) in rows]
+    
+    def get_meta(self, key: str, default=None):
+        """Читает служебное значение"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+    
+    def set_meta(self, key: str, value):
+        """Сохраняет служебное значение"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (key, json.dumps(value, ensure_ascii=False))
+            )
+    
+    def delete_meta(self, key: str):
+        """Удаляет служебное значение"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM meta WHERE key = ?', (key,))
+    
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Захватывает аренду одним атомарным UPSERT"""
+        now = time.time()
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                'INSERT INTO leases (name, owner, expires) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires = excluded.expires '
+                'WHERE leases.expires < ? OR leases.owner = excluded.owner',
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount == 1
+    
+    def release_lease(self, name: str, owner: str):
+        """Освобождает аренду, если она принадлежит owner"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM leases WHERE name = ? AND owner = ?', (name, owner))
+    
+    def incr(self, key: str, amount: int = 1):
+        """Увеличивает общий счетчик"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT INTO counters (key, value) VALUES (?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET value = value + excluded.value',
+                (key, amount)
+            )
+    
+    def get_counter(self, key: str) -> int:
+        """Читает общий счетчик"""
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+    
+    def get_post(self, channel: str, post_id: int) -> Optional[Dict]:
+        """Один пост по каналу и номеру"""
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT data FROM posts WHERE channel = ? AND id = ?', (channel, post_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_subscriptions(self, subscriptions: List[Tuple[int, Dict]]):
+        """Добавляет или заменяет подписки чатов"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO subscriptions (chat_id, filters, created) VALUES (?, ?, ?)',
+                [(chat_id, json.dumps(filters, ensure_ascii=False), now) for chat_id, filters in subscriptions]
+            )
+    
+    def delete_subscription(self, chat_id: int):
+        """Удаляет подписку чата вместе с неотправленными уведомлениями"""
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+            self.conn.execute('DELETE FROM notifications WHERE chat_id = ?', (chat_id,))
+    
+    def load_subscriptions(self) -> Dict[int, Dict]:
+        """Все подписки: {chat_id: фильтры}"""
+        with self.lock:
+            rows = self.conn.execute('SELECT chat_id, filters FROM subscriptions').fetchall()
+        return {chat_id: json.loads(filters) for chat_id, filters in rows}
+    
+    def enqueue_notifications(self, rows: List[Tuple[int, str, int]]):
+        """Ставит уведомления (chat_id, канал, номер поста) в очередь; повторы игнорируются"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO notifications (chat_id, channel, post_id, created) VALUES (?, ?, ?, ?)',
+                [(chat_id, channel, post_id, now) for chat_id, channel, post_id in rows]
+            )
+    
+    def pending_notifications(self, after: int, limit: int) -> List[Tuple[int, int, str, int, float]]:
+        """Следующие уведомления очереди по порядку постановки"""
+        with self.lock:
+            return self.conn.execute(
+                'SELECT id, chat_id, channel, post_id, created FROM notifications WHERE id > ? ORDER BY id LIMIT ?',
+                (after, limit)
+            ).fetchall()
+    
+    def ack_notifications(self, ids: List[int]):
+        """Удаляет доставленные уведомления"""
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM notifications WHERE id = ?', [(i,) for i in ids])
+    
+    def retry_notifications(self, ids: List[int], max_attempts: int):
+        """Учитывает неудачную попытку; после max_attempts уведомление удаляется"""
+        with self.lock, self.conn:
+            self.conn.executemany('UPDATE notifications SET attempts = attempts + 1 WHERE id = ?', [(i,) for i in ids])
+            self.conn.execute('DELETE FROM notifications WHERE attempts >= ?', (max_attempts,))
+
+
+# Русский стеммер (упрощенный Snowball/Портер): окончания снимаются в области после первой гласной
+STEM_RV_RE = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+STEM_PERFECTIVE_GERUND_RE = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+STEM_REFLEXIVE_RE = re.compile(r'(с[яь])$')
+STEM_ADJECTIVE_RE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+STEM_PARTICIPLE_RE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+STEM_VERB_RE = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+STEM_NOUN_RE = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+STEM_DERIVATIONAL_RE = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+WORD_RE = re.compile(r'[а-яёa-z0-9]+')
+# Беглые гласные и супплетивные формы, которые стеммер не сводит к одной основе
+# (ключи — целые слова или основы)
+STEM_ALIASES = {'котенок': 'котенк', 'котят': 'котенк', 'щенок': 'щенк', 'щенят': 'щенк', 'кошечк': 'кошк'}
+
+
+@lru_cache(maxsize=100000)
+def stem_ru(word: str) -> str:
+    """Основа русского слова: «рыжего котенка» и «рыжий котенок» дают одинаковые основы"""
+    word = word.lower().replace('ё', 'е')
+    if word in STEM_ALIASES:
+        return STEM_ALIASES[word]
+    match = STEM_RV_RE.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+    
+    stripped = STEM_PERFECTIVE_GERUND_RE.sub('', rv, 1)
+    if stripped == rv:
+        rv = STEM_REFLEXIVE_RE.sub('', rv, 1)
+        stripped = STEM_ADJECTIVE_RE.sub('', rv, 1)
+        if stripped != rv:
+            rv = STEM_PARTICIPLE_RE.sub('', stripped, 1)
+        else:
+            stripped = STEM_VERB_RE.sub('', rv, 1)
+            rv = STEM_NOUN_RE.sub('', rv, 1) if stripped == rv else stripped
+    else:
+        rv = stripped
+    
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if STEM_DERIVATIONAL_RE.match(rv):
+        rv = re.sub(r'ость?$', '', rv)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = re.sub(r'(ейше|ейш)$', '', rv)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    stem = prefix + rv
+    return STEM_ALIASES.get(stem, stem)
+
+
+def stems_of(words) -> Dict[str, str]:
+    """{основа: значение} для словаря {значение: формы слова}"""
+    return {stem_ru(form): value for value, forms in words.items() for form in forms}
+
+
+# Атрибуты объявления по основам слов
+COLOR_STEMS = stems_of({
+    'рыжий': ('рыжий', 'рыжая', 'персиковый'),
+    'черный': ('черный', 'черная'),
+    'белый': ('белый', 'белая', 'белоснежный'),
+    'серый': ('серый', 'серая', 'голубой'),
+    'трехцветный': ('трехцветный', 'трехцветная', 'трехцветка'),
+    'полосатый': ('полосатый', 'полосатая', 'тигровый'),
+    'черепаховый': ('черепаховый', 'черепаховая'),
+    'дымчатый': ('дымчатый', 'дымчатая')
+})
+SEX_STEMS = stems_of({
+    'male': ('мальчик', 'кот', 'котик', 'кастрирован'),
+    'female': ('девочка', 'кошка', 'кошечка', 'стерилизована')
+})
+STERILIZED_STEMS = set(stems_of({True: ('стерилизован', 'стерилизована', 'кастрирован', 'кастрирована')}))
+VACCINATED_STEMS = set(stems_of({True: ('привит', 'привита', 'привиты', 'привитый', 'вакцинирован', 'вакцинирована', 'прививки')}))
+NEGATIONS = {'не', 'нет', 'без'}
+AGE_RE = re.compile(r'(?P<half>полгода)|(?P<value>\d+(?:[.,]\d+)?)\s*(?P<unit>нед|мес|год|лет)', re.IGNORECASE)
+AGE_UNIT_MONTHS = {'нед': 0.25, 'мес': 1, 'год': 12, 'лет': 12}
+
+
+def extract_attributes(text: str) -> Dict:
+    """Возраст (в месяцах), пол, окрасы, стерилизация и прививки из текста объявления"""
+    words = WORD_RE.findall(text.lower())
+    stems = [stem_ru(w) for w in words]
+    attributes = {'age_months': None, 'sex': None, 'colors': set(), 'sterilized': None, 'vaccinated': None}
+    for index, stem in enumerate(stems):
+        negated = index > 0 and words[index - 1] in NEGATIONS
+        if stem in COLOR_STEMS:
+            attributes['colors'].add(COLOR_STEMS[stem])
+        if attributes['sex'] is None and stem in SEX_STEMS:
+            attributes['sex'] = SEX_STEMS[stem]
+        if attributes['sterilized'] is None and stem in STERILIZED_STEMS:
+            attributes['sterilized'] = not negated
+        if attributes['vaccinated'] is None and stem in VACCINATED_STEMS:
+            attributes['vaccinated'] = not negated
+    
+    match = AGE_RE.search(text)
+    if match and match.group('half'):
+        attributes['age_months'] = 6.0
+    elif match:
+        value = float(match.group('value').replace(',', '.'))
+        attributes['age_months'] = round(value * AGE_UNIT_MONTHS[match.group('unit').lower()], 2)
+    return attributes
+
+
+class PostIndex:
+    """Инвертированный индекс постов в памяти: основы слов и атрибуты.
+    
+    Обновляется инкрементально при разборе страниц; поиск — пересечение
+    множеств, начиная с самого маленького, и выборка самых новых.
+    """
+    
+    # Слова запроса, которые становятся фильтрами атрибутов, а не поиском по тексту
+    # («кастрирован» — про стерилизацию, «кот» и «кошка» — обычные слова, а не пол)
+    QUERY_FACETS = (
+        ('sterilized', dict.fromkeys(STERILIZED_STEMS, True)),
+        ('vaccinated', dict.fromkeys(VACCINATED_STEMS, True)),
+        ('color', COLOR_STEMS),
+        ('sex', stems_of({'male': ('мальчик', 'мальчики'), 'female': ('девочка', 'девочки')}))
+    )
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.posts = {}
+        self.attributes = {}
+        self.post_terms = {}
+        self.terms = {}
+        self.facets = {}
+        # (-timestamp, ключ) по возрастанию — от новых к старым
+        self.order = []
+    
+    @staticmethod
+    def key(post: Post):
+        return (post.channel.username, post.id)
+    
+    @staticmethod
+    def facet_values(post: Post, attributes: Dict) -> List:
+        values = [('type', post.type), ('channel', post.channel.username)]
+        values.extend(('color', color) for color in attributes['colors'])
+        for name in ('sex', 'sterilized', 'vaccinated'):
+            if attributes[name] is not None:
+                values.append((name, attributes[name]))
+        return values
+    
+    def add(self, posts: List[Post]):
+        """Добавляет или обновляет посты"""
+        for post in posts:
+            text = post.search_text
+            terms = {stem_ru(word) for word in WORD_RE.findall(text.lower())}
+            attributes = extract_attributes(text)
+            key = self.key(post)
+            with self.lock:
+                if key in self.posts:
+                    self.discard(key)
+                self.posts[key] = post
+                self.attributes[key] = attributes
+                self.post_terms[key] = terms
+                for term in terms:
+                    self.terms.setdefault(term, set()).add(key)
+                for facet in self.facet_values(post, attributes):
+                    self.facets.setdefault(facet, set()).add(key)
+                bisect.insort(self.order, (-post.timestamp, key))
+    
+    def remove(self, posts: List[Post]):
+        """Удаляет посты, вытесненные из хранилища"""
+        with self.lock:
+            for post in posts:
+                key = self.key(post)
+                if key in self.posts:
+                    self.discard(key)
+    
+    def discard(self, key):
+        """Удаляет пост из всех множеств (вызывается под self.lock)"""
+        post = self.posts.pop(key)
+        attributes = self.attributes.pop(key)
+        for term in self.post_terms.pop(key):
+            keys = self.terms[term]
+            keys.discard(key)
+            if not keys:
+                del self.terms[term]
+        for facet in self.facet_values(post, attributes):
+            keys = self.facets.get(facet)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.facets[facet]
+        position = bisect.bisect_left(self.order, (-post.timestamp, key))
+        if position < len(self.order) and self.order[position][1] == key:
+            del self.order[position]
+    
+    def rebuild(self, posts: List[Post]):
+        """Строит индекс заново (после загрузки снимка из хранилища)"""
+        with self.lock:
+            self.posts, self.attributes, self.post_terms, self.terms, self.facets = {}, {}, {}, {}, {}
+            self.order = []
+        self.add(posts)
+    
+    @classmethod
+    def parse_query(cls, query: str) -> Tuple[List[str], Dict]:
+        """Разбивает запрос на основы для поиска по тексту и фильтры атрибутов"""
+        terms = []
+        filters = {}
+        words = WORD_RE.findall(query.lower())
+        for index, word in enumerate(words):
+            if word in NEGATIONS:
+                continue
+            stem = stem_ru(word)
+            negated = index > 0 and words[index - 1] in NEGATIONS
+            for name, stems in cls.QUERY_FACETS:
+                if stem in stems:
+                    value = stems[stem]
+                    filters[name] = (not value) if negated and isinstance(value, bool) else value
+                    break
+            else:
+                terms.append(stem)
+        return terms, filters
+    
+    def search(self, query: str = '', channel_type: str = 'all', limit: int = 5,
+               filters: Optional[Dict] = None, since: float = 0,
+               after: Optional[Tuple[str, int]] = None) -> List[Post]:
+        """Самые новые посты, содержащие все слова запроса и подходящие под фильтры.
+        
+        С since (и after) — самые ранние после курсора, по возрастанию, как PostStore.query_posts.
+        filters: color, sex, sterilized, vaccinated, channel, max_age (месяцы).
+        """
+        terms, query_filters = self.parse_query(query)
+        filters = dict(query_filters, **(filters or {}))
+        max_age = filters.pop('max_age', None)
+        if channel_type != 'all':
+            filters['type'] = channel_type
+        
+        with self.lock:
+            sets = [self.terms.get(term, set()) for term in terms]
+            sets.extend(self.facets.get((name, value), set()) for name, value in filters.items())
+            if not sets and max_age is None:
+                return []
+            sets.sort(key=len)
+            smallest, others = (sets[0], sets[1:]) if sets else (self.posts.keys(), [])
+            
+            def accept(key) -> bool:
+                if any(key not in keys for keys in others):
+                    return False
+                if max_age is None:
+                    return True
+                age = self.attributes[key]['age_months']
+                return age is not None and age <= max_age
+            
+            # Частые слова дешевле проверять обходом от новых к старым с ранним выходом,
+            # редкие — перебором самого маленького множества без полного пересечения
+            if since:
+                def after_cursor(key) -> bool:
+                    timestamp = self.posts[key].timestamp
+                    return timestamp > since or (after is not None and timestamp == since and key > after)
+                
+                if len(smallest) * 8 > len(self.order):
+                    # Посты не старше since — начало self.order (от новых к старым)
+                    candidates = []
+                    for negative_timestamp, key in self.order:
+                        if -negative_timestamp < since:
+                            break
+                        if key in smallest:
+                            candidates.append(key)
+                else:
+                    candidates = smallest
+                keys = heapq.nsmallest(
+                    limit, (k for k in candidates if after_cursor(k) and accept(k)),
+                    key=lambda k: (self.posts[k].timestamp, k)
+                )
+            elif len(smallest) * 8 > len(self.order):
+                keys = []
+                for _, key in self.order:
+                    if key in smallest and accept(key):
+                        keys.append(key)
+                        if len(keys) >= limit:
+                            break
+            else:
+                keys = heapq.nlargest(
+                    limit, (k for k in smallest if accept(k)), key=lambda k: self.posts[k].timestamp
+                )
+            return [self.posts[key] for key in keys]
+    
+    def attributes_of(self, post: Post) -> Optional[Dict]:
+        with self.lock:
+            return self.attributes.get(self.key(post))
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.posts)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+MASK64 = (1 << 64) - 1
+# MinHash одной перестановкой: старшие биты хэша шингла выбирают ячейку, в ячейке — минимум
+MINHASH_BITS = int(os.environ.get('DEDUP_MINHASH_BITS', 4))
+# Порядок, в котором пустая ячейка ищет непустую: свой случайный для каждой ячейки, одинаковый для всех текстов
+MINHASH_PROBES = [
+    random.Random(cell).sample(range(1 << MINHASH_BITS), 1 << MINHASH_BITS) for cell in range(1 << MINHASH_BITS)
+]
+
+
+@lru_cache(maxsize=200000)
+def shingle_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big')
+
+
+def text_shingles(text: str, min_words: int = 6) -> Optional[frozenset]:
+    """Хэши пар соседних основ; короткие тексты («Подробности в посте») не сравниваются"""
+    stems = [stem_ru(word) for word in WORD_RE.findall(text.lower())]
+    if len(stems) < min_words:
+        return None
+    return frozenset(shingle_hash(f"{a} {b}") for a, b in zip(stems, stems[1:]))
+
+
+def minhash(shingles: frozenset) -> Tuple[int, ...]:
+    """Сигнатура из 2^MINHASH_BITS минимумов за один проход по шинглам.
+    
+    У короткого текста шинглов меньше, чем ячеек: пустая ячейка берет значение
+    первой непустой в своем порядке MINHASH_PROBES. Иначе полосы из пустых ячеек
+    совпадали бы у всех коротких постов, а при заполнении соседней ячейкой полоса
+    зависела бы от одного-двух общих шинглов («ищет дом», «звоните 7»).
+    """
+    shift = 64 - MINHASH_BITS
+    size = 1 << MINHASH_BITS
+    signature = [MASK64] * size
+    for value in shingles:
+        cell = value >> shift
+        if value < signature[cell]:
+            signature[cell] = value
+    empty = [cell for cell, value in enumerate(signature) if value == MASK64]
+    if empty and len(empty) < size:
+        filled = tuple(signature)
+        for cell in empty:
+            signature[cell] = next(filled[probe] for probe in MINHASH_PROBES[cell] if filled[probe] != MASK64)
+    return tuple(signature)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b)
+
+
+def image_fingerprint(content: bytes) -> Optional[int]:
+    """Перцептивный dHash превью: 64 сравнения соседних пикселей уменьшенной копии"""
+    if not PIL_AVAILABLE:
+        return None
+    with Image.open(io.BytesIO(content)) as image:
+        pixels = list(image.convert('L').resize((9, 8), Image.BILINEAR).getdata())
+    result = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            result = result << 1 | (left > pixels[row * 9 + col + 1])
+    return result
+
+
+class HammingIndex:
+    """Поиск 64-битных хэшей на расстоянии не больше distance.
+    
+    Хэш делится на distance + 1 полос: у близких хэшей хотя бы одна полоса
+    совпадает точно, поэтому кандидаты берутся из словарей полос.
+    """
+    
+    def __init__(self, distance: int):
+        self.distance = distance
+        bands = distance + 1
+        width = 64 // bands
+        self.bands = [
+            (index * width, (1 << (width if index < bands - 1 else 64 - index * width)) - 1)
+            for index in range(bands)
+        ]
+        self.tables = [{} for _ in self.bands]
+        self.hashes = {}
+    
+    def add(self, key, value: int):
+        self.hashes[key] = value
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault(value >> shift & mask, set()).add(key)
+    
+    def remove(self, key):
+        value = self.hashes.pop(key, None)
+        if value is None:
+            return
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            keys = table.get(value >> shift & mask)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del table[value >> shift & mask]
+    
+    def find(self, value: int, accept: Callable = lambda key: True):
+        """Ближайший подходящий ключ в пределах distance (None, если такого нет)"""
+        best, best_distance = None, self.distance + 1
+        seen = set()
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for key in table.get(value >> shift & mask, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                distance = hamming(value, self.hashes[key])
+                if distance < best_distance and accept(key):
+                    best, best_distance = key, distance
+                    if distance == 0:
+                        return best
+        return best
+    
+    def clear(self):
+        self.tables = [{} for _ in self.bands]
+        self.hashes = {}
+
+
+class MinHashIndex:
+    """Поиск похожих текстов: LSH по полосам MinHash-сигнатуры, кандидаты проверяются точным Жаккаром"""
+    
+    def __init__(self, threshold: float, rows: int = 4):
+        self.threshold = threshold
+        self.rows = rows
+        self.tables = [{} for _ in range((1 << MINHASH_BITS) // rows)]
+        self.shingles = {}
+        self.signatures = {}
+    
+    def bands(self, signature: Tuple[int, ...]):
+        return [signature[i:i + self.rows] for i in range(0, len(self.tables) * self.rows, self.rows)]
+    
+    def add(self, key, shingles: frozenset, signature: Tuple[int, ...]):
+        self.shingles[key] = shingles
+        self.signatures[key] = signature
+        for table, band in zip(self.tables, self.bands(signature)):
+            table.setdefault(band, set()).add(key)
+    
+    def remove(self, key):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        del self.shingles[key]
+        for table, band in zip(self.tables, self.bands(signature)):
+            keys = table.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del table[band]
+    
+    def find(self, shingles: frozenset, signature: Tuple[int, ...], accept: Callable = lambda key: True):
+        """Самый похожий подходящий ключ с Жаккаром не ниже threshold (None, если такого нет)"""
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for table, band in zip(self.tables, self.bands(signature)):
+            for key in table.get(band, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                if not accept(key):
+                    continue
+                similarity = jaccard(shingles, self.shingles[key])
+                if similarity >= best_similarity:
+                    best, best_similarity = key, similarity
+                    if similarity == 1.0:
+                        return best
+        return best
+    
+    def clear(self):
+        self.tables = [{} for _ in self.tables]
+        self.shingles = {}
+        self.signatures = {}
+
+
+class DuplicateDetector:
+    """Склейка перепостов между каналами: MinHash текста и dHash превью.
+    
+    Первый увиденный пост остается основным и получает ссылки на перепосты,
+    перепост помечается duplicate_of и в выдачу не попадает.
+    """
+    
+    def __init__(self, image_hash: Optional[Callable[[str, bool], Optional[int]]] = None):
+        self.text = MinHashIndex(float(os.environ.get('DEDUP_TEXT_SIMILARITY', 0.8)))
+        self.images = HammingIndex(int(os.environ.get('DEDUP_IMAGE_DISTANCE', 4)))
+        self.image_hash = image_hash
+        self.posts = {}
+        self.lock = threading.Lock()
+    
+    def fingerprints(self, post: Post, fetch: bool = False):
+        """(шинглы, MinHash-сигнатура) текста и dHash превью; None — сравнивать нечего"""
+        shingles = text_shingles(post.search_text)
+        text = (shingles, minhash(shingles)) if shingles else None
+        source = post.photo_url or post.video_url
+        image_hash = self.image_hash(source, fetch) if self.image_hash and source else None
+        return text, image_hash
+    
+    def register(self, post: Post, text: Optional[Tuple], image_hash: Optional[int]):
+        """Делает пост кандидатом для сравнения (вызывается под self.lock)"""
+        self.posts[post.url] = post
+        if text is not None:
+            self.text.add(post.url, *text)
+        if image_hash is not None:
+            self.images.add(post.url, image_hash)
+    
+    def check(self, post: Post) -> Optional[Post]:
+        """Основной пост, перепостом которого является post; иначе post становится основным.
+        
+        Превью сравниваются только по уже посчитанным хэшам; новые превью скачивает
+        фоновый поток парсера и досравнивает через check_image.
+        """
+        # Хэши — вне блокировки
+        text, image_hash = self.fingerprints(post)
+        
+        def other_channel(url) -> bool:
+            return self.posts[url].channel is not post.channel
+        
+        with self.lock:
+            url = None
+            if text is not None:
+                url = self.text.find(*text, other_channel)
+            if url is None and image_hash is not None:
+                url = self.images.find(image_hash, other_channel)
+            if url is None:
+                self.register(post, text, image_hash)
+                return None
+            canonical = self.posts[url]
+            post.duplicate_of = canonical.url
+            if post.url not in (link for _, link in canonical.reposts):
+                canonical.reposts = canonical.reposts + ((post.channel.title, post.url),)
+            return canonical
+    
+    def pending_image(self, post: Post) -> Optional[str]:
+        """Превью основного поста, хэш которого еще не посчитан (None — скачивать нечего)"""
+        source = post.photo_url or post.video_url
+        if not self.image_hash or not source or post.duplicate_of:
+            return None
+        with self.lock:
+            if self.posts.get(post.url) is not post or post.url in self.images.hashes:
+                return None
+        return source
+    
+    def check_image(self, post: Post, image_hash: int) -> Optional[Post]:
+        """Досравнивает основной пост по скачанному превью; перепостом он становится,
+        только если на него самого еще никто не ссылается"""
+        def other_channel(url) -> bool:
+            return self.posts[url].channel is not post.channel
+        
+        with self.lock:
+            if self.posts.get(post.url) is not post or post.duplicate_of:
+                return None
+            url = None if post.reposts else self.images.find(image_hash, other_channel)
+            if url is None:
+                self.images.add(post.url, image_hash)
+                return None
+            del self.posts[post.url]
+            self.text.remove(post.url)
+            canonical = self.posts[url]
+            post.duplicate_of = canonical.url
+            if post.url not in (link for _, link in canonical.reposts):
+                canonical.reposts = canonical.reposts + ((post.channel.title, post.url),)
+            return canonical
+    
+    def remove(self, posts: List[Post]):
+        """Забывает посты, вытесненные из хранилища"""
+        with self.lock:
+            for post in posts:
+                if self.posts.pop(post.url, None) is not None:
+                    self.text.remove(post.url)
+                    self.images.remove(post.url)
+    
+    def add(self, posts: List[Post]):
+        """Регистрирует основные посты без сравнения; превью берутся только из кэша хэшей"""
+        fingerprints = [(post, self.fingerprints(post)) for post in posts if not post.duplicate_of]
+        with self.lock:
+            for post, (text, image_hash) in fingerprints:
+                self.register(post, text, image_hash)
+    
+    def rebuild(self, posts: List[Post]):
+        """Заново регистрирует основные посты (после загрузки снимка из хранилища)"""
+        with self.lock:
+            self.posts = {}
+            self.text.clear()
+            self.images.clear()
+        self.add(posts)
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.posts)
+
+
 class AdvancedChannelParser:
     """Парсер групп и каналов о животных в Ялте"""
     
     def __init__(self):
-        self.channels = [
-            {
-                'username': 'cats_yalta',
-                'url': 'https://t.me/cats_yalta',
-                'type': 'cats',
-                'title': 'Котики Ялта (канал)'
-            },
-            {
-                'username': 'cats_yalta_group',
-                'url': 'https://t.me/cats_yalta_group',
-                'type': 'cats',
-                'title': 'Котики Ялта (группа)'
-            }
-        ]
+        self.refresh_interval = int(os.environ.get('REFRESH_INTERVAL', 3600))
+        self.registry = ChannelRegistry.load(
+            os.environ.get('CHANNELS_CONFIG', 'assets/channels.json'), self.refresh_interval
+        )
+        self.channels = self.registry.channels
+        self.channels_by_username = self.registry.by_username
         self.posts_cache = []
         self.last_update = None
+        
+        # Параллельная загрузка каналов
+        self.concurrent_fetch = os.environ.get('PARSER_CONCURRENT', '1') != '0'
+        self.request_timeout = float(os.environ.get('PARSER_REQUEST_TIMEOUT', 15))
+        self.refresh_deadline = float(os.environ.get('PARSER_DEADLINE', 30))
+        self.max_workers = int(os.environ.get('PARSER_MAX_WORKERS', 4))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='parser')
+        # Номер обновления, которому принадлежит загрузка канала: задачи, брошенные по дедлайну, его теряют
+        self.fetch_round = 0
+        self.fetch_tokens = {}
+        self.channel_locks = {channel.username: threading.Lock() for channel in self.channels}
+        
+        # Общая HTTP-сессия и условные запросы (ETag / Last-Modified)
+        self.web_base = os.environ.get('TELEGRAM_WEB_URL', 'https://t.me').rstrip('/')
+        self.session = self.create_session()
+        self.http_cache = {}
+        self.stats_lock = threading.Lock()
+        self.refresh_stats = self.empty_refresh_stats()
+        self.last_refresh_stats = None
+        
+        # Инкрементальный парсинг: хранилище постов и последний номер по каналам
+        self.channel_posts = {}
+        self.last_seen_ids = {}
+        self.oldest_seen_ids = {}
+        # Метка сохранения состояния канала, которое отражено в памяти этого процесса
+        self.channel_saved = {}
+        self.max_posts_per_channel = int(os.environ.get('PARSER_MAX_POSTS', 200))
+        self.parser_backend = self.select_backend(os.environ.get('PARSER_BACKEND', 'lxml'))
+        
+        keywords = [k.strip() for k in os.environ.get('ANIMAL_KEYWORDS', '').split(',') if k.strip()]
+        self.extractor = TextExtractor(keywords or DEFAULT_ANIMAL_KEYWORDS)
+        
+        # Постоянное хранилище: после перезапуска посты доступны сразу
+        self.store = PostStore(os.environ.get('POSTS_DB', 'data/posts.db'))
+        # Поиск по тексту и атрибутам всех постов в памяти
+        self.index = PostIndex()
+        
+        # Склейка перепостов между каналами; превью скачиваются один раз ради хэша
+        self.dedup = os.environ.get('DEDUP', '1') != '0'
+        self.dedup_images = PIL_AVAILABLE and os.environ.get('DEDUP_IMAGES', '1') != '0'
+        self.duplicates = DuplicateDetector(self.image_hash if self.dedup_images else None)
+        # Новые превью хэширует фоновый поток: CDN ограничен 1 запросом в секунду и не тормозит обновление
+        self.image_queue = queue.Queue(maxsize=int(os.environ.get('DEDUP_IMAGE_QUEUE', 1000)))
+        self.image_thread = None
+        self.image_lock = threading.Lock()
+        # Вызывается с новыми постами, найденными при обновлении (рассылка подписчикам)
+        self.on_new_posts = None
+        
+        # Фоновое обновление кэша (stale-while-revalidate)
+        self.refresh_check_interval = int(os.environ.get('REFRESH_CHECK_INTERVAL', 60))
+        self.refresh_lock = threading.Lock()
+        self.last_refresh_duration = None
+        self.refresh_thread = None
+        self.stop_event = threading.Event()
+        
+        # Между воркерами gunicorn каждый канал обновляет владелец его аренды
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.refresh_retry_at = 0.0
+        
+        # Планировщик: каждый канал обновляется по своему интервалу, сроки разнесены во времени
+        self.next_refresh = {}
+        self.max_due_per_tick = int(os.environ.get('REFRESH_MAX_CHANNELS_PER_TICK', self.max_workers * 2))
+        
+        # Поколение постов, до которого индекс этого процесса сверен с хранилищем
+        self.synced_generation = self.generation()
+        self.sync_lock = threading.Lock()
+        self.load_from_store()
+        self.spread_schedule()
     
-    def get_channel_posts(self, channel_type: str = 'all', limit: int = 5) -> List[Dict]:
-        """Получает последние посты с фото из всех каналов"""
+    def load_from_store(self):
+        """Восстанавливает посты и состояние парсера из хранилища"""
         try:
-            posts = []
+            started = time.perf_counter()
+            self.channel_posts = {
+                username: self.posts_from_rows(rows)
+                for username, rows in self.store.load_channel_posts().items()
+                if username in self.channels_by_username
+            }
+            stored_posts = [p for posts in self.channel_posts.values() for p in posts]
+            self.index.rebuild([p for p in stored_posts if not p.duplicate_of])
+            if self.dedup:
+                self.duplicates.rebuild(stored_posts)
+            state = self.store.get_meta('parser_state', {})
+            self.last_seen_ids, self.oldest_seen_ids, self.http_cache, self.channel_saved = {}, {}, {}, {}
             for channel in self.channels:
-                if channel_type != 'all' and channel['type'] != channel_type:
-                    continue
-                    
-                web_url = f'https://t.me/s/{channel["username"]}'
-                logger.info(f"🌐 Загрузка постов с {web_url}")
-                response = requests.get(web_url, headers={
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }, timeout=15)
-                response.raise_for_status()
-                
-                soup = BeautifulSoup(response.content, 'html.parser')
-                message_divs = soup.find_all('div', class_='tgme_widget_message')
-                
-                for div in message_divs[:limit*2]:
-                    post_data = self.parse_message_div(div, channel)
-                    if post_data and self.is_animal_related(post_data.get('text', '')):
-                        posts.append(post_data)
-                        if len(posts) >= limit:
-                            break
-            
-            # Сортируем по дате (новые сначала)
-            posts.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-            
-            if posts:
-                self.posts_cache = posts[:limit]
-                self.last_update = datetime.now()
-                logger.info(f"✅ Получено {len(posts)} постов (с фото: {sum(1 for p in posts if p['photo_url'])})")
+                username = channel.username
+                channel_state = self.store.get_meta(f'parser_state:{username}')
+                if channel_state is None:
+                    # Снимок прежнего формата: словари всех каналов под одним ключом
+                    channel_state = {
+                        'last_seen_id': state.get('last_seen_ids', {}).get(username),
+                        'oldest_seen_id': state.get('oldest_seen_ids', {}).get(username),
+                        'http_cache': state.get('http_cache', {}).get(username)
+                    }
+                self.apply_channel_state(username, channel_state)
+            if state.get('last_update'):
+                self.last_update = datetime.fromisoformat(state['last_update'])
+            self.posts_cache = self.posts_from_rows(self.store.query_posts('all'))
+            logger.info(
+                f"💾 Из хранилища загружено {sum(len(p) for p in self.channel_posts.values())} постов "
+                f"за {(time.perf_counter() - started) * 1000:.1f} мс"
+            )
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения хранилища: {e}")
+    
+    def posts_from_rows(self, rows: List[Dict]) -> List[Post]:
+        """Восстанавливает посты из хранилища, связывая их с настроенными каналами"""
+        posts = []
+        for data in rows:
+            channel = self.channels_by_username.get(data.get('channel_username'))
+            if channel:
+                posts.append(Post.from_dict(data, channel))
+        return posts
+    
+    def apply_channel_state(self, username: str, state: Dict):
+        """Номера сообщений и HTTP-валидаторы канала из сохраненного состояния"""
+        for field, values in (
+            ('last_seen_id', self.last_seen_ids),
+            ('oldest_seen_id', self.oldest_seen_ids),
+            ('http_cache', self.http_cache)
+        ):
+            if state.get(field) is not None:
+                values[username] = state[field]
             else:
-                logger.warning("⚠️ Не найдено подходящих постов")
-                
-            return posts[:limit] or self.get_mock_posts(channel_type)
+                values.pop(username, None)
+        self.channel_saved[username] = state.get('saved')
+    
+    def sync_from_store(self):
+        """Подхватывает каналы, обновленные другими воркерами; остальные каналы не перечитываются"""
+        with self.sync_lock:
+            changed = []
+            for channel in self.channels:
+                state = self.store.get_meta(f'parser_state:{channel.username}')
+                if state and state.get('saved') != self.channel_saved.get(channel.username):
+                    self.apply_channel_state(channel.username, state)
+                    changed.append(channel)
+            if not changed:
+                return
+            for channel in changed:
+                stored = self.channel_posts.get(channel.username, [])
+                posts = self.posts_from_rows(self.store.load_posts(channel.username))
+                self.index.remove(stored)
+                self.index.add([p for p in posts if not p.duplicate_of])
+                if self.dedup:
+                    self.duplicates.remove(stored)
+                    self.duplicates.add(posts)
+                self.channel_posts[channel.username] = posts
+            self.posts_cache = self.posts_from_rows(self.store.query_posts('all'))
+            shared_update = self.store.get_meta('parser_state', {}).get('last_update')
+            if shared_update:
+                shared_update = datetime.fromisoformat(shared_update)
+                if not self.last_update or shared_update > self.last_update:
+                    self.last_update = shared_update
+            logger.info(f"🔃 Подхвачены каналы других воркеров: {len(changed)}")
+    
+    def save_state(self, usernames: List[str]):
+        """Сохраняет состояние обновленных каналов — у каждого свой ключ, чужие каналы не затираются"""
+        saved = time.time()
+        for username in usernames:
+            self.store.set_meta(f'parser_state:{username}', {
+                'last_seen_id': self.last_seen_ids.get(username),
+                'oldest_seen_id': self.oldest_seen_ids.get(username),
+                'http_cache': self.http_cache.get(username),
+                'saved': saved
+            })
+            self.channel_saved[username] = saved
+        self.store.set_meta('parser_state', {
+            'last_update': self.last_update.isoformat() if self.last_update else None
+        })
+    
+    def create_session(self) -> requests.Session:
+        """Создает HTTP-сессию с keep-alive пулом соединений"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': ACCEPT_ENCODING
+        })
+        return session
+    
+    def empty_refresh_stats(self) -> Dict:
+        """Счетчики одного обновления"""
+        return {'bytes': 0, 'fetched': 0, 'not_modified': 0, 'unchanged': 0, 'parse_time_saved': 0.0}
+    
+    def record_refresh_stat(self, key: str, value):
+        """Потокобезопасно увеличивает счетчик текущего обновления"""
+        with self.stats_lock:
+            self.refresh_stats[key] += value
+    
+    def response_size(self, response) -> int:
+        """Количество байт, полученных по сети (до распаковки)"""
+        try:
+            return response.raw.tell()
+        except Exception:
+            return len(response.content)
+    
+    def fetch_channel_posts(self, channel: Channel, limit: int = 5, token: Optional[int] = None) -> List[Post]:
+        """Загружает и парсит посты одного канала; token — номер обновления из fetch_all_channels"""
+        username = channel.username
+        web_url = f'{self.web_base}/s/{username}'
+        cached = self.http_cache.get(username, {})
+        
+        headers = {}
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        
+        logger.info(f"🌐 Загрузка постов с {web_url}")
+        self.registry.bucket_for(web_url).acquire()
+        fetch_started = time.perf_counter()
+        response = self.session.get(web_url, headers=headers, timeout=self.request_timeout)
+        METRICS.observe('catbot_parser_fetch_seconds', time.perf_counter() - fetch_started, channel=username)
+        size = self.response_size(response)
+        METRICS.inc('catbot_parser_bytes_total', size, channel=username)
+        self.record_refresh_stat('bytes', size)
+        self.record_refresh_stat('fetched', 1)
+        
+        # Страница не изменилась — повторный парсинг не нужен
+        if response.status_code == 304 and cached:
+            METRICS.inc('catbot_parser_not_modified_total', channel=username)
+            self.record_refresh_stat('not_modified', 1)
+            self.record_refresh_stat('parse_time_saved', cached['parse_time'])
+            logger.info(f"♻️ {username}: не изменился (304)")
+            return self.channel_posts.get(username, [])[:limit]
+        response.raise_for_status()
+        
+        body_hash = hashlib.sha1(response.content).hexdigest()
+        if body_hash == cached.get('hash'):
+            METRICS.inc('catbot_parser_not_modified_total', channel=username)
+            self.record_refresh_stat('unchanged', 1)
+            self.record_refresh_stat('parse_time_saved', cached['parse_time'])
+            logger.info(f"♻️ {username}: содержимое не изменилось")
+            return self.channel_posts.get(username, [])[:limit]
+        
+        with self.channel_locks[username]:
+            # Обновление уже ушло по дедлайну: поздний ответ не меняет посты и валидаторы канала
+            if token is not None and self.fetch_tokens.get(username) != token:
+                logger.info(f"⌛ {username}: ответ пришел после дедлайна и отброшен")
+                return []
+            parse_started = time.perf_counter()
+            new_count = self.ingest_page(channel, response.content)
+            METRICS.observe('catbot_parser_parse_seconds', time.perf_counter() - parse_started, channel=username)
+            METRICS.inc('catbot_parser_new_posts_total', new_count, channel=username)
+            logger.info(f"🆕 {username}: новых постов {new_count}")
             
+            self.http_cache[username] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'hash': body_hash,
+                'parse_time': time.perf_counter() - parse_started
+            }
+        return self.channel_posts.get(username, [])[:limit]
+    
+    def select_backend(self, backend: str) -> str:
+        """Выбирает бэкенд парсинга HTML из настроек"""
+        if backend not in PARSER_BACKENDS:
+            logger.warning(f"⚠️ Неизвестный PARSER_BACKEND={backend}, используется html.parser")
+            return 'html.parser'
+        if backend != 'html.parser' and not LXML_AVAILABLE:
+            logger.warning("⚠️ lxml не установлен, используется html.parser")
+            return 'html.parser'
+        logger.info(f"🧩 Бэкенд парсинга: {backend}")
+        return backend
+    
+    def extract_message_nodes(self, content: bytes) -> List:
+        """Возвращает узлы сообщений страницы, не строя лишнего дерева"""
+        if self.parser_backend == 'lxml-xpath':
+            return XPATH_MESSAGES(lxml.html.fromstring(content))
+        if self.parser_backend == 'lxml':
+            soup = BeautifulSoup(content, 'lxml', parse_only=MESSAGE_STRAINER)
+        else:
+            soup = BeautifulSoup(content, 'html.parser')
+        return soup.find_all('div', class_='tgme_widget_message')
+    
+    def parse_message_node(self, node, channel: Channel) -> Optional[Post]:
+        """Парсит узел сообщения выбранным бэкендом"""
+        if self.parser_backend == 'lxml-xpath':
+            return self.parse_message_element(node, channel)
+        return self.parse_message_div(node, channel)
+    
+    def message_id(self, div) -> int:
+        """Номер сообщения из атрибута data-post (0, если его нет)"""
+        try:
+            return int(div.get('data-post', '').split('/')[-1])
+        except ValueError:
+            return 0
+    
+    def ingest_page(self, channel: Channel, content: bytes, backfill: bool = False) -> int:
+        """Парсит только неизвестные сообщения страницы и добавляет их в хранилище канала"""
+        username = channel.username
+        last_seen = self.last_seen_ids.get(username, 0)
+        stored = self.channel_posts.get(username, [])
+        known_ids = {p.id for p in stored}
+        
+        message_divs = self.extract_message_nodes(content)
+        
+        new_posts = []
+        newest_id = last_seen
+        oldest_id = self.oldest_seen_ids.get(username)
+        # Сообщения на странице идут от старых к новым — разбираем с конца
+        # и останавливаемся на первом уже известном номере
+        for div in reversed(message_divs):
+            msg_id = self.message_id(div)
+            if not msg_id:
+                continue
+            if not backfill and msg_id <= last_seen:
+                break
+            newest_id = max(newest_id, msg_id)
+            oldest_id = msg_id if oldest_id is None else min(oldest_id, msg_id)
+            if msg_id in known_ids:
+                continue
+            post_data = self.parse_message_node(div, channel)
+            if post_data:
+                new_posts.append(post_data)
+        
+        if new_posts:
+            self.collapse_duplicates(new_posts)
+            merged = new_posts + stored
+            merged.sort(key=lambda p: p.id, reverse=True)
+            self.channel_posts[username] = merged[:self.max_posts_per_channel]
+            self.index.add([p for p in new_posts if not p.duplicate_of])
+            self.index.remove(merged[self.max_posts_per_channel:])
+            self.duplicates.remove(merged[self.max_posts_per_channel:])
+            self.store.save_posts(username, new_posts)
+            self.store.prune(username, self.max_posts_per_channel)
+            # Новое поколение кэша: готовые HTTP-ответы всех воркеров устаревают
+            self.store.incr('posts_generation')
+            # Первая загрузка канала и догрузка истории — не новые посты
+            if self.on_new_posts and last_seen and not backfill:
+                self.announce([p for p in new_posts if p.id > last_seen and not p.duplicate_of])
+        self.last_seen_ids[username] = newest_id
+        if oldest_id is not None:
+            self.oldest_seen_ids[username] = oldest_id
+        return len(new_posts)
+    
+    def announce(self, posts: List[Post]):
+        """Передает новые посты подписчику on_new_posts; его ошибки не прерывают обновление"""
+        if not posts:
+            return
+        try:
+            self.on_new_posts(posts)
+        except Exception as e:
+            logger.error(f"❌ Ошибка рассылки новых постов: {e}")
+    
+    def collapse_duplicates(self, posts: List[Post]):
+        """Помечает перепосты из других каналов и сохраняет ссылки на них в основных постах"""
+        if not self.dedup:
+            return
+        updated = {}
+        for post in posts:
+            canonical = self.duplicates.check(post)
+            if canonical is not None:
+                updated[canonical.url] = canonical
+                METRICS.inc('catbot_parser_duplicates_total', channel=post.channel.username)
+                logger.info(f"🔁 {post.url} — перепост {canonical.url}")
+        for canonical in updated.values():
+            self.store.save_posts(canonical.channel.username, [canonical])
+        if self.dedup_images:
+            for post in posts:
+                if self.duplicates.pending_image(post):
+                    self.queue_image(post)
+    
+    def queue_image(self, post: Post):
+        """Ставит превью поста в очередь фонового хэширования"""
+        with self.image_lock:
+            if not (self.image_thread and self.image_thread.is_alive()):
+                self.image_thread = threading.Thread(target=self.image_loop, name='parser-images', daemon=True)
+                self.image_thread.start()
+        try:
+            self.image_queue.put_nowait(post)
+        except queue.Full:
+            logger.warning(f"⚠️ Очередь превью заполнена, {post.url} сравнивается только по тексту")
+    
+    def image_loop(self):
+        """Скачивает превью по одному (с лимитом хоста) и досравнивает посты"""
+        while not self.stop_event.is_set():
+            try:
+                post = self.image_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                self.fingerprint_image(post)
+            except Exception as e:
+                logger.error(f"❌ Ошибка сравнения превью {post.url}: {e}")
+            finally:
+                self.image_queue.task_done()
+    
+    def fingerprint_image(self, post: Post):
+        """Хэш превью поста; найденный по нему перепост убирается из выдачи"""
+        source = self.duplicates.pending_image(post)
+        value = self.image_hash(source) if source else None
+        if value is None:
+            return
+        canonical = self.duplicates.check_image(post, value)
+        if canonical is None:
+            return
+        METRICS.inc('catbot_parser_duplicates_total', channel=post.channel.username)
+        logger.info(f"🔁 {post.url} — перепост {canonical.url} (по превью)")
+        self.index.remove([post])
+        self.store.save_posts(post.channel.username, [post])
+        self.store.save_posts(canonical.channel.username, [canonical])
+        self.store.incr('posts_generation')
+    
+    def image_hash(self, url: str, fetch: bool = True) -> Optional[int]:
+        """dHash превью из общего кэша; при промахе превью скачивается один раз"""
+        cached = self.store.get_meta(f'phash:{url}')
+        if cached is not None or not fetch:
+            return cached
+        try:
+            self.registry.bucket_for(url).acquire()
+            response = self.session.get(url, timeout=self.request_timeout)
+            response.raise_for_status()
+            value = image_fingerprint(response.content)
         except Exception as e:
-            logger.error(f"❌ Ошибка парсинга: {e}")
-            return self.get_mock_posts(channel_type)
+            logger.warning(f"⚠️ Не удалось получить превью {url}: {e}")
+            return None
+        if value is not None:
+            self.store.set_meta(f'phash:{url}', value)
+        return value
+    
+    def backfill_channel(self, username: str, pages: int = 1) -> Optional[int]:
+        """Догружает более старые посты канала через ?before= (по запросу).
+        
+        Как и обновление, идет под refresh_lock и арендой канала; None — канал сейчас
+        обновляет этот поток или другой воркер.
+        """
+        channel = self.channels_by_username.get(username)
+        if not channel:
+            return 0
+        if not self.refresh_lock.acquire(timeout=self.refresh_deadline):
+            return None
+        try:
+            # Аренда остается за воркером до конца TTL, как после обычного обновления
+            if not self.store.acquire_lease(f'scrape:{username}', self.worker_id, channel.refresh_interval):
+                return None
+            self.schedule(channel, time.monotonic())
+            # Состояние канала могло уйти вперед у прежнего владельца аренды
+            self.sync_from_store()
+            return self.backfill_pages(channel, pages)
+        finally:
+            self.refresh_lock.release()
+    
+    def backfill_pages(self, channel: Channel, pages: int) -> int:
+        """Загружает до pages страниц истории канала (вызывается под refresh_lock и арендой)"""
+        username = channel.username
+        added = 0
+        for _ in range(pages):
+            before = self.oldest_seen_ids.get(username)
+            if not before or before <= 1:
+                break
+            web_url = f'{self.web_base}/s/{username}'
+            self.registry.bucket_for(web_url).acquire()
+            response = self.session.get(
+                web_url,
+                params={'before': before},
+                timeout=self.request_timeout
+            )
+            response.raise_for_status()
+            added += self.ingest_page(channel, response.content, backfill=True)
+            # Страница не сдвинула границу истории — дальше постов нет
+            if self.oldest_seen_ids.get(username) == before:
+                break
+        self.save_state([username])
+        
+        logger.info(f"📜 {username}: догружено {added} старых постов")
+        return added
+    
+    def fetch_all_channels(self, channels: List[Channel]) -> List[str]:
+        """Загружает арендованные каналы (параллельно, если PARSER_CONCURRENT) с общим дедлайном.
+        
+        Возвращает имена загруженных каналов; упавшие и не успевшие к дедлайну
+        каналы отдают аренду и повторяются раньше.
+        """
+        fetched, failed = [], set()
+        deadline = time.monotonic() + self.refresh_deadline
+        self.fetch_round += 1
+        token = self.fetch_round
+        for channel in channels:
+            self.fetch_tokens[channel.username] = token
+        if not (self.concurrent_fetch and len(channels) > 1):
+            for channel in channels:
+                if time.monotonic() >= deadline:
+                    break
+                try:
+                    self.fetch_channel_posts(channel)
+                    fetched.append(channel.username)
+                except Exception as e:
+                    self.fetch_failed(channel, e)
+                    failed.add(channel.username)
+        else:
+            futures = {
+                self.executor.submit(self.fetch_channel_posts, channel, token=token): channel for channel in channels
+            }
+            try:
+                # Результаты учитываются по мере готовности каналов
+                for future in as_completed(futures, timeout=self.refresh_deadline):
+                    channel = futures[future]
+                    try:
+                        future.result()
+                        fetched.append(channel.username)
+                    except Exception as e:
+                        self.fetch_failed(channel, e)
+                        failed.add(channel.username)
+            except FuturesTimeoutError:
+                for future in futures:
+                    future.cancel()
+        
+        # Каналы, не успевшие к дедлайну, тоже отдают аренду: иначе их никто не обновит до конца TTL
+        pending = [c for c in channels if c.username not in failed and c.username not in fetched]
+        if pending:
+            for channel in pending:
+                # Под блокировкой канала: уже начатый разбор страницы доводится до конца, следующий — отбрасывается
+                with self.channel_locks[channel.username]:
+                    self.fetch_tokens.pop(channel.username, None)
+                self.retry_channel(channel)
+            logger.warning(
+                f"⏱ Дедлайн обновления {self.refresh_deadline} с истёк, пропущены: "
+                f"{', '.join(c.username for c in pending)}"
+            )
+        return fetched
+    
+    def fetch_failed(self, channel: Channel, error: Exception):
+        """Канал не загрузился: ошибка в метрики и лог, повтор раньше обычного интервала"""
+        METRICS.inc('catbot_errors_total', source='fetch', channel=channel.username)
+        logger.error(f"❌ Ошибка загрузки {channel.username}: {error}")
+        self.retry_channel(channel)
     
-    def parse_message_div(self, div, channel) -> Optional[Dict]:
+    def retry_channel(self, channel: Channel):
+        """Повтор канала раньше обычного интервала; аренду отдаем другим воркерам"""
+        self.schedule(channel, time.monotonic(), self.refresh_check_interval * 5)
+        self.store.release_lease(f'scrape:{channel.username}', self.worker_id)
+    
+    def parse_message_div(self, div, channel: Channel) -> Optional[Post]:
         """Парсит пост, извлекая текст и фото"""
         try:
             # Базовые данные
@@ -88,213 +1879,1486 @@ class AdvancedChannelParser:
             text_div = div.find('div', class_='tgme_widget_message_text')
             text = text_div.get_text(strip=True) if text_div else ""
             
-            # Дата
-            timestamp = 0
             date_elem = div.find('time', datetime=True)
-            date_str = "Недавно"
-            if date_elem:
-                try:
-                    dt = datetime.fromisoformat(date_elem['datetime'].replace('Z', '+00:00'))
-                    date_str = dt.strftime('%d.%m.%Y %H:%M')
-                    timestamp = dt.timestamp()
-                except:
-                    pass
-            
-            # Фото (основное превью)
-            photo_url = None
             photo_wrap = div.find('a', class_='tgme_widget_message_photo_wrap')
-            if photo_wrap and photo_wrap.get('style'):
-                match = re.search(r"background-image:url\('(.*?)'\)", photo_wrap['style'])
-                if match:
-                    photo_url = match.group(1)
-            
-            # Видео
-            video_url = None
             video_wrap = div.find('div', class_='tgme_widget_message_video_wrap')
-            if video_wrap and video_wrap.get('style'):
-                match = re.search(r"background-image:url\('(.*?)'\)", video_wrap['style'])
-                if match:
-                    video_url = match.group(1)
             
-            if not text and not photo_url and not video_url:
-                return None
+            return self.build_post(
+                channel, post_id, text,
+                date_elem['datetime'] if date_elem else None,
+                photo_wrap.get('style') if photo_wrap else None,
+                video_wrap.get('style') if video_wrap else None
+            )
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка парсинга div: {e}")
+            return None
+    
+    def parse_message_element(self, element, channel: Channel) -> Optional[Post]:
+        """Парсит пост из узла lxml через предкомпилированные XPath"""
+        try:
+            post_id = element.get('data-post', '').split('/')[-1] or 'unknown'
+            text_nodes = XPATH_TEXT(element)
+            # Эквивалент get_text(strip=True) из BeautifulSoup
+            text = ''.join(part.strip() for part in text_nodes[0].itertext()) if text_nodes else ""
+            
+            date_attrs = XPATH_TIME(element)
+            photo_styles = XPATH_PHOTO_STYLE(element)
+            video_styles = XPATH_VIDEO_STYLE(element)
+            
+            return self.build_post(
+                channel, post_id, text,
+                date_attrs[0] if date_attrs else None,
+                photo_styles[0] if photo_styles else None,
+                video_styles[0] if video_styles else None
+            )
+            
+        except Exception as e:
+            logger.error(f"❌ Ошибка парсинга элемента: {e}")
+            return None
+    
+    def build_post(self, channel: Channel, post_id: str, text: str, datetime_attr: Optional[str],
+                   photo_style: Optional[str], video_style: Optional[str]) -> Optional[Post]:
+        """Собирает пост из извлеченных полей (None для нерелевантных)"""
+        # Дата
+        timestamp = 0
+        date_str = "Недавно"
+        if datetime_attr:
+            try:
+                dt = datetime.fromisoformat(datetime_attr.replace('Z', '+00:00'))
+                date_str = dt.strftime('%d.%m.%Y %H:%M')
+                timestamp = dt.timestamp()
+            except ValueError:
+                pass
+        
+        # Фото (основное превью)
+        photo_url = None
+        if photo_style:
+            match = BACKGROUND_IMAGE_RE.search(photo_style)
+            if match:
+                photo_url = match.group(1)
+        
+        # Видео
+        video_url = None
+        if video_style:
+            match = BACKGROUND_IMAGE_RE.search(video_style)
+            if match:
+                video_url = match.group(1)
+        
+        if not text and not photo_url and not video_url:
+            return None
+        if not post_id.isdigit():
+            return None
+        
+        # Посты не о животных отбрасываются сразу после извлечения полей
+        fields = self.extractor.extract(text)
+        if not fields['relevant']:
+            return None
+        
+        return Post(
+            int(post_id), channel, date_str, timestamp,
+            fields['title'], fields['description'], fields['contact'],
+            photo_url, video_url, text=fields['text']
+        )
+    
+    def get_mock_posts(self, channel_type: str = 'cats') -> List[Post]:
+        """Возвращает тестовые посты с фото"""
+        channel = self.channels_by_username.get('cats_yalta') or Channel('cats_yalta', 'Котики Ялта', 'cats')
+        group = self.channels_by_username.get('cats_yalta_group') or Channel('cats_yalta_group', 'Котики Ялта (группа)', 'cats')
+        return [
+            Post(
+                1001, channel, '03.08.2025 14:30', time.time(),
+                '🐱 Котенок Мурзик ищет дом',
+                'Возраст: 2 месяца, мальчик, рыжий окрас. Здоров, привит, очень игривый.',
+                '@volunteer1 • +7 978 123-45-67',
+                photo_url='https://via.placeholder.com/600x400?text=Котенок+Мурзик'
+            ),
+            Post(
+                1002, group, '02.08.2025 11:20', time.time() - 3600,
+                '🐱 Взрослый кот Барсик',
+                'Ищет дом взрослый кот, 3 года, кастрирован, приучен к лотку.',
+                '+7 978 765-43-21',
+                photo_url='https://via.placeholder.com/600x400?text=Кот+Барсик'
+            )
+        ]
+    
+    def cache_age(self) -> Optional[float]:
+        """Возраст кэша в секундах"""
+        if not self.last_update:
+            return None
+        return (datetime.now() - self.last_update).total_seconds()
+    
+    def is_stale(self) -> bool:
+        """Проверяет, пора ли обновлять кэш"""
+        age = self.cache_age()
+        return age is None or age > self.refresh_interval
+    
+    def refresh(self, force: bool = False) -> bool:
+        """Обновляет каналы по расписанию; force — все каналы сразу (аренды каналов соблюдаются)"""
+        started = time.monotonic()
+        fetched = self.refresh_due(force)
+        if not fetched:
+            return False
+        self.last_refresh_duration = time.monotonic() - started
+        logger.info(f"🔄 Кэш обновлен за {self.last_refresh_duration:.2f} с")
+        return True
+    
+    def schedule(self, channel: Channel, now: float, delay: Optional[float] = None):
+        """Назначает следующее обновление канала (с разбросом, чтобы каналы не сходились)"""
+        if delay is None:
+            # Разброс только вверх: владелец аренды продлевает ее сам и не должен опрашивать канал раньше TTL
+            delay = channel.refresh_interval * random.uniform(1.0, 1.1)
+        self.next_refresh[channel.username] = now + delay
+    
+    def spread_schedule(self):
+        """Распределяет первые обновления каналов равномерно по их интервалам"""
+        now = time.monotonic()
+        count = len(self.channels)
+        for index, channel in enumerate(self.channels):
+            self.schedule(channel, now, channel.refresh_interval * index / count)
+    
+    def due_channels(self, now: float, limit: Optional[int] = None) -> List[Channel]:
+        """Каналы, срок обновления которых наступил (приоритетные первыми)"""
+        due = [c for c in self.channels if self.next_refresh.get(c.username, 0) <= now]
+        due.sort(key=lambda c: (-c.priority, self.next_refresh.get(c.username, 0)))
+        return due[:limit]
+    
+    def refresh_due(self, force: bool = False) -> int:
+        """Обновляет каналы с наступившим сроком (force — все); возвращает число загруженных каналов"""
+        if not self.refresh_lock.acquire(blocking=False):
+            return 0
+        try:
+            now = time.monotonic()
+            if force:
+                self.next_refresh.clear()
+            channels = []
+            foreign = False
+            for channel in self.due_channels(now, None if force else self.max_due_per_tick):
+                self.schedule(channel, now)
+                # Аренда на канал: между воркерами каждый канал опрашивает только один из них
+                if self.store.acquire_lease(f'scrape:{channel.username}', self.worker_id, channel.refresh_interval):
+                    channels.append(channel)
+                else:
+                    foreign = True
+            if foreign:
+                self.sync_from_store()
+            if not channels:
+                return 0
+            
+            started = time.perf_counter()
+            with self.stats_lock:
+                self.refresh_stats = self.empty_refresh_stats()
+            fetched = self.fetch_all_channels(channels)
+            # Гистограмма — только для обновлений с загрузкой: пустые тики планировщика ее не размывают
+            METRICS.observe('catbot_parser_refresh_seconds', time.perf_counter() - started)
             
+            with self.stats_lock:
+                self.last_refresh_stats = dict(self.refresh_stats)
+            logger.info(
+                f"📊 Загружено {self.last_refresh_stats['bytes']} байт, "
+                f"без изменений: {self.last_refresh_stats['not_modified'] + self.last_refresh_stats['unchanged']}, "
+                f"сэкономлено на парсинге: {self.last_refresh_stats['parse_time_saved']:.3f} с"
+            )
+            if fetched:
+                self.posts_cache = self.posts_from_rows(self.store.query_posts('all'))
+                self.last_update = datetime.now()
+                self.save_state(fetched)
+            logger.info(f"🗓 Обновлено каналов по расписанию: {len(fetched)}/{len(channels)}")
+            return len(fetched)
+        finally:
+            self.refresh_lock.release()
+    
+    def refresh_async(self):
+        """Запускает в фоне обновление каналов с наступившим сроком, не дожидаясь результата"""
+        now = time.monotonic()
+        if self.refresh_lock.locked() or now < self.refresh_retry_at:
+            return
+        # Чтения устаревшего снимка будят планировщик не чаще его собственного цикла
+        self.refresh_retry_at = now + self.refresh_check_interval
+        threading.Thread(target=self.refresh_due, name='parser-refresh', daemon=True).start()
+    
+    def start_background_refresh(self):
+        """Запускает фоновый поток, поддерживающий кэш свежим"""
+        if self.refresh_thread and self.refresh_thread.is_alive():
+            return
+        
+        def refresh_loop():
+            while not self.stop_event.is_set():
+                try:
+                    self.refresh_due()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка фонового обновления: {e}")
+                self.stop_event.wait(self.refresh_check_interval)
+        
+        self.refresh_thread = threading.Thread(target=refresh_loop, name='parser-refresher', daemon=True)
+        self.refresh_thread.start()
+        logger.info(
+            f"🕒 Фоновое обновление {len(self.channels)} каналов по расписанию, "
+            f"проверка каждые {self.refresh_check_interval} с"
+        )
+    
+    def generation(self) -> int:
+        """Номер поколения постов; растет при каждом сохранении новых постов"""
+        return self.store.get_counter('posts_generation')
+    
+    def search_posts(self, query: str, channel_type: str = 'all', limit: int = 5,
+                     filters: Optional[Dict] = None, since: float = 0,
+                     after: Optional[Tuple[str, int]] = None) -> List[Post]:
+        """Поиск по индексу в памяти: слова запроса и атрибуты (окрас, пол, стерилизация...)"""
+        if self.is_stale():
+            self.refresh_async()
+        # Выдача кэшируется под общим posts_generation: индекс должен отражать это поколение,
+        # даже если каналы сохранил другой воркер, а свой срок обновления еще не наступил
+        generation = self.generation()
+        if generation != self.synced_generation:
+            self.sync_from_store()
+            self.synced_generation = generation
+        return self.index.search(query, channel_type, limit, filters, since, after)
+    
+    def get_cached_posts(self, channel_type: str = 'all', limit: int = 5, since: float = 0,
+                         offset: int = 0, after: Optional[Tuple[str, int]] = None) -> List[Post]:
+        """Возвращает последний снимок кэша, не дожидаясь обновления"""
+        if self.is_stale():
+            self.refresh_async()
+        try:
+            posts = self.posts_from_rows(self.store.query_posts(channel_type, limit, since, offset, after))
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения хранилища: {e}")
+            posts = [
+                p for p in self.posts_cache
+                if (channel_type == 'all' or p.type == channel_type)
+                and (p.timestamp > since or (after and p.timestamp == since and PostIndex.key(p) > after))
+            ]
+            if since:
+                posts.sort(key=lambda p: (p.timestamp, PostIndex.key(p)))
+            posts = posts[offset:offset + limit]
+        # Пустой ответ на запрос с since — нормальный результат, а не повод для заглушки
+        if posts or since:
+            return posts
+        return self.get_mock_posts(channel_type)[offset:offset + limit]
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Ошибка 429 Too Many Requests от Bot API"""
+    return isinstance(error, ApiTelegramException) and error.error_code == 429
+
+
+def retry_after_seconds(error: ApiTelegramException) -> float:
+    """Пауза из parameters.retry_after ответа 429"""
+    parameters = (error.result_json or {}).get('parameters') or {}
+    return float(parameters.get('retry_after', 1))
+
+
+def is_bot_blocked(error: Exception) -> bool:
+    """Ошибка 403: пользователь заблокировал бота или удалил аккаунт"""
+    return isinstance(error, ApiTelegramException) and error.error_code == 403
+
+
+def is_stale_file_id(error: Exception) -> bool:
+    """Telegram отверг сохраненный file_id"""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 400:
+        return False
+    description = str(error.description).lower()
+    return 'file identifier' in description or 'file_reference' in description or 'file reference' in description
+
+
+class MediaCache:
+    """Кэш file_id Telegram: повторная отправка медиа без загрузки"""
+    
+    def __init__(self, store: CacheBackend):
+        self.store = store
+        self.file_ids = LRUCache(maxsize=int(os.environ.get('MEDIA_CACHE_SIZE', 5000)))
+        self.file_hashes = {}
+        self.lock = threading.Lock()
+    
+    def key_for(self, source: str) -> str:
+        """Ключ: URL для удаленных файлов, хэш содержимого для локальных"""
+        if source.startswith(('http://', 'https://')):
+            return f'url:{source}'
+        stat = os.stat(source)
+        signature = (source, stat.st_mtime, stat.st_size)
+        digest = self.file_hashes.get(signature)
+        if digest is None:
+            with open(source, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            self.file_hashes[signature] = digest
+        return f'sha1:{digest}'
+    
+    def get(self, key: str) -> Optional[str]:
+        """file_id из памяти или общего хранилища"""
+        with self.lock:
+            file_id = self.file_ids.get(key)
+        if file_id is None:
+            file_id = self.store.get_meta(f'file_id:{key}')
+            if file_id:
+                with self.lock:
+                    self.file_ids[key] = file_id
+        return file_id
+    
+    def remember(self, key: str, message):
+        """Сохраняет file_id из ответа Telegram на отправку"""
+        file_id = None
+        if getattr(message, 'photo', None):
+            file_id = message.photo[-1].file_id
+        elif getattr(message, 'video', None):
+            file_id = message.video.file_id
+        if not file_id:
+            return
+        with self.lock:
+            self.file_ids[key] = file_id
+        self.store.set_meta(f'file_id:{key}', file_id)
+    
+    def discard(self, key: str):
+        """Забывает file_id, который Telegram больше не принимает"""
+        with self.lock:
+            self.file_ids.pop(key, None)
+        self.store.delete_meta(f'file_id:{key}')
+
+
+class FeedCursor:
+    """Позиция пользователя в ленте и сообщение, в котором она показана"""
+    
+    __slots__ = ('channel_type', 'offset', 'message_id', 'source', 'query')
+    
+    def __init__(self, channel_type: str, offset: int, message_id: int, source: Optional[str] = None,
+                 query: Optional[str] = None):
+        self.channel_type = channel_type
+        self.offset = offset
+        self.message_id = message_id
+        # Медиа в сообщении ленты (None — текстовое сообщение)
+        self.source = source
+        # Лента результатов /search
+        self.query = query
+
+
+class FeedCursors:
+    """Курсоры ленты по чатам; неактивные удаляются по TTL"""
+    
+    def __init__(self):
+        self.cursors = TTLCache(
+            maxsize=int(os.environ.get('FEED_CURSORS_SIZE', 10000)),
+            ttl=float(os.environ.get('FEED_CURSOR_TTL', 1800))
+        )
+        self.lock = threading.Lock()
+    
+    def get(self, chat_id: int) -> Optional[FeedCursor]:
+        with self.lock:
+            return self.cursors.get(chat_id)
+    
+    def put(self, chat_id: int, cursor: FeedCursor):
+        """Сохраняет курсор; каждое листание продлевает его TTL"""
+        with self.lock:
+            self.cursors[chat_id] = cursor
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.cursors)
+
+
+class TokenBucket:
+    """Ограничитель частоты «ведро токенов»"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def reserve(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    def acquire(self):
+        """Ждет, пока токен станет доступен"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class ShardedWorkerPool:
+    """Пул фоновых потоков: задачи с одним ключом выполняются по порядку в одном потоке"""
+    
+    def __init__(self, name: str, workers: int, maxsize: int):
+        self.name = name
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in range(workers)]
+        self.threads = []
+        for index, task_queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self.worker_loop, args=(task_queue,),
+                name=f'{name}-{index}', daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+    
+    def submit(self, key, task: Callable, block: bool = True, timeout: Optional[float] = None) -> bool:
+        """Ставит задачу в очередь ключа; False, если очередь переполнена"""
+        task_queue = self.queues[hash(key) % len(self.queues)]
+        try:
+            task_queue.put(task, block=block, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+    
+    def depth(self) -> int:
+        """Суммарная длина очередей"""
+        return sum(q.qsize() for q in self.queues)
+    
+    def join(self):
+        """Ждет выполнения всех поставленных задач"""
+        for task_queue in self.queues:
+            task_queue.join()
+    
+    def worker_loop(self, task_queue: queue.Queue):
+        while True:
+            task = task_queue.get()
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"❌ Ошибка задачи {self.name}: {e}")
+            finally:
+                task_queue.task_done()
+
+
+class SendQueue(ShardedWorkerPool):
+    """Очередь исходящих сообщений с лимитами Telegram и повтором при 429"""
+    
+    def __init__(self):
+        super().__init__(
+            'sender',
+            workers=int(os.environ.get('SEND_WORKERS', 4)),
+            maxsize=int(os.environ.get('SEND_QUEUE_SIZE', 1000))
+        )
+        global_rate = float(os.environ.get('SEND_GLOBAL_RATE', 30))
+        self.chat_rate = float(os.environ.get('SEND_CHAT_RATE', 1))
+        self.chat_burst = float(os.environ.get('SEND_CHAT_BURST', 3))
+        self.max_retries = int(os.environ.get('SEND_MAX_RETRIES', 3))
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        # Ведра неактивных чатов удаляются сами
+        self.chat_buckets = TTLCache(maxsize=10000, ttl=60)
+        self.buckets_lock = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.metrics = {'sent': 0, 'retries': 0, 'failed': 0, 'latency_total': 0.0, 'latency_max': 0.0}
+    
+    def chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self.buckets_lock:
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return bucket
+    
+    def send(self, chat_id: int, func: Callable, *args, **kwargs) -> bool:
+        """Ставит вызов Bot API в очередь чата, сохраняя порядок сообщений"""
+        call = partial(func, *args, **kwargs)
+        if not self.submit(chat_id, partial(self.deliver, chat_id, call, time.monotonic()), block=False):
+            logger.warning(f"📭 Очередь отправки переполнена, сообщение для {chat_id} отброшено")
+            return False
+        return True
+    
+    def deliver(self, chat_id: int, call: Callable, enqueued: float):
+        """Выполняет вызов с учетом лимитов; при 429 ждет retry_after и повторяет"""
+        for attempt in range(self.max_retries + 1):
+            self.global_bucket.acquire()
+            self.chat_bucket(chat_id).acquire()
+            try:
+                call_started = time.perf_counter()
+                call()
+                method = getattr(call.func, '__name__', 'call')
+                METRICS.observe('catbot_telegram_call_seconds', time.perf_counter() - call_started, method=method)
+                latency = time.monotonic() - enqueued
+                with self.metrics_lock:
+                    self.metrics['sent'] += 1
+                    self.metrics['latency_total'] += latency
+                    self.metrics['latency_max'] = max(self.metrics['latency_max'], latency)
+                return
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    with self.metrics_lock:
+                        self.metrics['failed'] += 1
+                    raise
+                METRICS.inc('catbot_telegram_rate_limited_total')
+                delay = retry_after_seconds(e)
+                logger.warning(f"⏳ 429 для чата {chat_id}, повтор через {delay} с")
+                with self.metrics_lock:
+                    self.metrics['retries'] += 1
+                time.sleep(delay)
+    
+    def stats(self) -> Dict:
+        """Глубина очереди и задержка отправки"""
+        with self.metrics_lock:
+            sent = self.metrics['sent']
             return {
-                'id': post_id,
-                'text': text,
-                'date': date_str,
-                'timestamp': timestamp,
-                'url': f"{channel['url']}/{post_id}" if post_id else channel['url'],
-                'title': self.extract_title(text),
-                'description': self.extract_description(text),
-                'contact': self.extract_contact(text),
-                'photo_url': photo_url,
-                'video_url': video_url,
-                'has_media': bool(photo_url or video_url),
-                'type': channel['type'],
-                'channel': channel['title'],
-                'channel_url': channel['url']
+                'depth': self.depth(),
+                'sent': sent,
+                'retries': self.metrics['retries'],
+                'failed': self.metrics['failed'],
+                'latency_avg': round(self.metrics['latency_total'] / sent, 3) if sent else None,
+                'latency_max': round(self.metrics['latency_max'], 3)
             }
+
+
+@lru_cache(maxsize=4096)
+def query_requirement(query: str) -> frozenset:
+    """Основы слов и атрибуты из текста подписки — все они должны найтись в посте"""
+    terms, filters = PostIndex.parse_query(query)
+    return frozenset(terms) | frozenset(filters.items())
+
+
+class SubscriberIndex:
+    """Подписки на новые посты и индекс для быстрого подбора подписчиков поста.
+    
+    Подписка — набор требований (основы слов, атрибуты, тип, канал); каждая
+    лежит в корзине только одного из них — самой маленькой при добавлении.
+    Для нового поста обходятся корзины его признаков с проверкой подмножества,
+    а не все подписчики. Источник — хранилище: изменения других воркеров
+    подхватываются по счетчику поколения.
+    """
+    
+    def __init__(self, store: CacheBackend):
+        self.store = store
+        self.lock = threading.Lock()
+        self.filters = {}
+        # Подписки без условий получают все новые посты
+        self.everyone = set()
+        self.anchors = {}
+        self.anchor_of = {}
+        self.generation = None
+    
+    @staticmethod
+    def requirement(filters: Dict) -> frozenset:
+        items = query_requirement(filters.get('query', ''))
+        extra = [(name, filters[name]) for name in ('type', 'channel') if filters.get(name)]
+        return items | frozenset(extra) if extra else items
+    
+    @staticmethod
+    def features(post: Post) -> set:
+        """Основы слов и атрибуты поста — в тех же элементах, что и требования подписок"""
+        text = post.search_text
+        features = {stem_ru(word) for word in WORD_RE.findall(text.lower())}
+        features.update(PostIndex.facet_values(post, extract_attributes(text)))
+        return features
+    
+    def add(self, chat_id: int, filters: Dict):
+        """Добавляет подписку в индекс (вызывается под self.lock)"""
+        requirement = self.requirement(filters)
+        self.filters[chat_id] = filters
+        if not requirement:
+            self.everyone.add(chat_id)
+            return
+        anchor = min(requirement, key=lambda item: len(self.anchors.get(item, ())))
+        self.anchors.setdefault(anchor, {})[chat_id] = requirement
+        self.anchor_of[chat_id] = anchor
+    
+    def discard(self, chat_id: int):
+        """Удаляет подписку из индекса (вызывается под self.lock)"""
+        self.filters.pop(chat_id, None)
+        self.everyone.discard(chat_id)
+        anchor = self.anchor_of.pop(chat_id, None)
+        if anchor is not None:
+            bucket = self.anchors[anchor]
+            del bucket[chat_id]
+            if not bucket:
+                del self.anchors[anchor]
+    
+    def sync(self):
+        """Перечитывает подписки, если их меняли в другом воркере"""
+        generation = self.store.get_counter('subscriptions_generation')
+        if generation == self.generation:
+            return
+        subscriptions = self.store.load_subscriptions()
+        with self.lock:
+            self.filters, self.everyone, self.anchors, self.anchor_of = {}, set(), {}, {}
+            for chat_id, filters in subscriptions.items():
+                self.add(chat_id, filters)
+            self.generation = generation
+    
+    def changed(self, chat_id: int, filters: Optional[Dict]):
+        """Новое поколение после своего изменения; чужие изменения между ними — повод перечитать все"""
+        self.store.incr('subscriptions_generation')
+        generation = self.store.get_counter('subscriptions_generation')
+        with self.lock:
+            self.discard(chat_id)
+            if filters is not None:
+                self.add(chat_id, filters)
+            if self.generation is not None and generation == self.generation + 1:
+                self.generation = generation
+    
+    def subscribe(self, chat_id: int, filters: Dict):
+        """Оформляет или заменяет подписку чата"""
+        self.store.save_subscriptions([(chat_id, filters)])
+        self.changed(chat_id, filters)
+    
+    def unsubscribe(self, chat_id: int) -> bool:
+        """Отменяет подписку и неотправленные уведомления; False, если ее не было"""
+        self.sync()
+        with self.lock:
+            subscribed = chat_id in self.filters
+        self.store.delete_subscription(chat_id)
+        self.changed(chat_id, None)
+        return subscribed
+    
+    def get(self, chat_id: int) -> Optional[Dict]:
+        self.sync()
+        with self.lock:
+            return self.filters.get(chat_id)
+    
+    def match(self, post: Post) -> List[int]:
+        """Чаты, подписки которых подходят посту"""
+        self.sync()
+        features = self.features(post)
+        with self.lock:
+            chats = list(self.everyone)
+            for item in features:
+                bucket = self.anchors.get(item)
+                if bucket:
+                    chats.extend(chat_id for chat_id, requirement in bucket.items() if requirement <= features)
+        return chats
+    
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.filters)
+
+
+class FanoutScheduler:
+    """Рассылка новых постов подписчикам из постоянной очереди уведомлений в хранилище.
+    
+    Уведомление удаляется только после отправки, поэтому после сбоя рассылка
+    продолжается с того же места (последние сообщения могут повториться, но не
+    потеряться). Очередь разбирает один воркер — владелец аренды. Посты одного
+    чата уходят вместе (альбомами и дайджестом) через SendQueue с общим лимитом
+    Telegram, а собственное ведро оставляет часть лимита ответам на команды.
+    """
+    
+    def __init__(self, store: CacheBackend, outbox: SendQueue, owner: str,
+                 calls: Callable[[int, List[Post]], List[Callable]],
+                 load_posts: Callable[[List[Dict]], List[Post]],
+                 on_blocked: Callable[[int], None]):
+        self.store = store
+        self.outbox = outbox
+        self.owner = owner
+        self.calls = calls
+        self.load_posts = load_posts
+        self.on_blocked = on_blocked
+        rate = float(os.environ.get('FANOUT_RATE', 25))
+        self.bucket = TokenBucket(rate, rate)
+        self.batch_size = int(os.environ.get('FANOUT_BATCH', 500))
+        self.max_in_flight = int(os.environ.get('FANOUT_MAX_IN_FLIGHT', 200))
+        self.max_attempts = int(os.environ.get('FANOUT_MAX_ATTEMPTS', 3))
+        self.interval = float(os.environ.get('FANOUT_INTERVAL', 5))
+        self.lease_ttl = float(os.environ.get('FANOUT_LEASE_TTL', 60))
+        # Уведомления в работе и завершенные, но еще не удаленные из хранилища,
+        # не выбираются повторно
+        self.condition = threading.Condition()
+        self.in_flight = set()
+        self.acked = set()
+        self.failed = set()
+        self.cursor = 0
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.metrics = {'sent': 0, 'blocked': 0, 'failed': 0}
+    
+    def enqueue(self, rows: List[Tuple[int, str, int]]):
+        """Ставит уведомления (chat_id, канал, номер поста) в очередь и будит рассылку"""
+        self.store.enqueue_notifications(rows)
+        METRICS.inc('catbot_notifications_enqueued_total', len(rows))
+        self.wake.set()
+    
+    def start(self):
+        """Запускает фоновый поток рассылки"""
+        if self.thread and self.thread.is_alive():
+            return
+        
+        def fanout_loop():
+            while not self.stop_event.is_set():
+                self.wake.wait(self.interval)
+                self.wake.clear()
+                try:
+                    self.drain()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка рассылки подписчикам: {e}")
+        
+        self.thread = threading.Thread(target=fanout_loop, name='fanout', daemon=True)
+        self.thread.start()
+    
+    def drain(self) -> int:
+        """Раздает очередь до конца; возвращает число чатов, которым ушли задачи"""
+        if not self.store.acquire_lease('fanout', self.owner, self.lease_ttl):
+            return 0
+        dispatched = 0
+        lease_renewed = time.monotonic()
+        posts = {}
+        while not self.stop_event.is_set():
+            self.flush()
+            rows = self.store.pending_notifications(self.cursor, self.batch_size)
+            if not rows:
+                break
+            self.cursor = rows[-1][0]
+            by_chat = {}
+            with self.condition:
+                skipped = self.in_flight | self.acked | self.failed
+            for row_id, chat_id, channel, post_id, created in rows:
+                if row_id not in skipped:
+                    by_chat.setdefault(chat_id, []).append((row_id, channel, post_id, created))
             
+            for chat_id, items in by_chat.items():
+                for _, channel, post_id, _ in items:
+                    if (channel, post_id) not in posts:
+                        data = self.store.get_post(channel, post_id)
+                        loaded = self.load_posts([data]) if data else []
+                        posts[(channel, post_id)] = loaded[0] if loaded else None
+                ids = [item[0] for item in items]
+                chat_posts = [posts[(channel, post_id)] for _, channel, post_id, _ in items]
+                chat_posts = [p for p in chat_posts if p is not None]
+                if not chat_posts:
+                    # Пост уже вытеснен из хранилища — уведомлять не о чем
+                    self.store.ack_notifications(ids)
+                    continue
+                calls = self.calls(chat_id, chat_posts)
+                for _ in calls:
+                    self.bucket.acquire()
+                with self.condition:
+                    while len(self.in_flight) >= self.max_in_flight:
+                        self.condition.wait(1)
+                    self.in_flight.update(ids)
+                oldest = min(item[3] for item in items)
+                self.outbox.submit(chat_id, partial(self.deliver, chat_id, ids, calls, oldest))
+                dispatched += 1
+            
+            if time.monotonic() - lease_renewed > self.lease_ttl / 2:
+                if not self.store.acquire_lease('fanout', self.owner, self.lease_ttl):
+                    break
+                lease_renewed = time.monotonic()
+        self.flush()
+        # Следующий проход начнется сначала и подберет неудавшиеся уведомления
+        self.cursor = 0
+        return dispatched
+    
+    def deliver(self, chat_id: int, ids: List[int], calls: List[Callable], created: float):
+        """Задача SendQueue: отправляет посты чата; 403 — подписка удаляется"""
+        enqueued = time.monotonic()
+        outcome = 'sent'
+        try:
+            for call in calls:
+                self.outbox.deliver(chat_id, call, enqueued)
+            METRICS.observe('catbot_notification_lag_seconds', time.time() - created)
         except Exception as e:
-            logger.error(f"❌ Ошибка парсинга div: {e}")
-            return None
+            if is_bot_blocked(e):
+                outcome = 'blocked'
+                logger.info(f"🚫 Чат {chat_id} заблокировал бота, подписка удалена")
+                self.on_blocked(chat_id)
+            else:
+                outcome = 'failed'
+                logger.warning(f"⚠️ Уведомление для {chat_id} не доставлено: {e}")
+        METRICS.inc('catbot_notifications_total', outcome=outcome)
+        with self.condition:
+            self.metrics[outcome] += 1
+            (self.failed if outcome == 'failed' else self.acked).update(ids)
+            self.in_flight.difference_update(ids)
+            self.condition.notify_all()
     
-    def extract_title(self, text: str) -> str:
-        """Извлекает заголовок из текста поста"""
-        lines = text.split('\n')
-        for line in lines[:3]:
-            line = line.strip()
-            if line and len(line) > 5:
-                title = re.sub(r'[^\w\s\-\.,!?а-яёА-ЯЁ]', '', line)
-                if len(title) > 50:
-                    title = title[:50] + "..."
-                return title or "Котик ищет дом"
-        return "Котик ищет дом"
+    def flush(self):
+        """Удаляет доставленные уведомления из хранилища и учитывает неудачные попытки"""
+        with self.condition:
+            acked, self.acked = self.acked, set()
+            failed, self.failed = self.failed, set()
+        if acked:
+            self.store.ack_notifications(list(acked))
+        if failed:
+            self.store.retry_notifications(list(failed), self.max_attempts)
+    
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Ждет завершения отправленных задач; False по таймауту"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+    
+    def stats(self) -> Dict:
+        with self.condition:
+            return dict(self.metrics, in_flight=len(self.in_flight))
+
+
+class UpdateQueue(ShardedWorkerPool):
+    """Очередь входящих обновлений: порядок в пределах чата и дедупликация по update_id"""
+    
+    # Поля Update, в которых может лежать чат или пользователь
+    CHAT_FIELDS = ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query')
+    
+    def __init__(self, bot: telebot.TeleBot):
+        super().__init__(
+            'updates',
+            workers=int(os.environ.get('UPDATE_WORKERS', 8)),
+            maxsize=int(os.environ.get('UPDATE_QUEUE_SIZE', 500))
+        )
+        self.bot = bot
+        self.enqueue_timeout = float(os.environ.get('UPDATE_ENQUEUE_TIMEOUT', 0.5))
+        self.seen_limit = int(os.environ.get('UPDATE_DEDUP_SIZE', 10000))
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.metrics = {'accepted': 0, 'duplicates': 0, 'rejected': 0, 'processed': 0}
+    
+    def chat_key(self, data: Dict):
+        """Ключ очереди: id чата (или пользователя), чтобы сохранить порядок в диалоге"""
+        for field in self.CHAT_FIELDS:
+            payload = data.get(field)
+            if not payload:
+                continue
+            chat = payload.get('chat') or (payload.get('message') or {}).get('chat')
+            if chat:
+                return chat.get('id')
+            if payload.get('from'):
+                return payload['from'].get('id')
+        return data.get('update_id')
+    
+    def mark_seen(self, update_id: int) -> bool:
+        """Запоминает update_id; False, если такое обновление уже было"""
+        with self.lock:
+            if update_id in self.seen:
+                self.metrics['duplicates'] += 1
+                return False
+            self.seen[update_id] = True
+            if len(self.seen) > self.seen_limit:
+                self.seen.popitem(last=False)
+            return True
+    
+    def forget(self, update_id: int):
+        with self.lock:
+            self.seen.pop(update_id, None)
+    
+    def enqueue(self, data: Dict, wait: bool = False) -> str:
+        """Ставит обновление в очередь: accepted, duplicate или full (wait — ждать места)"""
+        update_id = data['update_id']
+        if not self.mark_seen(update_id):
+            return 'duplicate'
+        timeout = None if wait else self.enqueue_timeout
+        if not self.submit(self.chat_key(data), partial(self.process, data), timeout=timeout):
+            # Telegram повторит доставку — дубликатом она считаться не должна
+            self.forget(update_id)
+            with self.lock:
+                self.metrics['rejected'] += 1
+            return 'full'
+        with self.lock:
+            self.metrics['accepted'] += 1
+        return 'accepted'
+    
+    def process(self, data: Dict):
+        update = types.Update.de_json(data)
+        self.bot.process_new_updates([update])
+        with self.lock:
+            self.metrics['processed'] += 1
+    
+    def stats(self) -> Dict:
+        with self.lock:
+            return dict(self.metrics, depth=self.depth())
+
+
+class PollingEngine:
+    """Long polling пачками: обработка в пуле воркеров и сохранение offset"""
+    
+    def __init__(self, token: str, updates: UpdateQueue, store: CacheBackend):
+        self.token = token
+        self.updates = updates
+        self.store = store
+        self.batch_size = min(int(os.environ.get('POLL_BATCH_SIZE', 100)), 100)
+        self.long_poll_timeout = int(os.environ.get('POLL_TIMEOUT', 25))
+        self.error_delay = float(os.environ.get('POLL_ERROR_DELAY', 3))
+        self.offset = store.get_meta('polling_offset')
+        self.stop_event = threading.Event()
+        self.metrics = {'batches': 0, 'updates': 0, 'errors': 0}
+    
+    def poll(self, timeout: int) -> List[Dict]:
+        """Одна пачка обновлений в виде сырых JSON-объектов"""
+        # apihelper.get_updates подменяет long_polling_timeout=0 на 10 с, поэтому запрос собираем сами:
+        # _make_request передает 0 в Bot API как есть (timeout — таймаут чтения HTTP)
+        params = {'limit': self.batch_size, 'timeout': timeout + 10, 'long_polling_timeout': timeout}
+        if self.offset:
+            params['offset'] = self.offset
+        return telebot.apihelper._make_request(self.token, 'getUpdates', params=params)
+    
+    def process_batch(self, batch: List[Dict]):
+        """Раздает пачку воркерам и после обработки сохраняет offset"""
+        for data in batch:
+            self.updates.enqueue(data, wait=True)
+        self.updates.join()
+        # Offset пишется только после обработки: перезапуск не теряет обновления
+        self.offset = max(data['update_id'] for data in batch) + 1
+        self.store.set_meta('polling_offset', self.offset)
+        self.metrics['batches'] += 1
+        self.metrics['updates'] += len(batch)
+    
+    def run(self):
+        """Цикл опроса; полная пачка — сразу следующий запрос без ожидания"""
+        logger.info(f"🔁 Polling: пачки по {self.batch_size}, таймаут {self.long_poll_timeout} с, offset {self.offset}")
+        timeout = self.long_poll_timeout
+        while not self.stop_event.is_set():
+            try:
+                batch = self.poll(timeout)
+            except Exception as e:
+                self.metrics['errors'] += 1
+                logger.error(f"❌ Ошибка polling: {e}")
+                self.stop_event.wait(self.error_delay)
+                continue
+            
+            if batch:
+                self.process_batch(batch)
+            timeout = 0 if len(batch) >= self.batch_size else self.long_poll_timeout
+    
+    def stop(self):
+        self.stop_event.set()
+
+
+class HyperLogLog:
+    """Приближенный подсчет уникальных значений в постоянной памяти (2^precision байт)"""
+    
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers else bytearray(self.size)
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+    
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other: 'HyperLogLog'):
+        """Объединяет со вторым скетчем (поэлементный максимум)"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+    
+    def count(self) -> int:
+        estimate = self.alpha * self.size * self.size / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Поправка для малых мощностей (linear counting)
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * math.log(self.size / zeros)
+        return int(round(estimate))
+    
+    def to_text(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+    
+    @classmethod
+    def from_text(cls, text: Optional[str]) -> 'HyperLogLog':
+        return cls(registers=base64.b64decode(text)) if text else cls()
+
+
+class UserStats:
+    """Статистика использования: уникальные пользователи, DAU/WAU, сообщения и кнопки.
     
-    def extract_description(self, text: str) -> str:
-        """Извлекает описание из текста"""
-        clean_text = re.sub(r'@\w+|https?://\S+|\+?\d[\d\s\-\(\)]+', '', text)
-        clean_text = re.sub(r'\s+', ' ', clean_text).strip()
-        if len(clean_text) > 200:
-            return clean_text[:200] + "..."
-        return clean_text or "Подробности в посте"
+    Пользователи считаются HyperLogLog-скетчами (общий и по дням), поэтому память
+    не растет с аудиторией. Счетчики копятся локально и периодически сливаются в
+    общее хранилище, где их видят все воркеры.
+    """
+    
+    RETENTION_DAYS = 8
+    
+    def __init__(self, store: CacheBackend):
+        self.store = store
+        self.flush_interval = float(os.environ.get('STATS_FLUSH_INTERVAL', 60))
+        self.lock = threading.Lock()
+        self.total = HyperLogLog()
+        self.daily = {}
+        self.pending_messages = 0
+        self.pending_buttons = {}
+        self.flusher = None
+    
+    def track(self, user_id: int, button: Optional[str] = None):
+        """Учитывает сообщение пользователя (потокобезопасно, без обращения к диску)"""
+        day = date.today().isoformat()
+        with self.lock:
+            self.total.add(user_id)
+            sketch = self.daily.get(day)
+            if sketch is None:
+                sketch = self.daily[day] = HyperLogLog()
+                self.drop_old_days()
+            sketch.add(user_id)
+            self.pending_messages += 1
+            if button:
+                self.pending_buttons[button] = self.pending_buttons.get(button, 0) + 1
+    
+    def drop_old_days(self):
+        oldest = (date.today() - timedelta(days=self.RETENTION_DAYS)).isoformat()
+        for day in [d for d in self.daily if d < oldest]:
+            del self.daily[day]
+    
+    def merged_sketch(self, key: str, local: Optional[HyperLogLog]) -> HyperLogLog:
+        """Скетч из хранилища, объединенный с локальным"""
+        sketch = HyperLogLog.from_text(self.store.get_meta(key))
+        if local is not None:
+            sketch.merge(local)
+        return sketch
+    
+    def flush(self):
+        """Сливает локальные скетчи и счетчики в общее хранилище"""
+        with self.lock:
+            messages, self.pending_messages = self.pending_messages, 0
+            buttons, self.pending_buttons = self.pending_buttons, {}
+            sketches = {'hll:total': HyperLogLog(registers=self.total.registers)}
+            for day, sketch in self.daily.items():
+                sketches[f'hll:day:{day}'] = HyperLogLog(registers=sketch.registers)
+        
+        # Слияние идемпотентно: локальные скетчи накопительные и сливаются при каждом сбросе
+        for key, local in sketches.items():
+            self.store.set_meta(key, self.merged_sketch(key, local).to_text())
+        if messages:
+            self.store.incr('messages', messages)
+        for button, count in buttons.items():
+            self.store.incr(f'button:{button}', count)
     
-    def extract_contact(self, text: str) -> str:
-        """Извлекает контактную информацию"""
-        phone_pattern = r'\+?[78][\s\-]?\(?9\d{2}\)?\s?[\d\s\-]{7,10}'
-        phones = re.findall(phone_pattern, text)
+    def start_flusher(self):
+        """Периодическое сохранение статистики"""
+        if self.flusher and self.flusher.is_alive():
+            return
         
-        username_pattern = r'@\w+'
-        usernames = re.findall(username_pattern, text)
+        def flush_loop():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка сохранения статистики: {e}")
         
-        contacts = []
-        if phones:
-            contacts.extend(phones[:1])
-        if usernames:
-            contacts.extend(usernames[:1])
-            
-        return ' • '.join(contacts) if contacts else "См. в группе"
-    
-    def is_animal_related(self, text: str) -> bool:
-        """Проверяет, относится ли пост к животным"""
-        animal_keywords = [
-            'кот', 'кошк', 'котен', 'котик', 'мурз', 'мяу',
-            'пристрой', 'дом', 'питомец', 'стерил', 'прививк',
-            'потерял', 'нашел', 'пропал', 'найден', 'потеряшка'
-        ]
-        text_lower = text.lower()
-        return any(keyword in text_lower for keyword in animal_keywords)
+        self.flusher = threading.Thread(target=flush_loop, name='stats-flusher', daemon=True)
+        self.flusher.start()
     
-    def get_mock_posts(self, channel_type: str = 'cats') -> List[Dict]:
-        """Возвращает тестовые посты с фото"""
-        return [
-            {
-                'id': '1001',
-                'title': '🐱 Котенок Мурзик ищет дом',
-                'description': 'Возраст: 2 месяца, мальчик, рыжий окрас. Здоров, привит, очень игривый.',
-                'date': '03.08.2025 14:30',
-                'timestamp': time.time(),
-                'url': 'https://t.me/cats_yalta/1001',
-                'contact': '@volunteer1 • +7 978 123-45-67',
-                'photo_url': 'https://via.placeholder.com/600x400?text=Котенок+Мурзик',
-                'video_url': None,
-                'has_media': True,
-                'type': 'cats',
-                'channel': 'Котики Ялта',
-                'channel_url': 'https://t.me/cats_yalta'
-            },
-            {
-                'id': '1002',
-                'title': '🐱 Взрослый кот Барсик',
-                'description': 'Ищет дом взрослый кот, 3 года, кастрирован, приучен к лотку.',
-                'date': '02.08.2025 11:20',
-                'timestamp': time.time() - 3600,
-                'url': 'https://t.me/cats_yalta_group/1002',
-                'contact': '+7 978 765-43-21',
-                'photo_url': 'https://via.placeholder.com/600x400?text=Кот+Барсик',
-                'video_url': None,
-                'has_media': True,
-                'type': 'cats',
-                'channel': 'Котики Ялта (группа)',
-                'channel_url': 'https://t.me/cats_yalta_group'
+    def report(self, buttons: List[str]) -> Dict:
+        """Пользователи, DAU/WAU, сообщения и нажатия кнопок для /"""
+        today = date.today()
+        with self.lock:
+            local_total = HyperLogLog(registers=self.total.registers)
+            local_daily = {day: HyperLogLog(registers=s.registers) for day, s in self.daily.items()}
+            pending_messages = self.pending_messages
+            pending_buttons = dict(self.pending_buttons)
+        
+        week = HyperLogLog()
+        dau = 0
+        for offset in range(7):
+            day = (today - timedelta(days=offset)).isoformat()
+            sketch = self.merged_sketch(f'hll:day:{day}', local_daily.get(day))
+            if offset == 0:
+                dau = sketch.count()
+            week.merge(sketch)
+        
+        return {
+            'users': self.merged_sketch('hll:total', local_total).count(),
+            'dau': dau,
+            'wau': week.count(),
+            'messages': self.store.get_counter('messages') + pending_messages,
+            'buttons': {
+                button: self.store.get_counter(f'button:{button}') + pending_buttons.get(button, 0)
+                for button in buttons
             }
-        ]
+        }
+
+
+def split_message(text: str, limit: int = 4096) -> List[str]:
+    """Делит длинный текст на сообщения по границам абзацев"""
+    parts = []
+    current = ""
+    for paragraph in text.split('\n\n'):
+        if current and len(current) + len(paragraph) + 2 > limit:
+            parts.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        parts.append(current)
+    return [part[i:i + limit] for part in parts for i in range(0, len(part), limit)]
+
+
+def render_contacts(data: Dict) -> str:
+    """Готовит HTML-список клиник и врачей из contacts.json"""
+    def as_list(value):
+        return value if isinstance(value, list) else [value]
+    
+    sections = []
+    for city, places in data['места'].items():
+        lines = [f"<b>📍 {city.upper()}</b>"]
+        for name, info in places.items():
+            lines.append("")
+            lines.append(f"🏥 <b>{name.capitalize()}</b>")
+            if info.get('имя'):
+                lines.append(f"👤 {info['имя']}")
+            if info.get('врач'):
+                lines.append(f"👨‍⚕️ {info['врач']}")
+            if info.get('адрес'):
+                lines.append(f"📍 {info['адрес']}")
+            if info.get('время'):
+                lines.append(f"🕒 {info['время']}")
+            if info.get('телефон'):
+                lines.append(f"📞 {', '.join(as_list(info['телефон']))}")
+            for doctor in info.get('врачи', []):
+                label = doctor.get('имя', 'Врач')
+                lines.append(f"👩‍⚕️ {label}: {doctor['тел']}" if doctor.get('тел') else f"👩‍⚕️ {label}")
+            pharmacy = info.get('ветаптека')
+            if isinstance(pharmacy, str):
+                lines.append(f"💊 Аптека: {pharmacy}")
+            elif pharmacy:
+                lines.append("💊 Есть аптека")
+            if info.get('услуги'):
+                lines.append(f"🔬 {', '.join(info['услуги'])}")
+            if info.get('экзотика'):
+                lines.append("🦎 Экзотические животные")
+            visit = info.get('выезд')
+            if isinstance(visit, dict):
+                lines.append(f"🚑 Выезд на дом: {visit.get('стоимость', 'по договоренности')}")
+            elif visit:
+                lines.append("🚑 Выезд на дом")
+            if info.get('ссылка'):
+                lines.append(f"🔗 <a href=\"{info['ссылка']}\">Страница</a>")
+        sections.append('\n'.join(lines))
+    return "🏥 <b>КЛИНИКИ И ВРАЧИ</b>\n\n" + '\n\n'.join(sections)
+
+
+class ContentRegistry:
+    """Тексты из assets: загружаются один раз, хранятся в памяти и перезагружаются при изменении файлов"""
+    
+    FILES = {
+        'paid_text': 'paid_text.html',
+        'free_text': 'free_text.html',
+        'about': 'about_text.html',
+        'contacts_header': 'contacts_text.html',
+        'contacts_json': 'contacts.json'
+    }
+    
+    def __init__(self, directory: str = 'assets'):
+        self.directory = directory
+        self.reload_interval = float(os.environ.get('CONTENT_RELOAD_INTERVAL', 5))
+        self.texts = {}
+        self.mtimes = {}
+        self.watcher = None
+        self.reload()
+    
+    def get(self, name: str) -> str:
+        """Готовый текст из памяти, без обращения к диску"""
+        return self.texts.get(name) or f"⚠️ Информация временно недоступна ({name})"
     
-    def get_cached_posts(self, channel_type: str = 'all') -> List[Dict]:
-        """Возвращает кэшированные или обновленные посты"""
-        if (not self.last_update or 
-            (datetime.now() - self.last_update).seconds > 3600):  # Обновляем каждый час
+    def get_parts(self, name: str) -> List[str]:
+        """Текст, разбитый на сообщения Telegram"""
+        return split_message(self.get(name))
+    
+    def current_mtimes(self) -> Dict[str, float]:
+        mtimes = {}
+        for filename in self.FILES.values():
             try:
-                return self.get_channel_posts(channel_type)
-            except:
-                pass
-        return [p for p in self.posts_cache if channel_type == 'all' or p['type'] == channel_type] or self.get_mock_posts(channel_type)
+                mtimes[filename] = os.path.getmtime(os.path.join(self.directory, filename))
+            except OSError:
+                mtimes[filename] = None
+        return mtimes
+    
+    def read(self, filename: str) -> str:
+        with open(os.path.join(self.directory, filename), 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+        if not text:
+            raise ValueError("пустой файл")
+        return text
+    
+    def reload(self) -> bool:
+        """Перечитывает assets, если изменилось время модификации; True, если тексты обновлены"""
+        mtimes = self.current_mtimes()
+        if mtimes == self.mtimes:
+            return False
+        
+        # Невалидный файл не затирает последнюю рабочую версию текста
+        texts = dict(self.texts)
+        raw = {}
+        for name, filename in self.FILES.items():
+            try:
+                raw[name] = self.read(filename)
+            except Exception as e:
+                logger.error(f"❌ Ошибка загрузки {filename}: {e}")
+        
+        for name in ('paid_text', 'free_text', 'about'):
+            if name in raw:
+                texts[name] = raw[name]
+        
+        if 'contacts_json' in raw or 'contacts_header' in raw:
+            try:
+                header = raw.get('contacts_header') or self.texts.get('contacts_header', '')
+                clinics = render_contacts(json.loads(raw['contacts_json'])) if 'contacts_json' in raw else None
+                texts['contacts_header'] = header
+                if clinics is None:
+                    clinics = self.texts.get('contacts_clinics', '')
+                texts['contacts_clinics'] = clinics
+                texts['contacts'] = f"{header}\n\n{clinics}".strip()
+            except Exception as e:
+                logger.error(f"❌ Невалидный contacts.json: {e}")
+        
+        self.texts = texts
+        self.mtimes = mtimes
+        logger.info(f"📚 Загружено текстов: {len(texts)}")
+        return True
+    
+    def start_watcher(self):
+        """Фоновая проверка изменений файлов; обработчики не ждут перезагрузки"""
+        if self.watcher and self.watcher.is_alive():
+            return
+        
+        def watch_loop():
+            while True:
+                time.sleep(self.reload_interval)
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка перезагрузки assets: {e}")
+        
+        self.watcher = threading.Thread(target=watch_loop, name='content-watcher', daemon=True)
+        self.watcher.start()
+
+
+class FrozenMarkup(types.JsonSerializable):
+    """Клавиатура, сериализованная один раз"""
+    
+    def __init__(self, markup):
+        self.json = markup.to_json()
+    
+    def to_json(self):
+        return self.json
+
+
+class MessageRouter:
+    """Диспетчер сообщений: поиск обработчика в словаре команд и кнопок за O(1)"""
+    
+    def __init__(self, fallback: Callable):
+        self.commands = {}
+        self.buttons = {}
+        self.callbacks = {}
+        self.fallback = fallback
+    
+    def command(self, *names: str):
+        """Регистрирует обработчик команд /name"""
+        def decorator(handler):
+            for name in names:
+                self.commands[name.lower()] = handler
+            return handler
+        return decorator
+    
+    def button(self, *texts: str):
+        """Регистрирует обработчик точного текста кнопки"""
+        def decorator(handler):
+            for text in texts:
+                self.buttons[text] = handler
+            return handler
+        return decorator
+    
+    def resolve(self, text: str) -> Callable:
+        """Находит обработчик для текста сообщения"""
+        if text.startswith('/'):
+            # /cmd@BotName аргументы -> cmd
+            name = text[1:].split(maxsplit=1)[0].split('@')[0].lower() if len(text) > 1 else ''
+            return self.commands.get(name, self.fallback)
+        return self.buttons.get(text, self.fallback)
+    
+    def callback(self, *prefixes: str):
+        """Регистрирует обработчик inline-кнопок с callback_data вида prefix:аргументы"""
+        def decorator(handler):
+            for prefix in prefixes:
+                self.callbacks[prefix] = handler
+            return handler
+        return decorator
+    
+    def resolve_callback(self, data: str) -> Optional[Callable]:
+        """Находит обработчик inline-кнопки по префиксу callback_data"""
+        return self.callbacks.get(data.split(':', 1)[0])
+    
+    def dispatch(self, message):
+        self.resolve(message.text or '')(message)
+
+
+class ResponseCache:
+    """Готовые JSON-ответы: сериализованные байты, gzip-версия и ETag"""
+    
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None, min_gzip_size: int = 512):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl) if ttl else LRUCache(maxsize=maxsize)
+        self.lock = threading.Lock()
+        self.min_gzip_size = min_gzip_size
+    
+    def get(self, key, build: Callable[[], Dict]):
+        """Возвращает (etag, body, gzipped) для ключа, сериализуя данные только при промахе"""
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            body = json.dumps(build(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            # Одинаковые данные дают одинаковый ETag во всех воркерах
+            etag = hashlib.sha1(body).hexdigest()[:20]
+            gzipped = gzip.compress(body, compresslevel=6) if len(body) >= self.min_gzip_size else None
+            entry = (etag, body, gzipped)
+            with self.lock:
+                self.entries[key] = entry
+        return entry
+    
+    def respond(self, key, build: Callable[[], Dict]) -> Response:
+        """Ответ с учетом If-None-Match (304) и Accept-Encoding (gzip)"""
+        etag, body, gzipped = self.get(key, build)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        elif gzipped is not None and request.accept_encodings['gzip']:
+            response = Response(gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
+
 
 class CatBotWithPhotos:
     """Бот для помощи кошкам Ялты с поддержкой фото и видео"""
     
+    # Русские названия типов каналов в /subscribe
+    TYPE_ALIASES = {'кошки': 'cats', 'коты': 'cats', 'собаки': 'dogs'}
+    
     def __init__(self):
         self.token = os.environ.get('TOKEN')
         if not self.token:
             logger.error("❌ TOKEN не найден!")
             exit(1)
         
-        self.bot = telebot.TeleBot(self.token)
+        # В асинхронном режиме обработчики выполняет наш пул, а не потоки telebot
+        self.async_updates = os.environ.get('ASYNC_UPDATES', '1') != '0'
+        self.bot = telebot.TeleBot(self.token, threaded=not self.async_updates)
         self.parser = AdvancedChannelParser()
         self.app = Flask(__name__)
         self.port = int(os.environ.get('PORT', 8080))
         self.webhook_url = os.environ.get('WEBHOOK_URL')
-        self.stats = {"users": set(), "messages": 0}
+        self.store = self.parser.store
+        self.outbox = SendQueue()
+        self.media_cache = MediaCache(self.store)
+        self.content = ContentRegistry()
+        self.content.start_watcher()
+        self.build_keyboards()
+        self.batch_delivery = os.environ.get('BATCH_DELIVERY', '1') != '0'
+        # Лента: один пост в сообщении, листание правкой этого сообщения
+        self.lazy_feed = os.environ.get('LAZY_FEED', '1') != '0'
+        self.feed_depth = int(os.environ.get('FEED_MAX_POSTS', 50))
+        self.feed_cursors = FeedCursors()
+        self.updates = UpdateQueue(self.bot) if self.async_updates else None
+        self.stats = UserStats(self.store)
+        self.stats.start_flusher()
+        
+        # Готовые ответы /posts живут до смены поколения постов, / — несколько секунд
+        self.posts_responses = ResponseCache(maxsize=int(os.environ.get('POSTS_RESPONSE_CACHE', 256)))
+        self.home_responses = ResponseCache(maxsize=1, ttl=float(os.environ.get('HOME_CACHE_TTL', 5)))
+        self.posts_max_limit = int(os.environ.get('POSTS_MAX_LIMIT', 100))
+        
+        # Подписки: новые посты рассылаются из постоянной очереди в хранилище
+        self.subscriptions = SubscriberIndex(self.store)
+        self.fanout = FanoutScheduler(
+            self.store, self.outbox, self.parser.worker_id,
+            self.delivery_calls, self.parser.posts_from_rows, self.drop_subscriber
+        )
+        self.parser.on_new_posts = self.notify_subscribers
+        self.fanout.start()
+        
+        METRICS.gauge('catbot_send_queue_depth', self.outbox.depth)
+        METRICS.gauge('catbot_update_queue_depth', lambda: self.updates.depth() if self.updates else None)
+        METRICS.gauge('catbot_cache_age_seconds', self.parser.cache_age)
+        METRICS.gauge('catbot_feed_cursors', lambda: len(self.feed_cursors))
+        METRICS.gauge('catbot_search_index_posts', lambda: len(self.parser.index))
+        METRICS.gauge('catbot_subscribers', lambda: len(self.subscriptions))
+        METRICS.gauge('catbot_notifications_in_flight', lambda: len(self.fanout.in_flight))
         
         self.setup_handlers()
         self.setup_routes()
     
-    def send_post(self, chat_id: int, post: Dict):
+    def track_message(self, message):
+        """Учитывает пользователя, сообщение и нажатую кнопку"""
+        text = message.text or ''
+        button = text if text in self.router.buttons else None
+        self.stats.track(message.from_user.id, button)
+    
+    def format_post_text(self, post: Post) -> str:
+        """Подпись поста (не длиннее лимита подписи Telegram)"""
+        emoji = '🐱' if post.type == 'cats' else '🐶'
+        post_text = (
+            f"{emoji} <b>{post.title}</b>\n\n"
+            f"{post.description}\n\n"
+            f"📅 {post.date}\n"
+            f"📞 {post.contact}\n"
+            f"📢 <a href='{post.channel.url}'>{post.channel.title}</a>\n"
+        )
+        for title, url in post.reposts:
+            post_text += f"🔁 Также: <a href='{url}'>{title}</a>\n"
+        post_text += f"🔗 <a href='{post.url}'>Открыть пост</a>"
+        
+        if len(post_text) > 1024:
+            post_text = post_text[:1000] + "..."
+        return post_text
+    
+    def send_cached_media(self, kind: str, chat_id: int, source: str, **kwargs):
+        """Отправляет фото/видео по URL или пути, переиспользуя сохраненный file_id"""
+        send = self.bot.send_photo if kind == 'photo' else self.bot.send_video
+        key = self.media_cache.key_for(source)
+        
+        file_id = self.media_cache.get(key)
+        if file_id:
+            try:
+                return send(chat_id, file_id, **kwargs)
+            except ApiTelegramException as e:
+                if not is_stale_file_id(e):
+                    raise
+                logger.warning(f"♻️ Устаревший file_id для {source}, загружаю заново")
+                self.media_cache.discard(key)
+        
+        if key.startswith('url:'):
+            message = send(chat_id, source, **kwargs)
+        else:
+            with open(source, 'rb') as media_file:
+                message = send(chat_id, media_file, **kwargs)
+        self.media_cache.remember(key, message)
+        return message
+    
+    @METRICS.timed('catbot_send_post_seconds')
+    def send_post(self, chat_id: int, post: Post):
         """Отправляет один пост с медиа или текстом"""
         try:
-            emoji = '🐱' if post['type'] == 'cats' else '🐶'
-            post_text = (
-                f"{emoji} <b>{post['title']}</b>\n\n"
-                f"{post['description']}\n\n"
-                f"📅 {post['date']}\n"
-                f"📞 {post['contact']}\n"
-                f"📢 <a href='{post['channel_url']}'>{post['channel']}</a>\n"
-                f"🔗 <a href='{post['url']}'>Открыть пост</a>"
-            )
-            
-            if len(post_text) > 1024:
-                post_text = post_text[:1000] + "..."
+            post_text = self.format_post_text(post)
             
             # Пытаемся отправить медиа
-            if post.get('photo_url'):
+            if post.photo_url:
                 try:
-                    self.bot.send_photo(
-                        chat_id,
-                        post['photo_url'],
+                    self.send_cached_media(
+                        'photo', chat_id,
+                        post.photo_url,
                         caption=post_text,
                         parse_mode="HTML",
                         reply_markup=types.InlineKeyboardMarkup().add(
-                            types.InlineKeyboardButton("📢 Открыть пост", url=post['url'])
+                            types.InlineKeyboardButton("📢 Открыть пост", url=post.url)
                         )
                     )
                     return
                 except Exception as e:
+                    if is_rate_limited(e) or is_bot_blocked(e):
+                        raise
                     logger.error(f"❌ Ошибка отправки фото: {e}")
             
-            if post.get('video_url'):
+            if post.video_url:
                 try:
-                    self.bot.send_video(
-                        chat_id,
-                        post['video_url'],
+                    self.send_cached_media(
+                        'video', chat_id,
+                        post.video_url,
                         caption=post_text,
                         parse_mode="HTML",
                         reply_markup=types.InlineKeyboardMarkup().add(
-                            types.InlineKeyboardButton("📢 Открыть пост", url=post['url'])
+                            types.InlineKeyboardButton("📢 Открыть пост", url=post.url)
                         )
                     )
                     return
                 except Exception as e:
+                    if is_rate_limited(e) or is_bot_blocked(e):
+                        raise
                     logger.error(f"❌ Ошибка отправки видео: {e}")
             
             # Если не удалось отправить медиа, отправляем текст
@@ -304,100 +3368,412 @@ class CatBotWithPhotos:
                 parse_mode="HTML",
                 disable_web_page_preview=False,
                 reply_markup=types.InlineKeyboardMarkup().add(
-                    types.InlineKeyboardButton("📢 Открыть пост", url=post['url'])
+                    types.InlineKeyboardButton("📢 Открыть пост", url=post.url)
                 )
             )
             
         except Exception as e:
+            # 429 повторяет очередь отправки, 403 снимает подписку
+            if is_rate_limited(e) or is_bot_blocked(e):
+                raise
             logger.error(f"❌ Ошибка отправки поста: {e}")
 
+    def send_media_album(self, chat_id: int, posts: List[Post]):
+        """Отправляет до 10 постов одним альбомом с подписью у каждого"""
+        if len(posts) == 1:
+            self.send_post(chat_id, posts[0])
+            return
+        
+        # Превью видео на странице канала — картинка, поэтому тоже InputMediaPhoto
+        sources = [post.photo_url or post.video_url for post in posts]
+        keys = [self.media_cache.key_for(source) for source in sources]
+        
+        def build_media(use_file_ids: bool):
+            return [
+                types.InputMediaPhoto(
+                    (use_file_ids and self.media_cache.get(key)) or source,
+                    caption=self.format_post_text(post),
+                    parse_mode="HTML"
+                )
+                for post, source, key in zip(posts, sources, keys)
+            ]
+        
+        try:
+            try:
+                messages = self.bot.send_media_group(chat_id, build_media(use_file_ids=True))
+            except ApiTelegramException as e:
+                if not is_stale_file_id(e):
+                    raise
+                logger.warning("♻️ Устаревший file_id в альбоме, загружаю заново")
+                for key in keys:
+                    self.media_cache.discard(key)
+                messages = self.bot.send_media_group(chat_id, build_media(use_file_ids=False))
+            for key, message in zip(keys, messages):
+                self.media_cache.remember(key, message)
+        except Exception as e:
+            if is_rate_limited(e) or is_bot_blocked(e):
+                raise
+            logger.error(f"❌ Ошибка отправки альбома, отправляю по одному: {e}")
+            for post in posts:
+                self.send_post(chat_id, post)
+    
+    def send_text_digest(self, chat_id: int, posts: List[Post]):
+        """Отправляет посты без медиа одним сообщением (делится по 4096 символов)"""
+        parts = []
+        current = ""
+        for post in posts:
+            post_text = self.format_post_text(post)
+            if current and len(current) + len(post_text) + 2 > 4096:
+                parts.append(current)
+                current = ""
+            current = f"{current}\n\n{post_text}" if current else post_text
+        if current:
+            parts.append(current)
+        
+        for part in parts:
+            self.bot.send_message(chat_id, part, parse_mode="HTML", disable_web_page_preview=True)
+    
+    def delivery_calls(self, chat_id: int, posts: List[Post]) -> List[Callable]:
+        """Вызовы отправки постов: альбомами и дайджестом или по одному, в зависимости от настроек"""
+        if not self.batch_delivery:
+            return [partial(self.send_post, chat_id, post) for post in posts]
+        
+        media_posts = [p for p in posts if p.photo_url or p.video_url]
+        text_posts = [p for p in posts if not (p.photo_url or p.video_url)]
+        calls = [
+            partial(self.send_media_album, chat_id, media_posts[start:start + 10])
+            for start in range(0, len(media_posts), 10)
+        ]
+        if text_posts:
+            calls.append(partial(self.send_text_digest, chat_id, text_posts))
+        return calls
+    
+    def queue_posts(self, chat_id: int, posts: List[Post]):
+        """Ставит посты в очередь чата"""
+        # Каждый альбом — отдельная задача, чтобы повтор при 429 не дублировал уже отправленные
+        for call in self.delivery_calls(chat_id, posts):
+            self.outbox.send(chat_id, call)
+    
+    def notify_subscribers(self, posts: List[Post]):
+        """Ставит новые посты в очередь рассылки подписчикам, чьи фильтры им подходят"""
+        started = time.perf_counter()
+        by_chat = {}
+        for post in posts:
+            for chat_id in self.subscriptions.match(post):
+                by_chat.setdefault(chat_id, []).append(post)
+        METRICS.observe('catbot_subscriber_match_seconds', time.perf_counter() - started)
+        # Уведомления одного чата идут подряд — рассылка отправит их одним альбомом или дайджестом
+        rows = [(chat_id, p.channel.username, p.id) for chat_id, chat_posts in by_chat.items() for p in chat_posts]
+        if rows:
+            self.fanout.enqueue(rows)
+            logger.info(f"🔔 Новых постов: {len(posts)}, уведомлений в очереди: {len(rows)}")
+    
+    def drop_subscriber(self, chat_id: int):
+        """Снимает подписку чата, заблокировавшего бота"""
+        self.subscriptions.unsubscribe(chat_id)
+        METRICS.inc('catbot_subscribers_blocked_total')
+    
+    def subscription_filters(self, text: str) -> Dict:
+        """Фильтры подписки из аргументов /subscribe: @канал, тип канала и слова запроса"""
+        filters = {}
+        words = []
+        for word in text.split():
+            if word.startswith('@'):
+                channel = self.parser.registry.get(word[1:])
+                if channel is None:
+                    raise ValueError(f"канал {word} не найден")
+                filters['channel'] = channel.username
+            elif self.TYPE_ALIASES.get(word.lower(), word.lower()) in self.parser.registry.types():
+                filters['type'] = self.TYPE_ALIASES.get(word.lower(), word.lower())
+            else:
+                words.append(word)
+        if words:
+            filters['query'] = ' '.join(words)
+        return filters
+    
+    def describe_subscription(self, filters: Dict) -> str:
+        """Подписка человеческим языком"""
+        parts = []
+        if filters.get('channel'):
+            channel = self.parser.registry.get(filters['channel'])
+            parts.append(f"канал {channel.title if channel else filters['channel']}")
+        if filters.get('type'):
+            parts.append(f"тип {filters['type']}")
+        if filters.get('query'):
+            parts.append(f"«{filters['query']}»")
+        return ', '.join(parts) if parts else 'все новые объявления'
+    
+    def feed_page(self, channel_type: str, offset: int, query: Optional[str] = None):
+        """Пост ленты (или результатов поиска) с номером offset и признак, что за ним есть еще"""
+        if offset >= self.feed_depth:
+            return None, False
+        if query:
+            posts = self.parser.search_posts(query, channel_type, limit=offset + 2)[offset:]
+        else:
+            posts = self.parser.get_cached_posts(channel_type, limit=2, offset=offset)
+        if not posts:
+            return None, False
+        return posts[0], len(posts) > 1 and offset + 1 < self.feed_depth
+    
+    def feed_markup(self, post: Post, offset: int, has_more: bool) -> types.InlineKeyboardMarkup:
+        """Кнопки листания ленты и ссылка на пост"""
+        markup = types.InlineKeyboardMarkup()
+        navigation = []
+        if offset > 0:
+            navigation.append(types.InlineKeyboardButton("◀️", callback_data=f"feed:{offset - 1}"))
+        if has_more:
+            navigation.append(types.InlineKeyboardButton("Ещё ▶️", callback_data=f"feed:{offset + 1}"))
+        if navigation:
+            markup.row(*navigation)
+        markup.row(types.InlineKeyboardButton("📢 Открыть пост", url=post.url))
+        return markup
+    
+    def send_feed_message(self, chat_id: int, post: Post, offset: int, has_more: bool):
+        """Новое сообщение ленты; возвращает (сообщение, показанное медиа)"""
+        caption = self.format_post_text(post)
+        markup = self.feed_markup(post, offset, has_more)
+        # Как и в альбомах, превью видео — картинка
+        source = post.photo_url or post.video_url
+        if source:
+            try:
+                message = self.send_cached_media(
+                    'photo', chat_id, source, caption=caption, parse_mode="HTML", reply_markup=markup
+                )
+                return message, source
+            except Exception as e:
+                if is_rate_limited(e):
+                    raise
+                logger.error(f"❌ Ошибка отправки фото ленты: {e}")
+        message = self.bot.send_message(
+            chat_id, caption, parse_mode="HTML", disable_web_page_preview=False, reply_markup=markup
+        )
+        return message, None
+    
+    def edit_cached_media(self, chat_id: int, message_id: int, source: str, caption: str, markup):
+        """Меняет фото сообщения, переиспользуя сохраненный file_id"""
+        key = self.media_cache.key_for(source)
+        file_id = self.media_cache.get(key)
+        if file_id:
+            try:
+                return self.bot.edit_message_media(
+                    types.InputMediaPhoto(file_id, caption=caption, parse_mode="HTML"),
+                    chat_id, message_id, reply_markup=markup
+                )
+            except ApiTelegramException as e:
+                if not is_stale_file_id(e):
+                    raise
+                logger.warning(f"♻️ Устаревший file_id для {source}, загружаю заново")
+                self.media_cache.discard(key)
+        
+        message = self.bot.edit_message_media(
+            types.InputMediaPhoto(source, caption=caption, parse_mode="HTML"),
+            chat_id, message_id, reply_markup=markup
+        )
+        self.media_cache.remember(key, message)
+        return message
+    
+    def send_feed(self, chat_id: int, channel_type: str, query: Optional[str] = None, footer: bool = False):
+        """Открывает ленту с первого поста и запоминает курсор чата; footer — подсказка «Как помочь?»
+        после поста, как в ленте без LAZY_FEED"""
+        post, has_more = self.feed_page(channel_type, 0, query)
+        if not post and query:
+            self.bot.send_message(chat_id, f"😿 По запросу «{query}» ничего не найдено")
+            return
+        if not post:
+            self.bot.send_message(
+                chat_id,
+                "😿 Сейчас нет актуальных объявлений.\n"
+                f"📢 Проверьте группы:\n"
+                f"{self.channel_links(channel_type)}"
+            )
+            return
+        message, source = self.send_feed_message(chat_id, post, 0, has_more)
+        self.feed_cursors.put(chat_id, FeedCursor(channel_type, 0, message.message_id, source, query))
+        if footer:
+            # Через очередь чата: подсказка уходит следом за лентой и не повторяется при ретрае ленты
+            self.send_help_footer(chat_id, channel_type)
+    
+    @METRICS.timed('catbot_feed_turn_seconds')
+    def turn_feed_page(self, chat_id: int, message_id: int, offset: int, callback_id: str):
+        """Листает ленту правкой ее сообщения; кнопки старых сообщений только получают ответ"""
+        cursor = self.feed_cursors.get(chat_id)
+        if not cursor or cursor.message_id != message_id:
+            self.bot.answer_callback_query(callback_id, "⌛ Лента устарела, нажмите «🐱 Актуальные посты»")
+            return
+        # Повторное нажатие той же кнопки — сообщение уже показывает эту страницу
+        if offset == cursor.offset:
+            self.bot.answer_callback_query(callback_id)
+            return
+        post, has_more = self.feed_page(cursor.channel_type, offset, cursor.query)
+        if not post:
+            self.bot.answer_callback_query(callback_id, "📭 Больше объявлений нет")
+            return
+        self.bot.answer_callback_query(callback_id)
+        
+        caption = self.format_post_text(post)
+        markup = self.feed_markup(post, offset, has_more)
+        source = post.photo_url or post.video_url
+        if source and cursor.source:
+            if source == cursor.source:
+                # То же фото (репост) — достаточно сменить подпись
+                self.bot.edit_message_caption(
+                    caption, chat_id, message_id, parse_mode="HTML", reply_markup=markup
+                )
+            else:
+                self.edit_cached_media(chat_id, message_id, source, caption, markup)
+        elif not source and not cursor.source:
+            self.bot.edit_message_text(
+                caption, chat_id, message_id, parse_mode="HTML",
+                disable_web_page_preview=False, reply_markup=markup
+            )
+        else:
+            # Текстовое сообщение нельзя превратить в медиа и наоборот — заменяем его
+            message, source = self.send_feed_message(chat_id, post, offset, has_more)
+            try:
+                self.bot.delete_message(chat_id, message_id)
+            except ApiTelegramException as e:
+                logger.warning(f"⚠️ Не удалось удалить сообщение ленты: {e}")
+            cursor.message_id = message.message_id
+        
+        cursor.offset = offset
+        cursor.source = source
+        self.feed_cursors.put(chat_id, cursor)
+    
+    def channel_links(self, animal_type: str = 'all', html: bool = False, limit: int = 10) -> str:
+        """Список групп для сообщений (приоритетные первыми)"""
+        channels = self.parser.registry.of_type(animal_type)[:limit]
+        if html:
+            return '\n'.join(f"• <a href='{c.url}'>{c.title}</a>" for c in channels)
+        return '\n'.join(f"• {c.url}" for c in channels)
+    
     def send_channel_posts(self, chat_id: int, animal_type: str = 'cats'):
-        """Отправляет все посты с медиа"""
+        """Ставит в очередь ленту постов (или все посты сразу без LAZY_FEED)"""
         try:
+            if self.lazy_feed:
+                # Следующие посты пользователь получает, только когда листает ленту
+                self.outbox.send(chat_id, self.send_feed, chat_id, animal_type, footer=True)
+                return
+            
             posts = self.parser.get_cached_posts(animal_type)
             
             if not posts:
-                self.bot.send_message(
-                    chat_id,
+                self.outbox.send(
+                    chat_id, self.bot.send_message, chat_id,
                     "😿 Сейчас нет актуальных объявлений.\n"
                     f"📢 Проверьте группы:\n"
-                    f"• {self.parser.channels[0]['url']}\n"
-                    f"• {self.parser.channels[1]['url']}"
+                    f"{self.channel_links(animal_type)}"
                 )
                 return
             
-            self.bot.send_message(
-                chat_id,
+            self.outbox.send(
+                chat_id, self.bot.send_message, chat_id,
                 f"🐱 <b>КОТИКИ ИЩУТ ДОМ</b>\n\n"
                 f"📢 Последние объявления из групп Ялты:",
                 parse_mode="HTML"
             )
             
-            for post in posts:
-                self.send_post(chat_id, post)
-                time.sleep(0.7)  # Защита от флуда
-            
-            self.bot.send_message(
-                chat_id,
-                "💡 <b>Как помочь?</b>\n\n"
-                f"🏠 <b>Взять котика:</b>\nСвяжитесь по контактам из объявления\n\n"
-                f"📢 <b>Группы:</b>\n"
-                f"• <a href='{self.parser.channels[0]['url']}'>Котики Ялта (канал)</a>\n"
-                f"• <a href='{self.parser.channels[1]['url']}'>Котики Ялта (группа)</a>\n\n"
-                "🤝 <b>Стать волонтером:</b>\nНапишите в группу",
-                parse_mode="HTML"
-            )
+            # Темп отправки задает очередь, webhook не ждет
+            self.queue_posts(chat_id, posts)
+            self.send_help_footer(chat_id, animal_type)
             
         except Exception as e:
             logger.error(f"❌ Ошибка отправки постов: {e}")
-            self.bot.send_message(
-                chat_id,
+            self.outbox.send(
+                chat_id, self.bot.send_message, chat_id,
                 f"⚠️ Ошибка загрузки объявлений\n\n"
                 f"Попробуйте позже или посетите группы:\n"
-                f"• {self.parser.channels[0]['url']}\n"
-                f"• {self.parser.channels[1]['url']}"
+                f"{self.channel_links(animal_type)}"
             )
 
+    def send_help_footer(self, chat_id: int, animal_type: str):
+        """Подсказка «Как помочь?» после постов"""
+        self.outbox.send(
+            chat_id, self.bot.send_message, chat_id,
+            "💡 <b>Как помочь?</b>\n\n"
+            f"🏠 <b>Взять котика:</b>\nСвяжитесь по контактам из объявления\n\n"
+            f"📢 <b>Группы:</b>\n"
+            f"{self.channel_links(animal_type, html=True)}\n\n"
+            "🤝 <b>Стать волонтером:</b>\nНапишите в группу",
+            parse_mode="HTML"
+        )
+    
+    def build_keyboards(self):
+        """Клавиатуры строятся один раз и отправляются уже сериализованными"""
+        main = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+        main.add("🏥 Стерилизация", "🏠 Пристройство")
+        main.add("📞 Контакты", "ℹ️ О проекте")
+        main.add("🐱 Актуальные посты")
+        
+        adoption = types.ReplyKeyboardMarkup(resize_keyboard=True)
+        adoption.add("🐱 Кошки ищут дом")
+        adoption.add("📝 Подать объявление")
+        adoption.add("🔙 Назад")
+        
+        sterilization = types.ReplyKeyboardMarkup(resize_keyboard=True)
+        sterilization.add("💰 Платная стерилизация", "🆓 Бесплатная стерилизация")
+        sterilization.add("🔙 Назад")
+        
+        self.keyboards = {
+            'main': FrozenMarkup(main),
+            'adoption': FrozenMarkup(adoption),
+            'sterilization': FrozenMarkup(sterilization)
+        }
+    
     def get_main_keyboard(self):
         """Главная клавиатура"""
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-        markup.add("🏥 Стерилизация", "🏠 Пристройство")
-        markup.add("📞 Контакты", "ℹ️ О проекте")
-        markup.add("🐱 Актуальные посты")
-        return markup
+        return self.keyboards['main']
     
     def get_adoption_keyboard(self):
         """Клавиатура пристройства"""
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("🐱 Кошки ищут дом")
-        markup.add("📝 Подать объявление")
-        markup.add("🔙 Назад")
-        return markup
+        return self.keyboards['adoption']
     
     def get_sterilization_keyboard(self):
         """Клавиатура стерилизации"""
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.add("💰 Платная стерилизация", "🆓 Бесплатная стерилизация")
-        markup.add("🔙 Назад")
-        return markup
-
-    def load_html_file(self, filename: str) -> str:
-        """Загружает HTML файл из папки assets"""
+        return self.keyboards['sterilization']
+    
+    def handle_message(self, message):
+        """Единая точка входа для текстовых сообщений"""
+        self.track_message(message)
+        handler = self.router.resolve(message.text or '')
+        started = time.perf_counter()
         try:
-            with open(f'assets/{filename}', 'r', encoding='utf-8') as f:
-                return f.read()
+            handler(message)
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки HTML: {e}")
-            return f"⚠️ Информация временно недоступна ({filename})"
+            METRICS.inc('catbot_errors_total', source='handler', handler=handler.__name__)
+            logger.error(f"❌ Ошибка обработки: {e}")
+            self.bot.send_message(message.chat.id, "⚠️ Ошибка. Попробуйте /start")
+        finally:
+            METRICS.observe('catbot_handler_seconds', time.perf_counter() - started, handler=handler.__name__)
 
+    def handle_callback(self, call):
+        """Единая точка входа для нажатий inline-кнопок"""
+        handler = self.router.resolve_callback(call.data or '')
+        if handler is None:
+            self.bot.answer_callback_query(call.id)
+            return
+        started = time.perf_counter()
+        try:
+            handler(call)
+        except Exception as e:
+            METRICS.inc('catbot_errors_total', source='callback', handler=handler.__name__)
+            logger.error(f"❌ Ошибка обработки кнопки: {e}")
+        finally:
+            METRICS.observe('catbot_handler_seconds', time.perf_counter() - started, handler=handler.__name__)
+    
     def setup_handlers(self):
         """Обработчики сообщений"""
         
-        @self.bot.message_handler(commands=['start'])
+        def unknown_handler(message):
+            self.bot.send_message(
+                message.chat.id,
+                "❓ Используйте кнопки меню\n\n/start - главное меню",
+                reply_markup=self.get_main_keyboard()
+            )
+        
+        self.router = router = MessageRouter(unknown_handler)
+        
+        @router.command('start')
         def start_handler(message):
-            self.stats["users"].add(message.from_user.id)
-            self.stats["messages"] += 1
-            
             welcome_text = """👋 <b>Добро пожаловать в "Котики Ялты"!</b>
 
 🐾 Помощник по кошкам Ялты
@@ -407,7 +3783,9 @@ class CatBotWithPhotos:
 🏠 <b>Пристройство</b> - котики ищут дом
 📞 <b>Контакты</b> - связь с волонтерами
 ℹ️ <b>О проекте</b> - наша деятельность
-🐱 <b>Актуальные посты</b> - свежие объявления"""
+🐱 <b>Актуальные посты</b> - свежие объявления
+🔎 /search - поиск, например «/search рыжий котенок»
+🔔 /subscribe - присылать новые объявления, например «/subscribe рыжий котенок»"""
             
             self.bot.send_message(
                 message.chat.id, 
@@ -416,35 +3794,54 @@ class CatBotWithPhotos:
                 reply_markup=self.get_main_keyboard()
             )
         
-        @self.bot.message_handler(commands=['update'])
+        @router.command('backfill')
+        def backfill_handler(message):
+            """Догрузка истории каналов (для админов)"""
+            if message.from_user.id not in [123456789]:  # Замените на ваш ID
+                return
+            
+            added, busy = 0, []
+            for channel in self.parser.channels:
+                try:
+                    count = self.parser.backfill_channel(channel.username)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка догрузки {channel.username}: {e}")
+                    continue
+                if count is None:
+                    busy.append(channel.username)
+                else:
+                    added += count
+            text = f"📜 Догружено старых постов: {added}"
+            if busy:
+                text += f"\n⏳ Сейчас обновляются другим воркером или потоком: {', '.join(busy)}"
+            self.bot.send_message(message.chat.id, text)
+        
+        @router.command('update')
         def update_handler(message):
             """Обновление постов (для админов)"""
             if message.from_user.id not in [123456789]:  # Замените на ваш ID
                 return
                 
-            self.parser.posts_cache = []
-            self.parser.last_update = None
             self.bot.send_message(message.chat.id, "🔄 Обновляю посты...")
-            posts = self.parser.get_channel_posts()
+            if not self.parser.refresh(force=True):
+                self.bot.send_message(message.chat.id, "⏳ Каналы уже обновляет другой воркер или поток")
+                return
+            posts = self.parser.posts_cache
             self.bot.send_message(
                 message.chat.id, 
-                f"✅ Обновлено: {len(posts)} постов (с медиа: {sum(1 for p in posts if p['has_media'])})"
+                f"✅ Обновлено: {len(posts)} постов (с медиа: {sum(1 for p in posts if p.has_media)})"
             )
         
-        @self.bot.message_handler(func=lambda m: m.text == "🏥 Стерилизация")
+        @router.button("🏥 Стерилизация")
         def sterilization_handler(message):
-            self.stats["users"].add(message.from_user.id)
-            self.stats["messages"] += 1
-            
             try:
-                with open('assets/images/sterilization.jpg', 'rb') as photo:
-                    self.bot.send_photo(
-                        message.chat.id,
-                        photo,
-                        caption="🏥 <b>Стерилизация кошек</b>\n\nВыберите вариант:",
-                        parse_mode="HTML",
-                        reply_markup=self.get_sterilization_keyboard()
-                    )
+                self.send_cached_media(
+                    'photo', message.chat.id,
+                    'assets/images/sterilization.jpg',
+                    caption="🏥 <b>Стерилизация кошек</b>\n\nВыберите вариант:",
+                    parse_mode="HTML",
+                    reply_markup=self.get_sterilization_keyboard()
+                )
             except Exception as e:
                 logger.error(f"❌ Ошибка загрузки фото: {e}")
                 self.bot.send_message(
@@ -454,37 +3851,71 @@ class CatBotWithPhotos:
                     reply_markup=self.get_sterilization_keyboard()
                 )
         
-        @self.bot.message_handler(func=lambda m: m.text == "💰 Платная стерилизация")
+        @router.button("💰 Платная стерилизация")
         def paid_sterilization_handler(message):
             self.bot.send_message(
                 message.chat.id,
-                self.load_html_file('paid_text.html'),
+                self.content.get('paid_text'),
                 parse_mode="HTML"
             )
         
-        @self.bot.message_handler(func=lambda m: m.text == "🆓 Бесплатная стерилизация")
+        @router.button("🆓 Бесплатная стерилизация")
         def free_sterilization_handler(message):
             self.bot.send_message(
                 message.chat.id,
-                self.load_html_file('free_text.html'),
+                self.content.get('free_text'),
                 parse_mode="HTML"
             )
         
-        @self.bot.message_handler(func=lambda m: m.text == "🐱 Актуальные посты")
+        @router.command('search')
+        def search_handler(message):
+            parts = (message.text or '').split(maxsplit=1)
+            query = parts[1].strip() if len(parts) > 1 else ''
+            if not query:
+                self.bot.send_message(
+                    message.chat.id,
+                    "🔎 Напишите, что искать, например:\n/search рыжий котенок\n/search кастрирован"
+                )
+                return
+            if self.lazy_feed:
+                self.outbox.send(message.chat.id, self.send_feed, message.chat.id, 'all', query)
+                return
+            posts = self.parser.search_posts(query, limit=5)
+            if not posts:
+                self.bot.send_message(message.chat.id, f"😿 По запросу «{query}» ничего не найдено")
+                return
+            self.queue_posts(message.chat.id, posts)
+        
+        @router.command('subscribe')
+        def subscribe_handler(message):
+            parts = (message.text or '').split(maxsplit=1)
+            try:
+                filters = self.subscription_filters(parts[1] if len(parts) > 1 else '')
+            except ValueError as e:
+                self.bot.send_message(message.chat.id, f"⚠️ {str(e).capitalize()}")
+                return
+            self.subscriptions.subscribe(message.chat.id, filters)
+            self.bot.send_message(
+                message.chat.id,
+                f"🔔 Подписка оформлена: {self.describe_subscription(filters)}\n\n"
+                "Новые посты придут сюда сами. Отписаться: /unsubscribe\n"
+                "Фильтры: @канал, тип (кошки, собаки) и слова, например «/subscribe @cats_yalta рыжий»"
+            )
+        
+        @router.command('unsubscribe')
+        def unsubscribe_handler(message):
+            if self.subscriptions.unsubscribe(message.chat.id):
+                self.bot.send_message(message.chat.id, "🔕 Подписка отменена")
+            else:
+                self.bot.send_message(message.chat.id, "🔕 Подписки не было. Оформить: /subscribe")
+        
+        @router.button("🐱 Актуальные посты", "🐱 Кошки ищут дом")
         def recent_posts_handler(message):
             self.send_channel_posts(message.chat.id)
         
-        @self.bot.message_handler(func=lambda m: True)
-        def message_handler(message):
-            self.stats["users"].add(message.from_user.id)
-            self.stats["messages"] += 1
-            
-            text = message.text
-            chat_id = message.chat.id
-            
-            try:
-                if text == "🏠 Пристройство":
-                    info_text = """🏠 <b>Пристройство котиков</b>
+        @router.button("🏠 Пристройство")
+        def adoption_handler(message):
+            info_text = """🏠 <b>Пристройство котиков</b>
 
 Выберите действие:
 
@@ -493,23 +3924,20 @@ class CatBotWithPhotos:
 
 📝 <b>Подать объявление</b>
 Как разместить свое объявление"""
-                    
-                    self.bot.send_message(
-                        chat_id, 
-                        info_text, 
-                        parse_mode="HTML",
-                        reply_markup=self.get_adoption_keyboard()
-                    )
-                
-                elif text == "🐱 Кошки ищут дом":
-                    self.send_channel_posts(chat_id)
-                
-                elif text == "📝 Подать объявление":
-                    info_text = f"""📝 <b>Подать объявление</b>
+            
+            self.bot.send_message(
+                message.chat.id, 
+                info_text, 
+                parse_mode="HTML",
+                reply_markup=self.get_adoption_keyboard()
+            )
+        
+        @router.button("📝 Подать объявление")
+        def submit_ad_handler(message):
+            info_text = f"""📝 <b>Подать объявление</b>
 
 📢 <b>Группы для объявлений:</b>
-• <a href="{self.parser.channels[0]['url']}">Котики Ялта (канал)</a>
-• <a href="{self.parser.channels[1]['url']}">Котики Ялта (группа)</a>
+{self.channel_links(html=True)}
 
 ✍️ <b>Как подать:</b>
 1️⃣ Перейти в группу
@@ -522,109 +3950,197 @@ class CatBotWithPhotos:
 🔹 Характер
 🔹 Здоровье (прививки, стерилизация)
 🔹 Ваши контакты"""
-                    
-                    self.bot.send_message(chat_id, info_text, parse_mode="HTML")
-                
-                elif text == "📞 Контакты":
-                    contacts_text = """📞 <b>КОНТАКТЫ</b>
-
-👥 <b>Координаторы:</b>
-🔹 По кошкам: +7 978 144-90-70
-🔹 По стерилизации: +7 978 000-00-02
-🔹 Лечение: +7 978 000-00-03
-
-🏥 <b>Клиники:</b>
-🔹 "Айболит": +7 978 000-00-04
-🔹 "ВетМир": +7 978 000-00-05
-
-📱 <b>Социальные сети:</b>
-🔹 Telegram: @cats_yalta
-🔹 Instagram: @yalta_cats"""
-                    
-                    self.bot.send_message(chat_id, contacts_text, parse_mode="HTML")
-                
-                elif text == "ℹ️ О проекте":
-                    about_text = """ℹ️ <b>О ПРОЕКТЕ "КОТИКИ ЯЛТЫ"</b>
-
-🎯 <b>Миссия:</b>
-Помощь бездомным кошкам Ялты
-
-📊 <b>Достижения:</b>
-🔹 Стерилизовано: 500+ кошек
-🔹 Пристроено: 300+ котят
-🔹 Волонтеров: 30+ активных
-
-💰 <b>Поддержать:</b>
-Карта: 2202 2020 0000 0000
-
-🤝 <b>Стать волонтером:</b>
-Пишите @cats_yalta_coordinator"""
-                    
-                    self.bot.send_message(chat_id, about_text, parse_mode="HTML")
-                
-                elif text == "🔙 Назад":
-                    self.bot.send_message(
-                        chat_id, 
-                        "🏠 Главное меню:", 
-                        reply_markup=self.get_main_keyboard()
-                    )
-                
-                else:
-                    self.bot.send_message(
-                        chat_id,
-                        "❓ Используйте кнопки меню\n\n/start - главное меню",
-                        reply_markup=self.get_main_keyboard()
-                    )
-                    
-            except Exception as e:
-                logger.error(f"❌ Ошибка обработки: {e}")
-                self.bot.send_message(chat_id, "⚠️ Ошибка. Попробуйте /start")
+            
+            self.bot.send_message(message.chat.id, info_text, parse_mode="HTML")
+        
+        @router.button("📞 Контакты")
+        def contacts_handler(message):
+            for part in self.content.get_parts('contacts'):
+                self.bot.send_message(message.chat.id, part, parse_mode="HTML", disable_web_page_preview=True)
+        
+        @router.button("ℹ️ О проекте")
+        def about_handler(message):
+            self.bot.send_message(message.chat.id, self.content.get('about'), parse_mode="HTML")
+        
+        @router.button("🔙 Назад")
+        def back_handler(message):
+            self.bot.send_message(
+                message.chat.id, 
+                "🏠 Главное меню:", 
+                reply_markup=self.get_main_keyboard()
+            )
+        
+        @router.callback('feed')
+        def feed_callback(call):
+            try:
+                offset = int(call.data.split(':', 1)[1])
+            except (IndexError, ValueError):
+                self.bot.answer_callback_query(call.id)
+                return
+            chat_id = call.message.chat.id
+            # Правка идет через очередь чата: после отправки первой страницы и с учетом лимитов
+            self.outbox.send(chat_id, self.turn_feed_page, chat_id, call.message.message_id, max(offset, 0), call.id)
+        
+        # Один обработчик telebot вместо цепочки фильтров: дальше — поиск в словаре
+        self.bot.register_message_handler(self.handle_message, content_types=['text'])
+        self.bot.register_callback_query_handler(self.handle_callback, func=lambda call: True)
     
     def setup_routes(self):
         """Flask маршруты"""
         
         @self.app.route(f'/{self.token}', methods=['POST'])
+        @METRICS.timed('catbot_webhook_seconds')
         def webhook():
             try:
-                if request.headers.get('content-type') == 'application/json':
-                    json_string = request.get_data().decode('utf-8')
+                if request.headers.get('content-type') != 'application/json':
+                    return 'Bad request', 400
+                json_string = request.get_data().decode('utf-8')
+                
+                if not self.async_updates:
                     update = telebot.types.Update.de_json(json_string)
                     self.bot.process_new_updates([update])
                     return '', 200
-                return 'Bad request', 400
+                
+                # Проверяем и ставим в очередь, обработка — в пуле воркеров
+                try:
+                    data = json.loads(json_string)
+                except ValueError:
+                    return 'Bad request', 400
+                if not isinstance(data, dict) or not isinstance(data.get('update_id'), int):
+                    return 'Bad request', 400
+                if self.updates.enqueue(data) == 'full':
+                    # Очередь заполнена: Telegram повторит доставку позже
+                    return 'Busy', 503
+                return '', 200
             except Exception as e:
                 logger.error(f"❌ Webhook ошибка: {e}")
                 return 'Internal error', 500
         
+        @self.app.route('/metrics')
+        def metrics():
+            return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+        
         @self.app.route('/')
         def home():
-            return jsonify({
-                "status": "🤖 Cat Bot Running",
-                "time": datetime.now().strftime('%H:%M:%S'),
-                "users": len(self.stats["users"]),
-                "messages": self.stats["messages"],
-                "channels": [c['url'] for c in self.parser.channels],
-                "last_update": self.parser.last_update.isoformat() if self.parser.last_update else None
-            })
+            return self.home_responses.respond('home', self.home_payload)
         
         @self.app.route('/posts')
         def posts_api():
+            channel_type = request.args.get('type', 'all')
+            if channel_type != 'all' and channel_type not in {c.type for c in self.parser.channels}:
+                return jsonify({"status": "error", "message": f"unknown type: {channel_type}"}), 400
+            try:
+                limit = min(max(int(request.args.get('limit', 5)), 1), self.posts_max_limit)
+                since = float(request.args.get('since', 0))
+            except ValueError:
+                return jsonify({"status": "error", "message": "limit and since must be numbers"}), 400
+            after = None
+            if request.args.get('cursor'):
+                # cursor = next_cursor прошлого ответа: timestamp:канал:номер последнего поста
+                try:
+                    timestamp, channel, post_id = request.args['cursor'].split(':')
+                    since, after = float(timestamp), (channel, int(post_id))
+                except ValueError:
+                    return jsonify({"status": "error", "message": "invalid cursor"}), 400
+            query = request.args.get('q', '').strip()
+            try:
+                filters = self.search_filters(request.args)
+            except ValueError as e:
+                return jsonify({"status": "error", "message": str(e)}), 400
+            
             try:
-                posts = self.parser.get_cached_posts()
-                return jsonify({
-                    "status": "ok",
-                    "count": len(posts),
-                    "posts": [{
-                        "title": p["title"],
-                        "url": p["url"],
-                        "date": p["date"],
-                        "channel": p["channel"]
-                    } for p in posts],
-                    "channels": [c['url'] for c in self.parser.channels]
-                })
+                if self.parser.is_stale():
+                    self.parser.refresh_async()
+                key = (
+                    self.parser.generation(), channel_type, limit, since, after, query, tuple(sorted(filters.items()))
+                )
+                return self.posts_responses.respond(
+                    key, lambda: self.posts_payload(channel_type, limit, since, query, filters, after)
+                )
             except Exception as e:
                 return jsonify({"status": "error", "message": str(e)}), 500
     
+    def home_payload(self) -> Dict:
+        """Данные для страницы статуса"""
+        usage = self.stats.report(list(self.router.buttons))
+        return {
+            "status": "🤖 Cat Bot Running",
+            "time": datetime.now().strftime('%H:%M:%S'),
+            "users": usage['users'],
+            "dau": usage['dau'],
+            "wau": usage['wau'],
+            "messages": usage['messages'],
+            "buttons": usage['buttons'],
+            "channels": [c.url for c in self.parser.channels],
+            "last_update": self.parser.last_update.isoformat() if self.parser.last_update else None,
+            "cache_age": round(self.parser.cache_age(), 1) if self.parser.last_update else None,
+            "last_refresh_duration": round(self.parser.last_refresh_duration, 3) if self.parser.last_refresh_duration is not None else None,
+            "refreshing": self.parser.refresh_lock.locked(),
+            "last_refresh_stats": self.parser.last_refresh_stats,
+            "send_queue": self.outbox.stats(),
+            "subscribers": len(self.subscriptions),
+            "fanout": self.fanout.stats(),
+            "updates": self.updates.stats() if self.updates else None
+        }
+    
+    @staticmethod
+    def search_filters(args) -> Dict:
+        """Фильтры атрибутов /posts: color, sex, sterilized, vaccinated, max_age (месяцы)"""
+        filters = {}
+        for name in ('color', 'sex'):
+            if args.get(name):
+                filters[name] = args[name].lower()
+        for name in ('sterilized', 'vaccinated'):
+            value = args.get(name)
+            if value is None:
+                continue
+            if value.lower() not in ('1', 'true', '0', 'false'):
+                raise ValueError(f"{name} must be true or false")
+            filters[name] = value.lower() in ('1', 'true')
+        if args.get('max_age'):
+            try:
+                filters['max_age'] = float(args['max_age'])
+            except ValueError:
+                raise ValueError("max_age must be a number")
+        return filters
+    
+    def posts_payload(self, channel_type: str, limit: int, since: float,
+                      query: str = '', filters: Optional[Dict] = None,
+                      after: Optional[Tuple[str, int]] = None) -> Dict:
+        """Данные для /posts; next_since и next_cursor — для следующего опроса.
+        
+        Без since — самые новые посты, с since или cursor — следующие по времени (по возрастанию).
+        next_cursor указывает на самый поздний отданный пост и не теряет посты с одинаковым
+        timestamp; next_since — только его timestamp.
+        """
+        if query or filters:
+            posts = self.parser.search_posts(query, channel_type, limit, filters, since, after)
+        else:
+            posts = self.parser.get_cached_posts(channel_type, limit, since, after=after)
+        last = (posts[-1] if since else posts[0]) if posts else None
+        if last:
+            next_since = last.timestamp
+            next_cursor = f"{last.timestamp!r}:{last.channel.username}:{last.id}"
+        else:
+            next_since = since
+            next_cursor = f"{since!r}:{after[0]}:{after[1]}" if after else None
+        return {
+            "status": "ok",
+            "count": len(posts),
+            "posts": [{
+                "id": p.id,
+                "title": p.title,
+                "url": p.url,
+                "date": p.date,
+                "timestamp": p.timestamp,
+                "channel": p.channel.title,
+                "reposts": [url for _, url in p.reposts]
+            } for p in posts],
+            "next_since": next_since,
+            "next_cursor": next_cursor,
+            "channels": [c.url for c in self.parser.channels]
+        }
+    
     def setup_webhook(self) -> bool:
         """Настройка webhook"""
         try:
@@ -653,18 +4169,32 @@ class CatBotWithPhotos:
         """Запуск бота"""
         logger.info("🚀 Запуск CatBot для Ялты...")
         
-        # Предзагрузка постов
-        try:
-            posts = self.parser.get_cached_posts()
-            logger.info(f"✅ Предзагружено {len(posts)} постов")
-        except Exception as e:
-            logger.warning(f"⚠️ Ошибка предзагрузки: {e}")
+        # Предзагрузка постов (если хранилище пустое)
+        if not self.parser.posts_cache:
+            try:
+                self.parser.refresh(force=True)
+                logger.info(f"✅ Предзагружено {len(self.parser.posts_cache)} постов")
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка предзагрузки: {e}")
+        self.parser.start_background_refresh()
         
         if self.setup_webhook():
             self.app.run(host='0.0.0.0', port=self.port)
         else:
             logger.error("🚨 Ошибка webhook, запуск в polling режиме")
-            self.bot.polling()
+            if not self.updates:
+                self.updates = UpdateQueue(self.bot)
+            PollingEngine(self.token, self.updates, self.store).run()
+
+def create_app():
+    """WSGI-фабрика для gunicorn: gunicorn -w 4 'main:create_app()'"""
+    bot = CatBotWithPhotos()
+    bot.parser.start_background_refresh()
+    # Webhook ставит только один воркер из запускаемых одновременно
+    if bot.store.acquire_lease('webhook', bot.parser.worker_id, 60):
+        bot.setup_webhook()
+    return bot.app
+
 
 if __name__ == "__main__":
     # Создаем необходимые папки и файлы, если их нет